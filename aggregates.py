@@ -0,0 +1,317 @@
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+import click
+
+import answered_sets
+import user_stats
+
+try:
+    import fcntl
+except ImportError:  # Windows上没有fcntl，每个进程都会各自定期重建
+    fcntl = None
+
+LOCK_PATH = os.path.join('build', 'aggregates.lock')
+
+# 默认配置，可在app.config中覆盖
+AGGREGATE_DEFAULTS = {
+    'AGGREGATES_REBUILD_INTERVAL': 24 * 3600,
+    # 重建时每个写事务大约处理的答题记录数
+    'AGGREGATES_REBUILD_CHUNK_RECORDS': 10000,
+    'LEADERBOARD_MAX_LIMIT': 100,
+    'QUESTION_STATS_MIN_ATTEMPTS': 5,
+}
+
+# 排行榜排序：答对题数多的在前，相同时答题总数少（正确率高）的在前
+RANK_ORDER = 'correct_answers DESC, total_answers ASC, user_id ASC'
+
+# 与 idx_question_stats_accuracy 索引相同的表达式，查询时才能走索引
+ACCURACY_EXPR = 'CAST(correct AS REAL) / attempts'
+
+
+def record_answers(db, records):
+    """按题目累加一批答题记录的作答次数和答对次数，需在写入answer_records的同一事务中调用
+
+    records 的每一项为 (user_id, question_id, user_answer, is_correct, answered_at)
+    """
+    counters = defaultdict(lambda: [0, 0])
+    for _user_id, question_id, _user_answer, is_correct, _answered_at in records:
+        item = counters[question_id]
+        item[0] += 1
+        item[1] += 1 if is_correct else 0
+
+    db.executemany("""
+        INSERT INTO question_stats (question_id, attempts, correct)
+        VALUES (?, ?, ?)
+        ON CONFLICT(question_id) DO UPDATE SET
+            attempts = attempts + excluded.attempts,
+            correct = correct + excluded.correct
+    """, [(question_id, attempts, correct) for question_id, (attempts, correct) in counters.items()])
+
+
+def delete_user(db, user_id):
+    """删除用户前，从题目统计中减去该用户的答题记录"""
+    rows = db.execute("""
+        SELECT question_id, COUNT(*) AS attempts, SUM(is_correct) AS correct
+        FROM answer_records WHERE user_id = ? GROUP BY question_id
+    """, (user_id,)).fetchall()
+    db.executemany(
+        'UPDATE question_stats SET attempts = MAX(attempts - ?, 0), correct = MAX(correct - ?, 0) '
+        'WHERE question_id = ?',
+        [(row['attempts'], row['correct'] or 0, row['question_id']) for row in rows]
+    )
+
+
+def leaderboard(db, limit=10):
+    """排行榜前limit名，按 idx_user_stats_rank 索引顺序读取"""
+    rows = db.execute(f"""
+        SELECT s.user_id, u.username, s.correct_answers, s.total_answers
+        FROM user_stats s JOIN users u ON u.id = s.user_id
+        WHERE s.total_answers > 0
+        ORDER BY {RANK_ORDER}
+        LIMIT ?
+    """, (limit,)).fetchall()
+    return [
+        {
+            'rank': rank,
+            'user_id': row['user_id'],
+            'username': row['username'],
+            'correct_answers': row['correct_answers'],
+            'total_answers': row['total_answers'],
+            'accuracy': round(row['correct_answers'] / row['total_answers'], 4),
+        }
+        for rank, row in enumerate(rows, 1)
+    ]
+
+
+def user_rank(db, user_id):
+    """用户的名次：排在其前面的人数加一
+
+    计数沿idx_user_stats_rank索引逐行扫描排在前面的用户，开销与名次成正比（O(rank)），
+    不是常数时间；排名靠后的用户较多时应改用分段计数或缓存名次。
+    """
+    row = db.execute(
+        'SELECT correct_answers, total_answers FROM user_stats WHERE user_id = ? AND total_answers > 0',
+        (user_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    ahead = db.execute("""
+        SELECT COUNT(*) FROM user_stats
+        WHERE total_answers > 0 AND (
+            correct_answers > ?
+            OR (correct_answers = ? AND total_answers < ?)
+            OR (correct_answers = ? AND total_answers = ? AND user_id < ?)
+        )
+    """, (row['correct_answers'], row['correct_answers'], row['total_answers'],
+          row['correct_answers'], row['total_answers'], user_id)).fetchone()[0]
+    return {
+        'rank': ahead + 1,
+        'correct_answers': row['correct_answers'],
+        'total_answers': row['total_answers'],
+    }
+
+
+def _question_stats_row(row):
+    return {
+        'question_id': row['question_id'],
+        'question': row['question_text'],
+        'attempts': row['attempts'],
+        'correct': row['correct'],
+        'accuracy': round(row['correct'] / row['attempts'], 4) if row['attempts'] else None,
+    }
+
+
+def question_stats(db, question_id):
+    row = db.execute("""
+        SELECT q.id AS question_id, q.question_text,
+               COALESCE(s.attempts, 0) AS attempts, COALESCE(s.correct, 0) AS correct
+        FROM questions q LEFT JOIN question_stats s ON s.question_id = q.id
+        WHERE q.id = ?
+    """, (question_id,)).fetchone()
+    return _question_stats_row(row) if row else None
+
+
+def hardest_questions(db, limit=10, min_attempts=5, easiest=False):
+    """按正确率排序的题目（默认最难的在前），只统计作答次数不少于min_attempts的题目"""
+    rows = db.execute(f"""
+        SELECT s.question_id, q.question_text, s.attempts, s.correct
+        FROM question_stats s JOIN questions q ON q.id = s.question_id
+        WHERE s.attempts >= ?
+        ORDER BY {ACCURACY_EXPR} {'DESC' if easiest else 'ASC'}
+        LIMIT ?
+    """, (min_attempts, limit)).fetchall()
+    return [_question_stats_row(row) for row in rows]
+
+
+def rebuild_questions(db, first, last):
+    """重新计算 first <= question_id < last 的题目统计，由调用方控制事务，返回题目数"""
+    db.execute('DELETE FROM question_stats WHERE question_id >= ? AND question_id < ?', (first, last))
+    return db.execute("""
+        INSERT INTO question_stats (question_id, attempts, correct)
+        SELECT question_id, COUNT(*), SUM(is_correct) FROM answer_records
+        WHERE question_id >= ? AND question_id < ? GROUP BY question_id
+    """, (first, last)).rowcount
+
+
+def _max_id(db, queries):
+    return max(db.execute(sql).fetchone()[0] or 0 for sql in queries)
+
+
+def _in_chunks(db, last_id, records, chunk_records, func):
+    """按id区间分段执行func，每段一个 BEGIN IMMEDIATE 事务，返回 (合计, 单段最长耗时ms)
+
+    每段的id个数按平均每个id的答题记录数估算，使每段大约处理chunk_records条记录。
+    """
+    chunk_size = max(1, chunk_records * (last_id + 1) // max(records, 1))
+    total, longest = 0, 0.0
+    for first in range(0, last_id + 1, chunk_size):
+        start = time.perf_counter()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            total += func(db, first, first + chunk_size)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        longest = max(longest, (time.perf_counter() - start) * 1000)
+    return total, longest
+
+
+def rebuild(db, chunk_records=10000):
+    """根据answer_records重新计算题目统计、用户统计和答题位图，返回 (题目数, 用户数, 单段最长耗时ms)
+
+    按题目id和用户id分段，每段在一个短的写事务中读取答题记录并覆盖该段的汇总数据，
+    段内结果与当时的答题记录一致；段与段之间答题写入等其他写操作可以照常进行，
+    不会在整个重建期间被阻塞。
+    """
+    if db.in_transaction:
+        db.commit()
+    last_question = _max_id(db, (
+        'SELECT MAX(id) FROM questions',
+        'SELECT MAX(question_id) FROM question_stats',
+        'SELECT MAX(question_id) FROM answer_records',
+    ))
+    last_user = _max_id(db, (
+        'SELECT MAX(id) FROM users',
+        'SELECT MAX(user_id) FROM user_stats',
+        'SELECT MAX(user_id) FROM user_answer_sets',
+        'SELECT MAX(user_id) FROM answer_records',
+        'SELECT MAX(user_id) FROM city_explorations',
+    ))
+    # 自增主键的最大值，作为答题记录数的估计，不必扫描全表
+    records = db.execute('SELECT MAX(id) FROM answer_records').fetchone()[0] or 0
+    questions, question_ms = _in_chunks(db, last_question, records, chunk_records, rebuild_questions)
+
+    def rebuild_users(db, first, last):
+        answered_sets.rebuild_users(db, first, last)
+        return user_stats.rebuild_users(db, first, last)
+
+    users, user_ms = _in_chunks(db, last_user, records, chunk_records, rebuild_users)
+    answered_sets.answer_sets.clear()
+    return questions, users, round(max(question_ms, user_ms), 1)
+
+
+class RebuildJob:
+    """后台定期重建汇总表，修正增量维护中可能出现的偏差
+
+    每个worker在处理第一个请求时启动定时线程（命令行和测试不会启动），但只有拿到文件锁的进程执行重建；
+    锁在该进程存活期间一直持有，它退出后由其他进程在下一个周期接替。
+    """
+
+    def __init__(self, interval=24 * 3600, chunk_records=10000):
+        self.interval = interval
+        self.chunk_records = chunk_records
+        self.lock_path = LOCK_PATH
+        self.last_run = None
+        self.last_duration_ms = None
+        self.last_max_chunk_ms = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._lock_file = None
+        self._lock_pid = None
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        # fork之后子进程需要重新启动自己的定时线程
+        if not self.interval or (self._thread is not None and self._pid == os.getpid()):
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='aggregates-rebuild', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.acquire_lock():
+                self.run_once()
+
+    def acquire_lock(self):
+        """尝试成为负责重建的进程，已持有锁时直接返回True"""
+        if fcntl is None:
+            return True
+        # fork继承来的文件描述符与父进程共享同一把锁，子进程需要自己重新打开
+        if self._lock_file is not None and self._lock_pid == os.getpid():
+            return True
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        lock_file = open(self.lock_path, 'a+b')
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file, self._lock_pid = lock_file, os.getpid()
+        return True
+
+    def run_once(self):
+        from database import get_pool
+        pool = get_pool()
+        db = pool.acquire()
+        start = time.perf_counter()
+        try:
+            _, _, self.last_max_chunk_ms = rebuild(db, self.chunk_records)
+        except Exception as e:
+            self.logger.error(f"汇总统计重建失败: {e}")
+        finally:
+            pool.release(db)
+        self.last_run = time.time()
+        self.last_duration_ms = round((time.perf_counter() - start) * 1000, 1)
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+
+rebuild_job = RebuildJob()
+
+
+def init_app(app):
+    for key, value in AGGREGATE_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    rebuild_job.interval = app.config['AGGREGATES_REBUILD_INTERVAL']
+    rebuild_job.chunk_records = app.config['AGGREGATES_REBUILD_CHUNK_RECORDS']
+    rebuild_job.lock_path = os.path.join(app.root_path, LOCK_PATH)
+    rebuild_job.logger = app.logger
+
+    @app.before_request
+    def start_rebuild_job():
+        # 只在实际处理请求时启动，flask命令行和测试创建应用时不启动后台重建
+        if not app.testing:
+            rebuild_job.start()
+
+
+@user_stats.stats_cli.command('rebuild')
+def rebuild_command():
+    """根据答题记录重建题目统计和排行榜数据"""
+    from database import get_db
+    from flask import current_app
+    questions, users, longest_ms = rebuild(get_db(), current_app.config['AGGREGATES_REBUILD_CHUNK_RECORDS'])
+    click.echo(f'已重建 {questions} 道题目和 {users} 个用户的统计数据，单个写事务最长 {longest_ms} ms')
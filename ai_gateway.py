@@ -0,0 +1,243 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import httpx
+
+from metrics import metrics
+
+logger = logging.getLogger('minpaixinyu.ai')
+
+# 默认配置，可在app.config中覆盖
+GATEWAY_DEFAULTS = {
+    'AI_BASE_URL': 'https://api.deepseek.com/v1',
+    'AI_MODEL': 'deepseek-chat',
+    'AI_CONNECT_TIMEOUT': 5.0,
+    'AI_READ_TIMEOUT': 60.0,
+    'AI_MAX_RETRIES': 2,
+    'AI_RETRY_BACKOFF': 0.5,
+    'AI_MAX_CONNECTIONS': 20,
+    # ASGI模式下异步客户端的连接数上限，等待上游时不占线程，可以远大于同步客户端
+    'AI_ASYNC_MAX_CONNECTIONS': 256,
+    'AI_LOG_SAMPLE_RATE': 0.1,
+}
+
+
+class AIGateway:
+    """AI问答的上游访问入口
+
+    应用启动时创建一次：长期持有一个带连接池的OpenAI客户端（keep-alive复用TLS连接），
+    ai.json只在修改时间变化时重新读取，调用失败按指数退避重试，并输出抽样的结构化日志。
+    """
+
+    def __init__(self, config_path='ai.json', base_url='https://api.deepseek.com/v1', model='deepseek-chat',
+                 connect_timeout=5.0, read_timeout=60.0, max_retries=2, retry_backoff=0.5,
+                 max_connections=20, log_sample_rate=0.1, async_max_connections=256):
+        self.config_path = config_path
+        self.base_url = base_url
+        self.model = model
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.max_connections = max_connections
+        self.log_sample_rate = log_sample_rate
+        self.async_max_connections = async_max_connections
+
+        self._lock = threading.Lock()
+        self._config = None
+        self._config_mtime = None
+        self._client = None
+        self._client_key = None
+        self._pid = None
+        self._async_client = None
+        self._async_key = None
+
+    def _load_config(self):
+        # 每次只做一次stat，文件未修改时直接使用缓存的配置
+        mtime = os.stat(self.config_path).st_mtime_ns
+        if mtime != self._config_mtime:
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            with self._lock:
+                self._config, self._config_mtime = config, mtime
+        return self._config
+
+    def get_client(self):
+        config = self._load_config()
+        key = (config['deepseek_api_key'], config.get('base_url', self.base_url))
+        if self._client is not None and self._client_key == key and self._pid == os.getpid():
+            return self._client
+
+        from openai import OpenAI
+
+        with self._lock:
+            if self._client is None or self._client_key != key or self._pid != os.getpid():
+                http_client = httpx.Client(
+                    timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                    limits=httpx.Limits(max_connections=self.max_connections,
+                                        max_keepalive_connections=self.max_connections),
+                )
+                # 重试由本类控制，关闭SDK自带的重试；旧客户端可能仍有请求在使用，交给垃圾回收关闭
+                self._client = OpenAI(api_key=key[0], base_url=key[1],
+                                      max_retries=0, http_client=http_client)
+                self._client_key = key
+                self._pid = os.getpid()
+        return self._client
+
+    def get_async_client(self):
+        """ASGI模式使用的AsyncOpenAI客户端，与当前事件循环绑定，只能在事件循环线程中调用"""
+        config = self._load_config()
+        key = (config['deepseek_api_key'], config.get('base_url', self.base_url), id(asyncio.get_running_loop()),
+               os.getpid())
+        if self._async_client is None or self._async_key != key:
+            from openai import AsyncOpenAI
+            http_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.async_max_connections,
+                                    max_keepalive_connections=self.async_max_connections),
+            )
+            self._async_client = AsyncOpenAI(api_key=key[0], base_url=key[1],
+                                             max_retries=0, http_client=http_client)
+            self._async_key = key
+        return self._async_client
+
+    def _should_retry(self, error):
+        from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+        return isinstance(error, (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError))
+
+    def _call(self, **kwargs):
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return self.get_client().chat.completions.create(model=self.model, **kwargs), attempt
+            except Exception as e:
+                if attempt > self.max_retries or not self._should_retry(e):
+                    raise
+                delay = self.retry_backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+                self._log(logging.WARNING, 'ai_retry', attempt=attempt, error=type(e).__name__, delay_ms=round(delay * 1000))
+                time.sleep(delay)
+
+    async def _acall(self, **kwargs):
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return await self.get_async_client().chat.completions.create(model=self.model, **kwargs), attempt
+            except Exception as e:
+                if attempt > self.max_retries or not self._should_retry(e):
+                    raise
+                delay = self.retry_backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+                self._log(logging.WARNING, 'ai_retry', attempt=attempt, error=type(e).__name__, delay_ms=round(delay * 1000))
+                await asyncio.sleep(delay)
+
+    def complete(self, messages, **kwargs):
+        """一次性获取完整回答，返回回答文本"""
+        start = time.perf_counter()
+        try:
+            response, attempts = self._call(messages=messages, **kwargs)
+        except Exception as e:
+            metrics.record_ai_call('complete', time.perf_counter() - start, 'error')
+            self._log(logging.ERROR, 'ai_error', error=type(e).__name__, detail=str(e)[:200],
+                      latency_ms=self._elapsed(start))
+            raise
+        metrics.record_ai_call('complete', time.perf_counter() - start)
+        answer = response.choices[0].message.content
+        self._log(logging.INFO, 'ai_complete', sampled=True, attempts=attempts,
+                  latency_ms=self._elapsed(start), question_chars=len(messages[-1]['content']),
+                  answer_chars=len(answer or ''),
+                  tokens=getattr(response.usage, 'total_tokens', None))
+        return answer
+
+    def stream(self, messages, **kwargs):
+        """建立流式请求，返回SDK的Stream对象（可迭代，response.close()取消上游）"""
+        start = time.perf_counter()
+        try:
+            upstream, attempts = self._call(messages=messages, stream=True, **kwargs)
+        except Exception as e:
+            metrics.record_ai_call('stream', time.perf_counter() - start, 'error')
+            self._log(logging.ERROR, 'ai_error', error=type(e).__name__, detail=str(e)[:200],
+                      latency_ms=self._elapsed(start), stream=True)
+            raise
+        metrics.record_ai_call('stream', time.perf_counter() - start)
+        self._log(logging.INFO, 'ai_stream_open', sampled=True, attempts=attempts,
+                  latency_ms=self._elapsed(start), question_chars=len(messages[-1]['content']))
+        return upstream
+
+    async def acomplete(self, messages, **kwargs):
+        """complete 的异步版本"""
+        start = time.perf_counter()
+        try:
+            response, attempts = await self._acall(messages=messages, **kwargs)
+        except Exception as e:
+            metrics.record_ai_call('complete', time.perf_counter() - start, 'error')
+            self._log(logging.ERROR, 'ai_error', error=type(e).__name__, detail=str(e)[:200],
+                      latency_ms=self._elapsed(start), asgi=True)
+            raise
+        metrics.record_ai_call('complete', time.perf_counter() - start)
+        answer = response.choices[0].message.content
+        self._log(logging.INFO, 'ai_complete', sampled=True, attempts=attempts,
+                  latency_ms=self._elapsed(start), question_chars=len(messages[-1]['content']),
+                  answer_chars=len(answer or ''),
+                  tokens=getattr(response.usage, 'total_tokens', None), asgi=True)
+        return answer
+
+    async def astream(self, messages, **kwargs):
+        """stream 的异步版本，返回AsyncStream（async for 迭代，await response.response.aclose() 取消上游）"""
+        start = time.perf_counter()
+        try:
+            upstream, attempts = await self._acall(messages=messages, stream=True, **kwargs)
+        except Exception as e:
+            metrics.record_ai_call('stream', time.perf_counter() - start, 'error')
+            self._log(logging.ERROR, 'ai_error', error=type(e).__name__, detail=str(e)[:200],
+                      latency_ms=self._elapsed(start), stream=True, asgi=True)
+            raise
+        metrics.record_ai_call('stream', time.perf_counter() - start)
+        self._log(logging.INFO, 'ai_stream_open', sampled=True, attempts=attempts,
+                  latency_ms=self._elapsed(start), question_chars=len(messages[-1]['content']), asgi=True)
+        return upstream
+
+    @staticmethod
+    def _elapsed(start):
+        return round((time.perf_counter() - start) * 1000, 1)
+
+    def _log(self, level, event, sampled=False, **fields):
+        # 成功请求按比例抽样记录，错误和重试总是记录
+        if sampled and random.random() >= self.log_sample_rate:
+            return
+        fields['event'] = event
+        logger.log(level, json.dumps(fields, ensure_ascii=False))
+
+    def close(self):
+        if self._client is not None and self._pid == os.getpid():
+            self._client.close()
+        self._client = None
+
+
+gateway = AIGateway()
+
+
+def init_app(app):
+    for key, value in GATEWAY_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    app.config.setdefault('AI_CONFIG_PATH', os.path.join(app.root_path, 'ai.json'))
+    gateway.config_path = app.config['AI_CONFIG_PATH']
+    gateway.base_url = app.config['AI_BASE_URL']
+    gateway.model = app.config['AI_MODEL']
+    gateway.connect_timeout = app.config['AI_CONNECT_TIMEOUT']
+    gateway.read_timeout = app.config['AI_READ_TIMEOUT']
+    gateway.max_retries = app.config['AI_MAX_RETRIES']
+    gateway.retry_backoff = app.config['AI_RETRY_BACKOFF']
+    gateway.max_connections = app.config['AI_MAX_CONNECTIONS']
+    gateway.async_max_connections = app.config['AI_ASYNC_MAX_CONNECTIONS']
+    gateway.log_sample_rate = app.config['AI_LOG_SAMPLE_RATE']
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
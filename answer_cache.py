@@ -0,0 +1,315 @@
+import math
+import re
+import threading
+import time
+import unicodedata
+from contextlib import contextmanager
+
+from city_index import city_index
+from database import get_pool
+
+try:
+    import opencc
+    _t2s = opencc.OpenCC('t2s').convert
+except ImportError:  # 未安装opencc时使用内置的常用繁简对照表
+    _t2s = None
+
+# 常用繁体字到简体字的对照（覆盖福建文化相关问答中常见的字）
+TRADITIONAL_CHARS = (
+    '為麼甚這個們來時會與學點華寧蓮灣興區縣鄉傳統藝術戲劇廟寶專業紀現經濟關係對麗觀遊戰爭軍記話語讀書號稱裏裡誰'
+    '歷東門龍陽廈樓產發國說見長開問題還沒讓從後過頭體麵條種樣萬實應該當處動於這邊幾難聽寫邊風雲島閩漢僑鄭臺'
+    '橋塔廣場館園莊鎮陳縣區劃誌譜禮節慶飲餚飯餅燈團圓葉蘭鳥魚貨幣價錢買賣歲數鐘錶媽祖廈鼓嶼嶺巖請嗎'
+)
+SIMPLIFIED_CHARS = (
+    '为么甚这个们来时会与学点华宁莲湾兴区县乡传统艺术戏剧庙宝专业纪现经济关系对丽观游战争军记话语读书号称里里谁'
+    '历东门龙阳厦楼产发国说见长开问题还没让从后过头体面条种样万实应该当处动于这边几难听写边风云岛闽汉侨郑台'
+    '桥塔广场馆园庄镇陈县区划志谱礼节庆饮肴饭饼灯团圆叶兰鸟鱼货币价钱买卖岁数钟表妈祖厦鼓屿岭岩请吗'
+)
+_T2S_TABLE = str.maketrans(TRADITIONAL_CHARS, SIMPLIFIED_CHARS)
+
+_IGNORED = re.compile(r'[\s\W_]+', re.UNICODE)
+# 句首的礼貌用语和句末的语气词不影响问题含义
+_FILLERS = re.compile(r'^(请问|你好|您好|请)+|(呢|吗|呀|啊|吧)+$')
+_NUMBERS = re.compile(r'\d+')
+
+# 福建九个设区市；只差一个地名的两个问题字面上很相似，答案却完全不同
+FUJIAN_CITIES = ('福州', '厦门', '泉州', '漳州', '莆田', '三明', '南平', '龙岩', '宁德')
+# 短于该长度的问题只做精确匹配
+MIN_SIMILAR_LENGTH = 4
+
+# 默认配置，可在app.config中覆盖
+CACHE_DEFAULTS = {
+    'ANSWER_CACHE_ENABLED': True,
+    'ANSWER_CACHE_TTL': 7 * 24 * 3600,
+    'ANSWER_CACHE_MAX_ENTRIES': 5000,
+    'ANSWER_CACHE_SIMILARITY': 0.8,
+    # 不超过该长度的问题改用更严格的相似度阈值
+    'ANSWER_CACHE_SHORT_KEY_LENGTH': 12,
+    'ANSWER_CACHE_SHORT_SIMILARITY': 0.9,
+}
+
+
+def normalize_question(question):
+    """统一全角/半角、繁简体、大小写，并去掉空白、标点和语气词"""
+    text = unicodedata.normalize('NFKC', question).lower()
+    text = _t2s(text) if _t2s else text.translate(_T2S_TABLE)
+    text = _IGNORED.sub('', text)
+    return _FILLERS.sub('', text) or text
+
+
+def known_cities():
+    return set(FUJIAN_CITIES).union(city_index.cities())
+
+
+def question_entities(key, cities=None):
+    """归一化后的问题中提到的城市名和数字，近似命中要求两边完全一致"""
+    cities = known_cities() if cities is None else cities
+    return frozenset(city for city in cities if city in key) | frozenset(_NUMBERS.findall(key))
+
+
+@contextmanager
+def _connection(db):
+    # 请求中使用调用方已持有的连接，不在同一请求内再占用一个连接池连接
+    if db is not None:
+        yield db
+        return
+    pool = get_pool()
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+def char_ngrams(text, n=2):
+    if len(text) < n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class NgramIndex:
+    """字符二元组倒排索引，用于查找与问题最相近的已缓存问题（集合余弦相似度）"""
+
+    def __init__(self):
+        self._postings = {}
+        self._sizes = {}
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def __contains__(self, key):
+        return key in self._sizes
+
+    def add(self, key):
+        if key in self._sizes:
+            return
+        grams = char_ngrams(key)
+        self._sizes[key] = len(grams)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(key)
+
+    def remove(self, key):
+        if self._sizes.pop(key, None) is None:
+            return
+        for gram in char_ngrams(key):
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+
+    def best_match(self, key, accept=None):
+        """返回相似度最高的已缓存问题及其得分；给出accept时跳过不满足条件的候选"""
+        grams = char_ngrams(key)
+        if not grams:
+            return None, 0.0
+        overlaps = {}
+        for gram in grams:
+            for candidate in self._postings.get(gram, ()):
+                overlaps[candidate] = overlaps.get(candidate, 0) + 1
+        best, best_score = None, 0.0
+        for candidate, overlap in overlaps.items():
+            score = overlap / math.sqrt(len(grams) * self._sizes[candidate])
+            if score > best_score and (accept is None or accept(candidate)):
+                best, best_score = candidate, score
+        return best, best_score
+
+
+class AnswerCache:
+    """AI回答缓存
+
+    问题归一化后在SQLite表ai_answer_cache中精确查找（带TTL和按最近命中时间的LRU淘汰），
+    未命中时可再用进程内的n-gram索引查找相似度超过阈值的已缓存问题，
+    近似命中要求两个问题提到的城市和数字完全相同，短问题使用更严格的阈值。
+    """
+
+    def __init__(self, ttl=7 * 24 * 3600, max_entries=5000, similarity=0.8, enabled=True,
+                 refresh_interval=5.0, short_key_length=12, short_similarity=0.9):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.short_key_length = short_key_length
+        self.short_similarity = short_similarity
+        self.enabled = enabled
+        self.refresh_interval = refresh_interval
+
+        self._lock = threading.Lock()
+        self._index = NgramIndex()
+        self._last_rowid = 0
+        self._last_refresh = 0.0
+        self._inserts = 0
+        self._upstream_ms = None
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+
+    def _refresh_index(self, db):
+        # 增量加载其他进程新写入的问题
+        now = time.monotonic()
+        if now - self._last_refresh < self.refresh_interval:
+            return
+        rows = db.execute(
+            'SELECT rowid, question_key FROM ai_answer_cache WHERE rowid > ? ORDER BY rowid',
+            (self._last_rowid,)
+        ).fetchall()
+        with self._lock:
+            for row in rows:
+                self._index.add(row['question_key'])
+                self._last_rowid = max(self._last_rowid, row['rowid'])
+            self._last_refresh = now
+
+    def _fetch(self, db, key, now):
+        row = db.execute(
+            'SELECT answer, created_at, last_hit_at FROM ai_answer_cache WHERE question_key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if now - row['created_at'] > self.ttl:
+            db.execute('DELETE FROM ai_answer_cache WHERE question_key = ?', (key,))
+            db.commit()
+            return None
+        # LRU只需要粗略的最近命中时间，一分钟内的重复命中不再写库
+        if now - row['last_hit_at'] > 60:
+            db.execute(
+                'UPDATE ai_answer_cache SET last_hit_at = ?, hits = hits + 1 WHERE question_key = ?',
+                (now, key)
+            )
+            db.commit()
+        return row['answer']
+
+    def lookup(self, question, db=None):
+        """返回缓存的回答，未命中返回None
+
+        db为调用方已持有的连接（请求中为get_db()），为None时临时从连接池取一个。
+        """
+        if not self.enabled:
+            return None
+        key = normalize_question(question)
+        if not key:
+            return None
+        now = time.time()
+        with _connection(db) as db:
+            answer = self._fetch(db, key, now)
+            kind = 'exact'
+            if answer is None and self.similarity and len(key) >= MIN_SIMILAR_LENGTH:
+                self._refresh_index(db)
+                threshold = self.similarity
+                if len(key) <= self.short_key_length:
+                    threshold = max(threshold, self.short_similarity)
+                cities = known_cities()
+                entities = question_entities(key, cities)
+                with self._lock:
+                    match, score = self._index.best_match(
+                        key, accept=lambda candidate: question_entities(candidate, cities) == entities)
+                if match is not None and score >= threshold:
+                    answer = self._fetch(db, match, now)
+                    kind = 'similar'
+                    if answer is None:
+                        with self._lock:
+                            self._index.remove(match)
+
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                if kind == 'exact':
+                    self.exact_hits += 1
+                else:
+                    self.similar_hits += 1
+                if self._upstream_ms is not None:
+                    self.saved_ms += self._upstream_ms
+        return answer
+
+    def record_upstream_latency(self, elapsed_ms):
+        # 用上游调用耗时的滑动平均估算每次命中节省的时间
+        with self._lock:
+            if self._upstream_ms is None:
+                self._upstream_ms = elapsed_ms
+            else:
+                self._upstream_ms = 0.9 * self._upstream_ms + 0.1 * elapsed_ms
+
+    def store(self, question, answer, db=None):
+        if not self.enabled or not answer:
+            return
+        key = normalize_question(question)
+        if not key:
+            return
+        now = time.time()
+        with _connection(db) as db:
+            with db:
+                db.execute("""
+                    INSERT INTO ai_answer_cache (question_key, question, answer, created_at, last_hit_at, hits)
+                    VALUES (?, ?, ?, ?, ?, 0)
+                    ON CONFLICT(question_key) DO UPDATE SET
+                        answer = excluded.answer,
+                        created_at = excluded.created_at,
+                        last_hit_at = excluded.last_hit_at
+                """, (key, question, answer, now, now))
+            with self._lock:
+                self._index.add(key)
+                self._inserts += 1
+                evict = self._inserts % 100 == 0
+            if evict:
+                self.evict(db, now)
+
+    def evict(self, db, now=None):
+        """删除过期记录，并按最近命中时间淘汰超出容量的部分"""
+        now = now or time.time()
+        with db:
+            db.execute('DELETE FROM ai_answer_cache WHERE created_at < ?', (now - self.ttl,))
+            db.execute("""
+                DELETE FROM ai_answer_cache WHERE question_key IN (
+                    SELECT question_key FROM ai_answer_cache
+                    ORDER BY last_hit_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.similar_hits
+            total = hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'exact_hits': self.exact_hits,
+                'similar_hits': self.similar_hits,
+                'misses': self.misses,
+                'hit_rate': round(hits / total, 4) if total else 0.0,
+                'avg_upstream_ms': round(self._upstream_ms, 1) if self._upstream_ms is not None else None,
+                'saved_ms': round(self.saved_ms, 1),
+                'indexed_questions': len(self._index),
+            }
+
+
+answer_cache = AnswerCache()
+
+
+def init_app(app):
+    for key, value in CACHE_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    answer_cache.enabled = app.config['ANSWER_CACHE_ENABLED']
+    answer_cache.ttl = app.config['ANSWER_CACHE_TTL']
+    answer_cache.max_entries = app.config['ANSWER_CACHE_MAX_ENTRIES']
+    answer_cache.similarity = app.config['ANSWER_CACHE_SIMILARITY']
+    answer_cache.short_key_length = app.config['ANSWER_CACHE_SHORT_KEY_LENGTH']
+    answer_cache.short_similarity = app.config['ANSWER_CACHE_SHORT_SIMILARITY']
@@ -0,0 +1,179 @@
+import atexit
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from database import get_pool
+import aggregates
+import answered_sets
+import user_stats
+
+# 默认配置，可在app.config中覆盖
+WRITER_DEFAULTS = {
+    'ANSWER_WRITER_SYNC': False,
+    'ANSWER_WRITER_BATCH_SIZE': 200,
+    'ANSWER_WRITER_FLUSH_INTERVAL': 0.5,
+}
+
+INSERT_SQL = (
+    'INSERT INTO answer_records (user_id, question_id, user_answer, is_correct, answered_at) '
+    'VALUES (?, ?, ?, ?, ?)'
+)
+
+# 由记录本身的数据引起、重试也不会成功的错误；其余sqlite3.Error（如数据库被锁）视为暂时性错误
+DATA_ERRORS = (sqlite3.IntegrityError, sqlite3.ProgrammingError, sqlite3.InterfaceError, TypeError, ValueError)
+
+
+class AnswerWriter:
+    """答题记录的批量异步写入器
+
+    答题记录先放入进程内缓冲区，由后台线程在攒够 batch_size 条或距离上次写入
+    超过 flush_interval 秒时，合并为一个事务写入，进程退出时保证全部落盘。
+    sync=True 时每条记录立即写入，方便测试和脚本使用。
+    同步写入和flush可以传入调用方已持有的连接（请求中为get_db()），避免一个请求同时占用两个连接，
+    连接池用尽时互相等待。
+    某条记录本身有问题导致整批写入失败时，逐条重写以找出这条记录并丢弃，
+    其余记录照常写入；数据库暂时不可写时整批放回缓冲区等待重试。
+    """
+
+    def __init__(self, batch_size=200, flush_interval=0.5, sync=False):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sync = sync
+
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._thread = None
+        self._pid = None
+        self._closed = False
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.dropped = 0
+        self.logger = logging.getLogger(__name__)
+
+    def submit(self, user_id, question_id, user_answer, is_correct, db=None):
+        record = (user_id, question_id, user_answer, int(bool(is_correct)),
+                  datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'))
+        if self.sync or self._closed:
+            self._write([record], db)
+            return
+
+        self._ensure_thread()
+        with self._cond:
+            self._pending.append(record)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def _ensure_thread(self):
+        # fork之后子进程需要重新启动自己的写入线程
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._pending = []
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='answer-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                if self._closed and not self._pending:
+                    return
+            self.flush()
+
+    def flush(self, db=None):
+        """把缓冲区中的记录一次性写入数据库，db为None时从连接池取一个连接"""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+            if batch:
+                self._write(batch, db)
+
+    def _write(self, batch, db=None):
+        pool = None
+        if db is None:
+            pool = get_pool()
+            db = pool.acquire()
+        # 尚未提交的记录；逐条重写时每条单独提交，中途出现暂时性错误只放回其余部分
+        remaining = batch
+        try:
+            try:
+                self._insert(db, batch)
+            except DATA_ERRORS as e:
+                if len(batch) == 1:
+                    self._drop(batch[0], e)
+                else:
+                    # 逐条重写，只丢弃出错的记录
+                    for i, record in enumerate(batch):
+                        remaining = batch[i:]
+                        try:
+                            self._insert(db, [record])
+                        except DATA_ERRORS as e:
+                            self._drop(record, e)
+            remaining = []
+            self.batches += 1
+        except sqlite3.Error as e:
+            self.errors += 1
+            self.logger.warning(f"答题记录写入失败({len(remaining)}条): {e}")
+            if not self.sync and not self._closed:
+                # 放回缓冲区，等待下一次写入重试
+                with self._cond:
+                    self._pending[:0] = remaining
+        finally:
+            if pool is not None:
+                pool.release(db)
+
+    def _drop(self, record, error):
+        self.errors += 1
+        self.dropped += 1
+        self.logger.error(f"答题记录无效，已丢弃: {record!r}: {error}")
+
+    def _insert(self, db, batch):
+        with db:
+            db.executemany(INSERT_SQL, batch)
+            user_stats.record_answers(db, batch)
+            aggregates.record_answers(db, batch)
+            answered_sets.record_answers(db, batch)
+        self.written += len(batch)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid() and thread.is_alive():
+            thread.join(timeout=10)
+        self.flush()
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            'sync': self.sync,
+            'pending': pending,
+            'written': self.written,
+            'batches': self.batches,
+            'errors': self.errors,
+            'dropped': self.dropped,
+        }
+
+
+answer_writer = AnswerWriter()
+
+
+def init_app(app):
+    for key, value in WRITER_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    answer_writer.batch_size = app.config['ANSWER_WRITER_BATCH_SIZE']
+    answer_writer.flush_interval = app.config['ANSWER_WRITER_FLUSH_INTERVAL']
+    answer_writer.sync = app.config['ANSWER_WRITER_SYNC']
+    answer_writer.logger = app.logger
+    atexit.register(answer_writer.close)
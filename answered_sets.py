@@ -0,0 +1,272 @@
+import threading
+import zlib
+from collections import OrderedDict, defaultdict
+
+# 默认配置，可在app.config中覆盖
+ANSWERED_SET_DEFAULTS = {
+    'QUIZ_REVIEW_RATIO': 0.3,
+    'ANSWERED_SET_CACHE_SIZE': 2000,
+}
+
+
+class Bitset:
+    """按题目id编址的位图，第id位为1表示集合中包含该题"""
+
+    __slots__ = ('bits',)
+
+    def __init__(self, bits=None):
+        self.bits = bits if bits is not None else bytearray()
+
+    def __contains__(self, question_id):
+        index = question_id >> 3
+        return index < len(self.bits) and bool(self.bits[index] & (1 << (question_id & 7)))
+
+    def add(self, question_id):
+        index = question_id >> 3
+        if index >= len(self.bits):
+            # 按4KB对齐扩容，避免题目id递增时频繁重新分配
+            self.bits.extend(bytes(((index >> 12) + 1 << 12) - len(self.bits)))
+        self.bits[index] |= 1 << (question_id & 7)
+
+    def discard(self, question_id):
+        index = question_id >> 3
+        if index < len(self.bits):
+            self.bits[index] &= ~(1 << (question_id & 7)) & 0xFF
+
+    def __iter__(self):
+        for index, byte in enumerate(self.bits):
+            while byte:
+                low = byte & -byte
+                yield (index << 3) + low.bit_length() - 1
+                byte ^= low
+
+    def count(self):
+        return sum(bin(byte).count('1') for byte in self.bits)
+
+    def to_blob(self):
+        # 大部分用户只答过少量题目，位图中多为0，压缩后通常只有几十到几百字节
+        return zlib.compress(bytes(self.bits.rstrip(b'\x00')), 1)
+
+    @classmethod
+    def from_blob(cls, blob):
+        return cls(bytearray(zlib.decompress(blob)) if blob else bytearray())
+
+
+class AnswerSet:
+    """一个用户答过的题目和最近一次答错的题目"""
+
+    __slots__ = ('answered', 'wrong', 'wrong_ids', 'version')
+
+    def __init__(self, answered=None, wrong=None, version=0):
+        self.answered = answered or Bitset()
+        self.wrong = wrong or Bitset()
+        self.version = version
+        # 错题数量通常不多，展开成列表便于随机抽取
+        self.wrong_ids = list(self.wrong)
+
+    def record(self, question_id, is_correct):
+        self.answered.add(question_id)
+        if is_correct:
+            if question_id in self.wrong:
+                self.wrong.discard(question_id)
+                self.wrong_ids.remove(question_id)
+        elif question_id not in self.wrong:
+            self.wrong.add(question_id)
+            self.wrong_ids.append(question_id)
+
+    def prune(self, known):
+        """从错题中去掉已不在题库中的题目（known支持 in 判断），返回去掉的数量"""
+        stale = [question_id for question_id in self.wrong_ids if question_id not in known]
+        for question_id in stale:
+            self.wrong.discard(question_id)
+            self.wrong_ids.remove(question_id)
+        return len(stale)
+
+    def choose(self, candidates, k, review_ratio, rng, max_tries=None, known=None):
+        """从题目id数组中挑选k道题：一部分复习错题，其余优先没做过的题，不足时用做过的题补齐
+
+        没做过的题用拒绝采样挑选，期望尝试次数只取决于没做过的题所占比例，与答题历史长短无关。
+        错题只从仍在candidates中的题目里挑选：known是与candidates内容相同、支持快速 in 判断的容器，
+        不提供时临时建一个集合。抽到已删除的错题时先从错题中去掉这些题，再重新抽取。
+        """
+        if not candidates:
+            return []
+        k = min(k, len(candidates))
+        chosen = []
+        seen = set()
+
+        if self.wrong_ids and review_ratio:
+            known = known if known is not None else set(candidates)
+            review = rng.sample(self.wrong_ids, min(len(self.wrong_ids), int(round(k * review_ratio))))
+            if any(question_id not in known for question_id in review):
+                self.prune(known)
+                review = rng.sample(self.wrong_ids, min(len(self.wrong_ids), len(review)))
+            for question_id in review:
+                chosen.append(question_id)
+                seen.add(question_id)
+
+        answered_fallback = []
+        tries = max_tries or k * 20
+        while len(chosen) < k and tries > 0:
+            tries -= 1
+            question_id = candidates[rng.randrange(len(candidates))]
+            if question_id in seen:
+                continue
+            seen.add(question_id)
+            if question_id in self.answered:
+                answered_fallback.append(question_id)
+            else:
+                chosen.append(question_id)
+
+        # 几乎全部做过时，先补错题再补做过的题
+        if len(chosen) < k and self.wrong_ids:
+            self.prune(known if known is not None else set(candidates))
+        tries = len(self.wrong_ids) and k * 20
+        while len(chosen) < k and tries > 0:
+            tries -= 1
+            question_id = self.wrong_ids[rng.randrange(len(self.wrong_ids))]
+            if question_id not in seen:
+                chosen.append(question_id)
+                seen.add(question_id)
+        while len(chosen) < k and answered_fallback:
+            chosen.append(answered_fallback.pop())
+        while len(chosen) < k:
+            question_id = candidates[rng.randrange(len(candidates))]
+            if question_id not in seen:
+                chosen.append(question_id)
+                seen.add(question_id)
+        rng.shuffle(chosen)
+        return chosen
+
+
+def load(db, user_id):
+    row = db.execute(
+        'SELECT answered, wrong, version FROM user_answer_sets WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    if row is None:
+        return AnswerSet()
+    return AnswerSet(Bitset.from_blob(row['answered']), Bitset.from_blob(row['wrong']), row['version'])
+
+
+def save(db, user_id, answer_set):
+    db.execute("""
+        INSERT INTO user_answer_sets (user_id, answered, wrong, version)
+        VALUES (?, ?, ?, 1)
+        ON CONFLICT(user_id) DO UPDATE SET
+            answered = excluded.answered,
+            wrong = excluded.wrong,
+            version = version + 1
+    """, (user_id, answer_set.answered.to_blob(), answer_set.wrong.to_blob()))
+
+
+def record_answers(db, records):
+    """把一批答题记录合并进各用户的位图，需在写入answer_records的同一事务中调用
+
+    records 的每一项为 (user_id, question_id, user_answer, is_correct, answered_at)，按时间顺序排列
+    """
+    by_user = defaultdict(list)
+    for user_id, question_id, _user_answer, is_correct, _answered_at in records:
+        by_user[user_id].append((question_id, is_correct))
+    for user_id, answers in by_user.items():
+        answer_set = load(db, user_id)
+        for question_id, is_correct in answers:
+            answer_set.record(question_id, is_correct)
+        save(db, user_id, answer_set)
+
+
+def delete_user(db, user_id):
+    db.execute('DELETE FROM user_answer_sets WHERE user_id = ?', (user_id,))
+    answer_sets.invalidate(user_id)
+
+
+def backfill(db):
+    """根据answer_records重建全部用户的位图（按用户逐个处理，内存占用与用户数无关）"""
+    count = _rebuild(db, '', ())
+    answer_sets.clear()
+    return count
+
+
+def rebuild_users(db, first, last):
+    """重建 first <= user_id < last 的用户位图，由调用方控制事务"""
+    return _rebuild(db, 'WHERE user_id >= ? AND user_id < ?', (first, last))
+
+
+def _rebuild(db, where, params):
+    # 逐个覆盖写入（版本号递增，其他进程缓存的位图随之失效），最后删除已没有答题记录的用户；
+    # 已删除题目的答题记录不再计入，错题中残留的题目随重建清除
+    saved = set()
+    current_user, answer_set = None, None
+    for row in db.execute(f"""
+        SELECT user_id, question_id, is_correct FROM answer_records {where}
+        {'AND' if where else 'WHERE'} question_id IN (SELECT id FROM questions)
+        ORDER BY user_id, id
+    """, params):
+        if row['user_id'] != current_user:
+            if answer_set is not None:
+                save(db, current_user, answer_set)
+                saved.add(current_user)
+            current_user, answer_set = row['user_id'], AnswerSet()
+        answer_set.record(row['question_id'], row['is_correct'])
+    if answer_set is not None:
+        save(db, current_user, answer_set)
+        saved.add(current_user)
+    stale = [row[0] for row in db.execute(f'SELECT user_id FROM user_answer_sets {where}', params)
+             if row[0] not in saved]
+    db.executemany('DELETE FROM user_answer_sets WHERE user_id = ?', [(user_id,) for user_id in stale])
+    return len(saved)
+
+
+class AnswerSetCache:
+    """进程内的用户位图LRU缓存，每次使用前比对数据库中的版本号，只有变化时才重新读取位图"""
+
+    def __init__(self, max_entries=2000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, db, user_id):
+        row = db.execute('SELECT version FROM user_answer_sets WHERE user_id = ?', (user_id,)).fetchone()
+        version = row[0] if row else 0
+        with self._lock:
+            answer_set = self._entries.get(user_id)
+            if answer_set is not None and answer_set.version == version:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return answer_set
+            self.misses += 1
+        answer_set = load(db, user_id)
+        with self._lock:
+            self._entries[user_id] = answer_set
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return answer_set
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+answer_sets = AnswerSetCache()
+
+
+def init_app(app):
+    for key, value in ANSWERED_SET_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    answer_sets.max_entries = app.config['ANSWERED_SET_CACHE_SIZE']
@@ -1,7 +1,11 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, g, send_file
+from flask import Flask, render_template, request, jsonify, redirect, url_for, g, send_file, make_response, Response
 import sqlite3
 import os
+import json
+import threading
+import time
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import wrap_file
 import io
 
 app = Flask(__name__)
@@ -14,43 +18,68 @@ def allowed_file(filename):
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 # 初始化数据库
-from database import get_db, init_app
-
+from database import get_db, get_pool_stats, release_db, init_app
+from metrics import metrics, stats_endpoint, init_app as init_metrics
+from question_sampler import sampler as question_sampler
+from question_cache import question_cache
+from answer_writer import answer_writer, init_app as init_answer_writer
+import user_stats
+import aggregates
+import answered_sets
+import explorations
+import user_context
+from user_context import current_user, login_required
+import request_limits
+from request_limits import concurrency_limited, rate_limited
+import avatar_store
+import geo_assets
+import questions_io
+from question_snapshot import question_store, init_app as init_question_snapshot
+from ai_gateway import gateway as ai_gateway, init_app as init_ai_gateway
+from answer_cache import answer_cache, init_app as init_answer_cache
+from city_index import city_index, init_app as init_city_index
+from pdf_assets import pdf_assets, init_app as init_pdf_assets
+from page_images import page_images, init_app as init_page_images
+from render_cache import render_cache, city_names, init_app as init_render_cache
+
+init_metrics(app)
 init_app(app)
-
-# 检查并添加必要的字段
-with app.app_context():
-    db = get_db()
-    cursor = db.cursor()
-    
-    # 检查用户表是否存在avatar_blob字段
-    cursor.execute("PRAGMA table_info(users)")
-    columns = [column[1] for column in cursor.fetchall()]
-    if 'avatar_blob' not in columns:
-        cursor.execute("ALTER TABLE users ADD COLUMN avatar_blob BLOB")
-        db.commit()
-    
-    # 检查是否存在地区探索记录表
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='city_explorations'")
-    if not cursor.fetchone():
-        cursor.execute("""
-            CREATE TABLE city_explorations (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                city_name TEXT NOT NULL,
-                explored_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id),
-                UNIQUE(user_id, city_name)
-            )
-        """)
-        db.commit()
+init_answer_writer(app)
+user_stats.init_app(app)
+aggregates.init_app(app)
+answered_sets.init_app(app)
+user_context.init_app(app)
+request_limits.init_app(app)
+geo_assets.init_app(app)
+questions_io.init_app(app)
+init_question_snapshot(app)
+init_ai_gateway(app)
+init_answer_cache(app)
+init_city_index(app)
+init_pdf_assets(app)
+init_page_images(app)
+init_render_cache(app)
+
+# /metrics 中一并输出各组件的运行统计
+metrics.register_collector('db_pool', get_pool_stats)
+metrics.register_collector('question_cache', question_cache.stats)
+metrics.register_collector('question_snapshot', question_store.stats)
+metrics.register_collector('answer_writer', answer_writer.stats)
+metrics.register_collector('answer_cache', answer_cache.stats)
+metrics.register_collector('answered_sets', answered_sets.answer_sets.stats)
+metrics.register_collector('render_cache', render_cache.stats)
+metrics.register_collector('user_cache', user_context.user_cache.stats)
+metrics.register_collector('rate_limit', request_limits.limiter.stats)
+
+# 已有详情页的城市，只允许渲染这些模板
+CITY_NAMES = city_names(app.root_path)
 
 # ===== 用户认证相关路由 =====
 @app.route('/upload-avatar', methods=['POST'])
+@app.route('/api/upload-avatar', methods=['POST'])
+@login_required(error='用户未登录')
+@rate_limited('upload_avatar')
 def upload_avatar():
-    if 'user_id' not in session:
-        return jsonify({'error': '用户未登录'}), 401
-    
     if 'avatar' not in request.files:
         return jsonify({'error': '未选择文件'}), 400
     
@@ -61,52 +90,74 @@ def upload_avatar():
     if not allowed_file(file.filename):
         return jsonify({'error': '不支持的文件类型，仅允许png, jpg, jpeg, gif'}), 400
     
-    avatar_blob = file.read()
-    
-    if len(avatar_blob) > 2 * 1024 * 1024:
-        return jsonify({'error': '文件大小不能超过2MB'}), 400
+    try:
+        # 分块读取，超过大小上限时立即停止
+        avatar_blob = avatar_store.read_upload(file)
+    except avatar_store.AvatarError as e:
+        return jsonify({'error': str(e)}), 400
     
     if len(avatar_blob) == 0:
         return jsonify({'error': '文件内容为空，请选择有效的图片文件'}), 400
     
+    db = get_db()
     try:
-        db = get_db()
-        db.execute('UPDATE users SET avatar_blob = ? WHERE id = ?', (avatar_blob, session['user_id']))
+        # 引用计数必须准确，旧头像从数据库重新读取而不是用缓存
+        old = user_context.load_user(refresh=True)
+        if old is None:
+            return jsonify({'error': '用户未登录'}), 401
+        digest = avatar_store.store_avatar(db, avatar_blob)
+        db.execute('UPDATE users SET avatar_hash = ?, avatar_blob = NULL WHERE id = ?', (digest, old.id))
+        if old.avatar_hash != digest:
+            avatar_store.release_avatar(db, old.avatar_hash)
         db.commit()
+        user_context.invalidate_user(old.id)
         return jsonify({'success': True})
+    except avatar_store.AvatarError as e:
+        return jsonify({'error': str(e)}), 400
     except sqlite3.Error as e:
         db.rollback()
         return jsonify({'error': f'数据库错误: {str(e)}'}), 500
 
 @app.route('/get-avatar')
 def get_avatar():
-    if 'user_id' not in session:
+    if not current_user:
         return '', 401
     
-    db = get_db()
-    user = db.execute('SELECT avatar_blob FROM users WHERE id = ?', (session['user_id'],)).fetchone()
+    variant = request.args.get('size', 'original')
+    if variant not in avatar_store.VARIANTS:
+        variant = 'original'
     
-    if user and user['avatar_blob']:
-        return user['avatar_blob'], 200, {'Content-Type': 'image/jpeg'}
+    if current_user.avatar_hash:
+        # 跳转到内容寻址的地址，浏览器可以长期缓存
+        response = redirect(url_for('serve_avatar', digest=current_user.avatar_hash, variant=variant))
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
     
     # 返回默认头像
-    default_avatar_path = os.path.join(app.root_path, 'static', 'images', 'default.png')
-    try:
-        with open(default_avatar_path, 'rb') as f:
-            default_avatar = f.read()
-        return default_avatar, 200, {'Content-Type': 'image/png'}
-    except FileNotFoundError:
-        # 如果没有默认头像文件，返回一个简单的SVG占位符头像
-        svg_avatar = '''
-        <svg width="100" height="100" xmlns="http://www.w3.org/2000/svg">
-            <circle cx="50" cy="50" r="40" fill="#8B7355"/>
-            <circle cx="50" cy="40" r="15" fill="#D2B48C"/>
-            <circle cx="40" cy="35" r="3" fill="white"/>
-            <circle cx="60" cy="35" r="3" fill="white"/>
-            <path d="M35,65 Q50,75 65,65" stroke="white" stroke-width="2" fill="none"/>
-        </svg>
-        '''.strip().encode('utf-8')
-        return svg_avatar, 200, {'Content-Type': 'image/svg+xml'}
+    content_type, data, etag = avatar_store.get_default_avatar(app.root_path)
+    response = make_response(data)
+    response.headers['Content-Type'] = content_type
+    response.headers['Cache-Control'] = 'private, max-age=3600'
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+@app.route('/avatars/<digest>/<variant>')
+def serve_avatar(digest, variant):
+    if variant not in avatar_store.VARIANTS:
+        return '', 404
+    
+    etag = f'{digest}-{variant}'
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        avatar = avatar_store.load_avatar(get_db(), digest, variant)
+        if avatar is None:
+            return '', 404
+        response = make_response(avatar[1])
+        response.headers['Content-Type'] = avatar[0]
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -115,19 +166,19 @@ def login():
         password = request.form['password']
         db = get_db()
         user = db.execute(
-            'SELECT * FROM users WHERE username = ?', (username,)
+            f'SELECT {user_context.USER_COLUMNS} FROM users WHERE username = ?', (username,)
         ).fetchone()
         
         if user is None:
             return render_template('auth/login.html', error='用户不存在'), 401
         if user['password'] == password:
-            session['user_id'] = user['id']
-            session['username'] = user['username']
+            user_context.login_user(user_context.CurrentUser.from_row(user))
             return redirect(url_for('index'))
         return render_template('auth/login.html', error='密码错误'), 401
     return render_template('auth/login.html')
 
 @app.route('/register', methods=['GET', 'POST'])
+@rate_limited('register', methods=('POST',), as_text=True)
 def register():
     if request.method == 'POST':
         def calculate_username_length(username):
@@ -150,15 +201,22 @@ def register():
         if avatar and avatar.filename:
             if not allowed_file(avatar.filename):
                 return '不支持的文件类型，仅允许png, jpg, jpeg, gif', 400
-            avatar_blob = avatar.read()
-            if len(avatar_blob) > 2 * 1024 * 1024:
-                return '文件大小不能超过2MB', 400
+            try:
+                avatar_blob = avatar_store.read_upload(avatar)
+            except avatar_store.AvatarError as e:
+                return str(e), 400
         
         db = get_db()
         try:
+            avatar_hash = None
+            if avatar_blob:
+                try:
+                    avatar_hash = avatar_store.store_avatar(db, avatar_blob)
+                except avatar_store.AvatarError as e:
+                    return str(e), 400
             db.execute(
-                'INSERT INTO users (username, password, avatar_blob) VALUES (?, ?, ?)',
-                (username, password, avatar_blob)
+                'INSERT INTO users (username, password, avatar_hash) VALUES (?, ?, ?)',
+                (username, password, avatar_hash)
             )
             db.commit()
             return redirect(url_for('login'))
@@ -168,150 +226,236 @@ def register():
 
 @app.route('/logout')
 def logout():
-    session.clear()
+    user_context.logout_user()
     return redirect(url_for('index'))
 
 @app.route('/user-center')
+@login_required(redirect_to='login')
 def user_center():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    db = get_db()
-    # 获取用户答题统计
-    total_answers = db.execute('SELECT COUNT(*) FROM answer_records WHERE user_id = ?', (session['user_id'],)).fetchone()[0]
-    correct_answers = db.execute('SELECT COUNT(*) FROM answer_records WHERE user_id = ? AND is_correct = 1', (session['user_id'],)).fetchone()[0]
-    wrong_answers = total_answers - correct_answers
-    correct_rate = round((correct_answers / total_answers) * 100) if total_answers > 0 else 0
-    
-    # 获取探索统计和探索记录
-    exploration_count = db.execute('SELECT COUNT(*) FROM city_explorations WHERE user_id = ?', (session['user_id'],)).fetchone()[0]
-    explorations = db.execute('SELECT city_name FROM city_explorations WHERE user_id = ?', (session['user_id'],)).fetchall()
-    
-    # 将探索记录转换为集合以便快速查找
-    explored_cities = set()
-    for exp in explorations:
-        city_name = exp['city_name']
-        # 转换格式：从"闽派新语 - 福州"到"福州"
-        if city_name.startswith('闽派新语 - '):
-            explored_cities.add(city_name.replace('闽派新语 - ', ''))
-        else:
-            explored_cities.add(city_name)
+    stats = user_stats.get_user_stats(get_db(), current_user.id)
+    total_answers = stats['total_answers']
+    wrong_answers = total_answers - stats['correct_answers']
+    correct_rate = round((stats['correct_answers'] / total_answers) * 100) if total_answers > 0 else 0
     
     return render_template('user_center.html',
                           total_answers=total_answers, 
                           correct_rate=correct_rate, 
                           wrong_answers=wrong_answers,
-                          exploration_count=exploration_count,
-                          explored_cities=explored_cities)
+                          exploration_count=stats['exploration_count'],
+                          explored_cities=stats['explored_cities'])
 
 # ===== 主要功能路由 =====
 @app.route('/')
 def index():
     # 福建地图首页
-    return render_template('index.html')
+    return render_cache.render('index.html')
 
 @app.route('/ai-chat')
 def ai_chat():
     # AI问答页面
-    return render_template('ai_chat.html')
+    return render_cache.render('ai_chat.html')
 
 @app.route('/ebook')
 def ebook():
     # 学习日志电子书页面
-    return render_template('ebook.html')
+    return render_cache.render('ebook.html')
+
+def sample_questions(db, user_id, k=10):
+    # 优先抽取没做过的题，并穿插一部分答错过的题
+    answer_set = answered_sets.answer_sets.get(db, user_id)
+    review_ratio = app.config['QUIZ_REVIEW_RATIO']
+    
+    def choose(ids, k, rng):
+        return answer_set.choose(ids, k, review_ratio, rng, known=question_sampler)
+    
+    return question_sampler.sample(db, k, fetch=question_store.get_many, choose=choose)
 
 @app.route('/quiz')
+@login_required(redirect_to='login')
 def quiz():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    db = get_db()
-    questions = db.execute('SELECT * FROM questions ORDER BY RANDOM() LIMIT 10').fetchall()
+    questions = sample_questions(get_db(), current_user.id)
     return render_template('quiz.html', questions=questions)
 
 # ===== 地市详情页路由 =====
 @app.route('/city/<city_name>')
 def city_detail(city_name):
+    if city_name not in CITY_NAMES:
+        return '城市不存在', 404
     # 不再自动记录探索，让用户手动点击按钮来标记
-    return render_template(f'cities/{city_name}.html', city_name=city_name)
+    return render_cache.render(f'cities/{city_name}.html', city_name=city_name)
 
 # ===== API接口 =====
 @app.route('/api/check-login')
 def check_login():
     return jsonify({
-        'logged_in': 'user_id' in session,
-        'username': session.get('username', '')
+        'logged_in': bool(current_user),
+        'username': current_user.username if current_user else ''
     })
 
 @app.route('/api/submit-answer', methods=['POST'])
+@login_required
+@rate_limited('submit_answer')
 def submit_answer():
-    if 'user_id' not in session:
-        return jsonify({'error': '未登录'}), 401
-    
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': '请求格式错误'}), 400
     db = get_db()
     
-    question = db.execute(
-        'SELECT * FROM questions WHERE id = ?', (data['question_id'],)
-    ).fetchone()
+    # 题目id兼容数字字符串（如 "1"），其它类型直接拒绝
+    question_id = data.get('question_id')
+    if isinstance(question_id, str) and question_id.isascii() and question_id.isdigit():
+        question_id = int(question_id)
+    if not isinstance(question_id, int) or isinstance(question_id, bool):
+        return jsonify({'error': '题目id无效'}), 400
     
-    is_correct = data['user_answer'] == question['correct_answer']
+    # 答案在后台写入，入队前先校验，避免无效记录在写入时才失败
+    user_answer = data.get('user_answer')
+    if not isinstance(user_answer, str) or user_answer not in questions_io.ANSWERS:
+        return jsonify({'error': '答案无效'}), 400
     
-    db.execute(
-        'INSERT INTO answer_records (user_id, question_id, user_answer, is_correct) VALUES (?, ?, ?, ?)',
-        (session['user_id'], data['question_id'], data['user_answer'], is_correct)
-    )
-    db.commit()
+    question = question_store.get(db, question_id)
+    if question is None:
+        return jsonify({'error': '题目不存在'}), 404
+    
+    is_correct = user_answer == question['correct_answer']
+    
+    # 答题记录交给后台批量写入，判题结果直接返回
+    answer_writer.submit(current_user.id, question.id, user_answer, is_correct, db=db)
     
     return jsonify({
         'correct': is_correct,
         'correct_answer': question['correct_answer']
     })
 
+AI_SYSTEM_PROMPT = "你是一个福建文化知识问答助手，专门解答关于福建历史、文化、地理等相关问题。"
+
+DEFAULT_BACKUP_ANSWER = '抱歉，目前无法获取AI回答。您可以尝试询问关于福建文化、历史、地理等方面的问题。'
+
+app.config.setdefault('CHAT_MAX_STREAMS', 8)
+app.config.setdefault('AI_GROUNDING', True)
+
+# 每个worker同时进行的流式回答数量上限
+chat_stream_slots = threading.BoundedSemaphore(app.config['CHAT_MAX_STREAMS'])
+
+def backup_answer(question):
+    # 上游AI不可用时，从城市内容索引中检索相关段落作为回答
+    answer = city_index.answer(question)
+    if answer:
+        return answer
+    for city in city_index.cities():
+        if city in question:
+            return city_index.answer(f'{city}城市简介') or DEFAULT_BACKUP_ANSWER
+    return DEFAULT_BACKUP_ANSWER
+
+def chat_messages(question):
+    messages = [{"role": "system", "content": AI_SYSTEM_PROMPT}]
+    if app.config['AI_GROUNDING']:
+        context = city_index.context(question)
+        if context:
+            messages.append({"role": "system", "content": f"以下资料摘自本站的城市介绍，可供回答时参考：\n{context}"})
+    messages.append({"role": "user", "content": question})
+    return messages
+
+def sse_event(payload):
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def stream_chat(question):
+    """以server-sent events逐段转发上游返回的内容
+
+    客户端断开时WSGI服务器会关闭生成器，finally中随即关闭上游连接，停止继续生成。
+    生成器在请求上下文结束后才执行，其中写入回答缓存时另从连接池取连接。
+    """
+    cached = answer_cache.lookup(question, get_db())
+    if cached is not None:
+        def replay():
+            yield sse_event({'delta': cached, 'cached': True})
+            yield sse_event({'done': True})
+        return Response(replay(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+    
+    if not chat_stream_slots.acquire(blocking=False):
+        return jsonify({'error': '当前提问人数较多，请稍后再试'}), 429
+    
+    # 等待上游期间不占用数据库连接
+    release_db()
+    start = time.perf_counter()
+    try:
+        upstream = ai_gateway.stream(chat_messages(question), temperature=0.7, max_tokens=2000)
+    except Exception:
+        # 失败原因已由ai_gateway记录日志
+        chat_stream_slots.release()
+        upstream = None
+    
+    released = []
+    
+    def cleanup():
+        # 生成器可能在开始迭代前就被关闭，因此也注册到call_on_close，保证只执行一次
+        if not released:
+            released.append(True)
+            upstream.response.close()
+            chat_stream_slots.release()
+    
+    def generate():
+        if upstream is None:
+            yield sse_event({'delta': backup_answer(question), 'fallback': True})
+            yield sse_event({'done': True})
+            return
+        
+        parts = []
+        sent = False
+        try:
+            for chunk in upstream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    sent = True
+                    parts.append(delta)
+                    yield sse_event({'delta': delta})
+            # 只缓存完整生成的回答
+            answer_cache.record_upstream_latency((time.perf_counter() - start) * 1000)
+            answer_cache.store(question, ''.join(parts))
+        except Exception as e:
+            app.logger.warning(f"DeepSeek流式响应中断: {type(e).__name__}")
+            if not sent:
+                yield sse_event({'delta': backup_answer(question), 'fallback': True})
+            else:
+                yield sse_event({'error': '回答生成中断，请稍后重试'})
+        finally:
+            cleanup()
+        yield sse_event({'done': True})
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    if upstream is not None:
+        response.call_on_close(cleanup)
+    return response
+
 @app.route('/api/chat', methods=['POST'])
+@login_required(error='未登录，无法使用AI问答功能')
+@rate_limited('chat')
+@concurrency_limited('chat')
 def api_chat():
-    if 'user_id' not in session:
-        return jsonify({'error': '未登录，无法使用AI问答功能'}), 401
-
     data = request.get_json()
     question = data.get('question', '').strip()
     if not question:
         return jsonify({'error': '问题不能为空'}), 400
 
-    try:
-        # 读取AI配置
-        with open('ai.json', 'r', encoding='utf-8') as f:
-            import json
-            ai_config = json.load(f)
-        
-        from openai import OpenAI
-        
-        # 初始化 DeepSeek 客户端
-        api_key = ai_config['deepseek_api_key']
-        print(f"使用API密钥: {api_key[:8]}...{api_key[-4:]}")
-        
-        client = OpenAI(
-            api_key=api_key,
-            base_url="https://api.deepseek.com/v1"
-        )
+    if data.get('stream') or 'text/event-stream' in request.headers.get('Accept', ''):
+        return stream_chat(question)
 
-        print(f"发送问题到DeepSeek: {question}")
-        
-        # 调用API
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system", "content": "你是一个福建文化知识问答助手，专门解答关于福建历史、文化、地理等相关问题。"},
-                {"role": "user", "content": question}
-            ],
-            temperature=0.7,
-            max_tokens=2000
-        )
-        
-        print(f"API响应: {response}")
-        
-        answer = response.choices[0].message.content
-        print(f"AI回答: {answer[:100]}...")  # 只显示前100个字符
+    cached = answer_cache.lookup(question, get_db())
+    if cached is not None:
+        return jsonify({'answer': cached, 'cached': True})
+
+    # 等待上游回答可能长达数十秒，期间不占用数据库连接，写入缓存时再重新取得
+    release_db()
+    try:
+        start = time.perf_counter()
+        answer = ai_gateway.complete(chat_messages(question), temperature=0.7, max_tokens=2000)
+        answer_cache.record_upstream_latency((time.perf_counter() - start) * 1000)
+        answer_cache.store(question, answer, get_db())
         return jsonify({'answer': answer})
 
     except FileNotFoundError:
@@ -319,56 +463,21 @@ def api_chat():
             'error': '未找到AI配置文件，请联系管理员',
             'details': '请确保ai.json文件存在并包含有效的API密钥'
         }), 500
-    except Exception as e:
-        # 记录详细的错误信息
-        print(f"DeepSeek API调用失败: {str(e)}")
-        print(f"API密钥: {ai_config['deepseek_api_key'][:10]}...")  # 只显示前10个字符
-        
-        # 提供备用回答
-        backup_answers = {
-            '福州': '福州是福建省的省会城市，有着2200多年的建城史，是国家历史文化名城。因城内遍植榕树，别称"榕城"。',
-            '南平': '南平市位于福建省北部，武夷山脉北段东南侧，闽江上游，是福建通往内地的咽喉要道。',
-            '龙岩': '龙岩市位于福建省西部，地处闽粤赣三省交界，是重要的客家聚居地和革命老区。',
-            '泉州': '泉州市位于福建省东南沿海，是联合国教科文组织认定的海上丝绸之路起点。',
-            '莆田': '莆田市位于福建省东部沿海，是妈祖文化的发祥地，也是著名的侨乡。',
-            'default': '抱歉，目前无法获取AI回答。您可以尝试询问关于福建文化、历史、地理等方面的问题。'
-        }
-        
-        # 检查问题中是否包含城市名称
-        for city in ['福州', '南平', '龙岩', '泉州', '莆田']:
-            if city in question:
-                return jsonify({'answer': backup_answers[city]})
-        
-        return jsonify({'answer': backup_answers['default']})
+    except Exception:
+        # 错误信息已由ai_gateway记录，提供备用回答
+        return jsonify({'answer': backup_answer(question)})
 
 @app.route('/api/get-questions')
+@login_required
 def get_questions():
-    if 'user_id' not in session:
-        return jsonify({'error': '未登录'}), 401
-    
-    db = get_db()
-    questions = db.execute('SELECT * FROM questions ORDER BY RANDOM() LIMIT 10').fetchall()
-    
-    # 将Row对象转换为字典
-    questions_list = []
-    for question in questions:
-        questions_list.append({
-            'id': question['id'],
-            'question': question['question_text'],
-            'option_a': question['option_a'],
-            'option_b': question['option_b'],
-            'option_c': question['option_c'],
-            'option_d': question['option_d'],
-            'correct_answer': question['correct_answer']
-        })
+    questions = sample_questions(get_db(), current_user.id)
+    questions_list = [question.to_dict() for question in questions]
     
     return jsonify({'questions': questions_list})
 
 @app.route('/api/mark-explored', methods=['POST'])
+@login_required
 def mark_explored():
-    if 'user_id' not in session:
-        return jsonify({'error': '未登录'}), 401
-    
     # 支持JSON和表单两种数据格式
     if request.is_json:
         data = request.get_json()
@@ -379,40 +488,70 @@ def mark_explored():
     if not city_name:
         return jsonify({'error': '城市名称不能为空'}), 400
     
-    db = get_db()
     try:
-        db.execute(
-            'INSERT OR IGNORE INTO city_explorations (user_id, city_name) VALUES (?, ?)',
-            (session['user_id'], city_name)
-        )
-        db.commit()
+        explorations.mark_explored(get_db(), current_user.id, [city_name])
         return jsonify({'success': True})
     except sqlite3.Error as e:
-        db.rollback()
         return jsonify({'error': f'数据库错误: {str(e)}'}), 500
 
 @app.route('/api/check-explored')
 def check_explored():
-    if 'user_id' not in session:
+    if not current_user:
         return jsonify({'explored': False})
     
     city_name = request.args.get('city_name')
     if not city_name:
         return jsonify({'error': '城市名称不能为空'}), 400
     
+    return jsonify({'explored': explorations.is_explored(get_db(), current_user.id, city_name)})
+
+@app.route('/api/explorations', methods=['GET', 'POST'])
+@login_required
+def sync_explorations():
+    """批量同步探索记录
+
+    GET ?since=版本号：返回该版本之后新增的城市，版本未变化时可用If-None-Match得到304；
+    POST {"since": 版本号, "cities": [...]}：上传离线标记的城市，在一个事务中写入后返回增量。
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+    else:
+        data = request.args
+    try:
+        since = max(int(data.get('since', 0)), 0)
+    except (TypeError, ValueError):
+        return jsonify({'error': '版本号格式错误'}), 400
+    
+    cities = data.get('cities', []) if request.method == 'POST' else []
+    if not isinstance(cities, list) or not all(isinstance(city, str) for city in cities):
+        return jsonify({'error': '城市列表格式错误'}), 400
+    if len(cities) > explorations.MAX_SYNC_CITIES:
+        return jsonify({'error': '城市数量过多'}), 400
+    
     db = get_db()
-    exploration = db.execute(
-        'SELECT 1 FROM city_explorations WHERE user_id = ? AND city_name = ?',
-        (session['user_id'], city_name)
-    ).fetchone()
+    if request.method == 'GET':
+        version = explorations.current_version(db, current_user.id)
+        etag = f'explorations-{current_user.id}-{version}'
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
     
-    return jsonify({'explored': exploration is not None})
+    try:
+        result = explorations.sync(db, current_user.id, cities, since)
+    except sqlite3.Error as e:
+        return jsonify({'error': f'数据库错误: {str(e)}'}), 500
+    
+    response = jsonify(result)
+    if request.method == 'GET':
+        response.set_etag(f'explorations-{current_user.id}-{result["version"]}')
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/api/change-password', methods=['POST'])
+@login_required
 def change_password():
-    if 'user_id' not in session:
-        return jsonify({'error': '未登录'}), 401
-    
     current_password = request.form.get('current_password')
     new_password = request.form.get('new_password')
     confirm_new_password = request.form.get('confirm_new_password')
@@ -426,53 +565,55 @@ def change_password():
     if len(new_password) < 6:
         return jsonify({'error': '新密码长度至少6个字符'}), 400
     
-    db = get_db()
-    user = db.execute(
-        'SELECT password FROM users WHERE id = ?', (session['user_id'],)
-    ).fetchone()
-    
-    if not user or user['password'] != current_password:
+    # 校验密码时从数据库重新读取，不使用可能过期的缓存
+    user = user_context.load_user(refresh=True)
+    if not user or user.password != current_password:
         return jsonify({'error': '当前密码不正确'}), 400
     
+    db = get_db()
     try:
         db.execute(
             'UPDATE users SET password = ? WHERE id = ?',
-            (new_password, session['user_id'])
+            (new_password, user.id)
         )
         db.commit()
+        user_context.invalidate_user(user.id)
         return jsonify({'success': True})
     except sqlite3.Error as e:
         db.rollback()
         return jsonify({'error': f'数据库错误: {str(e)}'}), 500
 
 @app.route('/api/delete-account', methods=['POST'])
+@login_required
 def delete_account():
-    if 'user_id' not in session:
-        return jsonify({'error': '未登录'}), 401
-    
     confirm_username = request.form.get('confirm_username')
     confirm_password = request.form.get('confirm_password')
     
     if not all([confirm_username, confirm_password]):
         return jsonify({'error': '所有字段都必须填写'}), 400
     
-    db = get_db()
-    user = db.execute(
-        'SELECT username, password FROM users WHERE id = ?', (session['user_id'],)
-    ).fetchone()
-    
-    if not user or user['username'] != confirm_username or user['password'] != confirm_password:
+    user = user_context.load_user(refresh=True)
+    if not user or user.username != confirm_username or user.password != confirm_password:
         return jsonify({'error': '用户名或密码不正确'}), 400
     
+    db = get_db()
     try:
+        # 先写入缓冲中的答题记录，避免删除后又被补写回来
+        answer_writer.flush(db)
+        
         # 删除用户的所有相关数据
-        db.execute('DELETE FROM answer_records WHERE user_id = ?', (session['user_id'],))
-        db.execute('DELETE FROM city_explorations WHERE user_id = ?', (session['user_id'],))
-        db.execute('DELETE FROM users WHERE id = ?', (session['user_id'],))
+        aggregates.delete_user(db, user.id)
+        answered_sets.delete_user(db, user.id)
+        db.execute('DELETE FROM answer_records WHERE user_id = ?', (user.id,))
+        db.execute('DELETE FROM city_explorations WHERE user_id = ?', (user.id,))
+        user_stats.delete_user(db, user.id)
+        db.execute('DELETE FROM users WHERE id = ?', (user.id,))
+        avatar_store.release_avatar(db, user.avatar_hash)
         db.commit()
         
-        # 清除会话
-        session.clear()
+        # 清除缓存和会话
+        user_context.invalidate_user(user.id)
+        user_context.logout_user()
         
         return jsonify({'success': True})
     except sqlite3.Error as e:
@@ -481,45 +622,185 @@ def delete_account():
 
 @app.route('/api/get-explorations')
 def get_explorations():
-    if 'user_id' not in session:
+    if not current_user:
         return jsonify({'explorations': []})
     
-    db = get_db()
-    explorations = db.execute(
-        'SELECT city_name FROM city_explorations WHERE user_id = ?',
-        (session['user_id'],)
-    ).fetchall()
-    
     # 返回数据库原始的城市名称格式，让客户端处理显示格式
-    explored_cities = [exp['city_name'] for exp in explorations]
+    version, explored_cities = explorations.explored_since(get_db(), current_user.id)
     
     return jsonify({
-        'explorations': explored_cities
+        'explorations': explored_cities,
+        'version': version
     })
 
+# ===== 排行榜与题目统计 =====
+def _limit_arg(default=10):
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        limit = default
+    return min(max(limit, 1), app.config['LEADERBOARD_MAX_LIMIT'])
+
+@app.route('/api/leaderboard')
+def leaderboard():
+    db = get_db()
+    result = {'leaderboard': aggregates.leaderboard(db, _limit_arg())}
+    if current_user:
+        result['me'] = aggregates.user_rank(db, current_user.id)
+    return jsonify(result)
+
+@app.route('/api/questions/stats')
+def questions_stats():
+    order = request.args.get('order', 'hardest')
+    if order not in ('hardest', 'easiest'):
+        return jsonify({'error': '排序方式错误'}), 400
+    questions = aggregates.hardest_questions(
+        get_db(), _limit_arg(), min_attempts=app.config['QUESTION_STATS_MIN_ATTEMPTS'],
+        easiest=order == 'easiest'
+    )
+    return jsonify({'order': order, 'questions': questions})
+
+@app.route('/api/questions/<int:question_id>/stats')
+def question_stats(question_id):
+    stats = aggregates.question_stats(get_db(), question_id)
+    if stats is None:
+        return jsonify({'error': '题目不存在'}), 404
+    return jsonify(stats)
+
+# ===== 运行状态统计（默认关闭，见 metrics.METRICS_DEFAULTS） =====
+@app.route('/api/stats/db-pool')
+@stats_endpoint
+def db_pool_stats():
+    return jsonify(get_pool_stats())
+
+@app.route('/api/stats/question-cache')
+@stats_endpoint
+def question_cache_stats():
+    return jsonify(question_cache.stats())
+
+@app.route('/api/stats/question-snapshot')
+@stats_endpoint
+def question_snapshot_stats():
+    return jsonify(question_store.stats())
+
+@app.route('/api/stats/answer-writer')
+@stats_endpoint
+def answer_writer_stats():
+    return jsonify(answer_writer.stats())
+
+@app.route('/api/stats/answer-cache')
+@stats_endpoint
+def answer_cache_stats():
+    return jsonify(answer_cache.stats())
+
+@app.route('/api/stats/answered-sets')
+@stats_endpoint
+def answered_sets_stats():
+    return jsonify(answered_sets.answer_sets.stats())
+
+@app.route('/api/stats/user-cache')
+@stats_endpoint
+def user_cache_stats():
+    return jsonify(user_context.user_cache.stats())
+
+@app.route('/api/stats/rate-limit')
+@stats_endpoint
+def rate_limit_stats():
+    return jsonify(request_limits.limiter.stats())
+
+@app.route('/api/stats/render-cache')
+@stats_endpoint
+def render_cache_stats():
+    return jsonify(render_cache.stats())
+
 # 提供PDF文件的路由
 @app.route('/source/<path:filename>')
 def serve_pdf(filename):
     # 确保只允许访问PDF文件
     if not filename.endswith('.pdf'):
         return '文件类型不允许', 403
+    if '..' in filename.replace('\\', '/').split('/'):
+        return '文件不存在', 404
     
-    pdf_path = os.path.join(app.root_path, 'source', filename)
-    
-    if not os.path.exists(pdf_path):
+    meta = pdf_assets.resolve(filename)
+    if meta is None:
         return '文件不存在', 404
     
-    return send_file(pdf_path, as_attachment=False)
+    # 支持Range请求（206分段响应）和条件请求，PDF.js可以只获取当前页所需的数据
+    response = Response(wrap_file(request.environ, open(meta.path, 'rb')),
+                        mimetype='application/pdf', direct_passthrough=True)
+    response.content_length = meta.size
+    # 完整响应也要声明Accept-Ranges，PDF.js据此切换到分块加载
+    response.accept_ranges = 'bytes'
+    response.set_etag(meta.etag)
+    response.last_modified = meta.mtime
+    response.cache_control.no_cache = True
+    return response.make_conditional(request, accept_ranges=True, complete_length=meta.size)
+
+@app.route('/source/<path:filename>.manifest.json')
+def serve_pdf_manifest(filename):
+    # 每一页所需对象的字节范围，供阅读器预取相邻页面
+    cached = pdf_assets.manifest(filename) if filename.endswith('.pdf') else None
+    if cached is None:
+        return '文件不存在', 404
+    etag, data = cached
+    response = make_response(data)
+    response.mimetype = 'application/json'
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/source/<path:filename>.pages.json')
+def serve_pdf_page_index(filename):
+    # 预渲染页面图片的索引，尚未运行 flask ebook render 时返回404，前端改用pdf.js渲染
+    cached = page_images.index(filename) if filename.endswith('.pdf') else None
+    if cached is None:
+        return '文件不存在', 404
+    etag, data = cached
+    response = make_response(data)
+    response.mimetype = 'application/json'
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/ebook/pages/<digest>/<int:width>.<fmt>')
+def serve_page_image(digest, width, fmt):
+    # 文件名包含页面内容哈希，内容不变时可以长期缓存
+    if fmt not in ('webp', 'png'):
+        return '', 404
+    path = page_images.image_path(digest, width, fmt)
+    if path is None:
+        return '', 404
+    response = send_file(path, mimetype=f'image/{fmt}', etag=f'{digest}-{width}', max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
 # 提供fujian.json文件的路由
 @app.route('/fujian.json')
+@app.route('/static/fujian.json')
 def serve_fujian_json():
-    fujian_path = os.path.join(app.root_path, 'static', 'fujian.json')
-    
-    if not os.path.exists(fujian_path):
-        return '文件不存在', 404
-    
-    return send_file(fujian_path, as_attachment=False, mimetype='application/json')
+    detail = request.args.get('detail', geo_assets.DEFAULT_DETAIL)
+    fmt = request.args.get('format', 'geojson')
+    if detail not in geo_assets.DETAIL_LEVELS or fmt not in geo_assets.FORMATS:
+        return '参数错误', 400
+    
+    artifact = geo_assets.artifacts.get(detail, fmt, request.accept_encodings)
+    if artifact is None:
+        # 尚未构建简化数据时直接返回原始文件
+        fujian_path = os.path.join(app.root_path, 'static', 'fujian.json')
+        if not os.path.exists(fujian_path):
+            return '文件不存在', 404
+        return send_file(fujian_path, as_attachment=False, mimetype='application/json')
+    
+    data, etag, encoding = artifact
+    response = make_response(data)
+    response.headers['Content-Type'] = 'application/json'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    return response.make_conditional(request)
 
 if __name__ == '__main__':
     app.run(debug=True)
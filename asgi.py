@@ -0,0 +1,446 @@
+"""ASGI部署入口：AI问答等待上游时不占用工作线程
+
+用法（需要 pip install uvicorn，或其它ASGI服务器）:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers 4
+
+- POST /api/chat 由原生异步视图处理：上游使用AsyncOpenAI客户端，流式回答逐段转发，
+  客户端断开时立即取消上游请求；一个进程可以同时挂起数百个问答；
+- 问答过程中的数据库操作（校验登录用户、读写回答缓存）放到有上限的线程池中执行；
+- 其余路由仍是 app.py 中原来的Flask同步视图，通过 WsgiBridge 在另一个有上限的线程池中运行，
+  行为与WSGI部署时相同（包括流式响应、call_on_close 和客户端断开后关闭响应迭代器）；
+- 两个线程池中的每个线程同一时刻最多持有一个数据库连接，SQLite连接池的大小会被调到不小于
+  两者线程数之和再加上后台任务（答题记录写入、题库快照生成、汇总统计重建）所需的连接数，
+  线程不会因为连接被其它线程占满而等待超时；连接按需创建，空闲时不会打开这么多连接；
+- 限流、并发名额和请求体大小上限与WSGI部署时使用同一套配置和计数（request_limits）。
+"""
+import asyncio
+import json
+import math
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+from itsdangerous import BadSignature
+from werkzeug.http import parse_cookie
+
+from ai_gateway import gateway as ai_gateway
+from answer_cache import answer_cache
+from app import app, backup_answer, chat_messages, sse_event
+from database import configure_pool, get_pool
+from metrics import metrics
+from request_limits import TOO_MANY_CONCURRENT, TOO_MANY_REQUESTS, limiter
+from user_context import user_cache
+
+# 默认配置，可在app.config中覆盖
+ASGI_DEFAULTS = {
+    'ASGI_WSGI_THREADS': 32,
+    'ASGI_DB_THREADS': app.config['SQLITE_POOL_SIZE'],
+    # 后台线程各自从连接池取连接：答题记录写入、题库快照生成、汇总统计重建
+    'ASGI_BACKGROUND_CONNECTIONS': 3,
+    # 每个进程同时进行的流式回答数量上限（同步部署时为 CHAT_MAX_STREAMS）
+    'ASGI_CHAT_MAX_STREAMS': 256,
+    'ASGI_CHAT_MAX_BODY': 64 * 1024,
+}
+
+CHAT_PATH = '/api/chat'
+
+
+async def read_body(receive, max_size=None):
+    """读取完整的请求体，超过max_size时返回None"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def header_value(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return ''
+
+
+class WsgiBridge:
+    """在有上限的线程池中运行WSGI应用
+
+    每个请求占用一个线程直到响应体发送完毕；响应体逐块发送（流式响应不会被缓冲），
+    客户端断开后停止迭代并调用响应的close()，与WSGI服务器的行为一致。
+    """
+
+    def __init__(self, wsgi_app, executor, max_body=None):
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+        self.max_body = max_body
+
+    async def __call__(self, scope, receive, send):
+        # 声明的或实际读到的请求体超过上限时直接返回413，不再继续缓冲
+        declared = header_value(scope, b'content-length')
+        if self.max_body is not None and declared.isdigit() and int(declared) > self.max_body:
+            await self.too_large(send)
+            return
+        body = SpooledTemporaryFile(max_size=1024 * 1024)
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                body.close()
+                return
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if self.max_body is not None and size > self.max_body:
+                body.close()
+                await self.too_large(send)
+                return
+            body.write(chunk)
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+
+        loop = asyncio.get_running_loop()
+        disconnected = threading.Event()
+        watcher = loop.create_task(wait_disconnect(receive))
+        watcher.add_done_callback(lambda task: task.cancelled() or disconnected.set())
+        try:
+            await loop.run_in_executor(self.executor, self._run, scope, body, loop, send, disconnected)
+        finally:
+            watcher.cancel()
+            body.close()
+
+    @staticmethod
+    async def too_large(send):
+        body = '上传内容过大'.encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': 413,
+            'headers': [(b'content-type', b'text/plain; charset=utf-8'), (b'content-length', str(len(body)).encode()),
+                        (b'connection', b'close')],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    @staticmethod
+    def build_environ(scope, body):
+        root_path = scope.get('root_path', '')
+        path = scope['path']
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        server = scope.get('server') or ('localhost', 80)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+            'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1] or 80),
+            'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+            'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for key, value in scope['headers']:
+            name = key.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[name] = value
+                continue
+            name = 'HTTP_' + name
+            if name in environ:
+                value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') + value
+            environ[name] = value
+        return environ
+
+    def _run(self, scope, body, loop, send, disconnected):
+        def call(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        state = {'start': None, 'sent': False}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and state['sent']:
+                raise exc_info[1].with_traceback(exc_info[2])
+            state['start'] = {
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            }
+            return write
+
+        def write(data):
+            if not state['sent']:
+                state['sent'] = True
+                call(state['start'])
+            if data:
+                call({'type': 'http.response.body', 'body': data, 'more_body': True})
+
+        iterable = self.wsgi_app(self.build_environ(scope, body), start_response)
+        try:
+            for chunk in iterable:
+                if disconnected.is_set():
+                    return
+                write(chunk)
+            if not disconnected.is_set():
+                write(b'')
+                call({'type': 'http.response.body'})
+        finally:
+            close = getattr(iterable, 'close', None)
+            if close is not None:
+                close()
+
+
+class AsyncChat:
+    """/api/chat 的异步实现，逻辑与 app.api_chat / app.stream_chat 相同"""
+
+    def __init__(self, flask_app, db_executor, max_streams=256, max_body=64 * 1024):
+        self.app = flask_app
+        self.db_executor = db_executor
+        self.max_streams = max_streams
+        self.max_body = max_body
+        self.active_streams = 0
+
+    async def offload(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.db_executor, func, *args)
+
+    @staticmethod
+    def _load_user(user_id):
+        pool = get_pool()
+        db = pool.acquire()
+        try:
+            return user_cache.load(db, user_id)
+        finally:
+            pool.release(db)
+
+    async def current_user(self, scope):
+        """从Flask的签名cookie中取出登录用户，cookie无效或账号已注销时返回None"""
+        cookie = parse_cookie(header_value(scope, b'cookie')).get(self.app.config['SESSION_COOKIE_NAME'])
+        if not cookie:
+            return None
+        serializer = self.app.session_interface.get_signing_serializer(self.app)
+        try:
+            session = serializer.loads(cookie, max_age=int(self.app.permanent_session_lifetime.total_seconds()))
+        except BadSignature:
+            return None
+        user_id = session.get('user_id')
+        if user_id is None:
+            return None
+        # 缓存命中时直接返回，不必交给数据库线程池
+        user = user_cache.cached(user_id)
+        if user is not None:
+            return user
+        return await self.offload(self._load_user, user_id)
+
+    @staticmethod
+    async def send_json(send, payload, status=200, headers=()):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                        *headers],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+        return status
+
+    async def __call__(self, scope, receive, send):
+        start = time.perf_counter()
+        status = await self.handle(scope, receive, send)
+        if metrics.enabled and status is not None:
+            metrics.request_seconds.observe(('POST', CHAT_PATH, str(status)), time.perf_counter() - start)
+
+    async def handle(self, scope, receive, send):
+        body = await read_body(receive, self.max_body)
+        if body is None:
+            return await self.send_json(send, {'error': '请求内容过大'}, 413)
+        user = await self.current_user(scope)
+        if user is None:
+            return await self.send_json(send, {'error': '未登录，无法使用AI问答功能'}, 401)
+        client = scope.get('client')
+        wait = await self.offload(limiter.check, 'chat', user.id, client[0] if client else None)
+        if wait:
+            return await self.send_json(send, {'error': TOO_MANY_REQUESTS}, 429,
+                                        [(b'retry-after', str(max(1, math.ceil(wait))).encode())])
+        lease = await self.offload(limiter.acquire, 'chat', user.id)
+        if lease is None:
+            return await self.send_json(send, {'error': TOO_MANY_CONCURRENT}, 429)
+        try:
+            return await self.answer(body, scope, receive, send)
+        finally:
+            await self.offload(limiter.release, lease)
+
+    async def answer(self, body, scope, receive, send):
+        try:
+            data = json.loads(body or b'{}')
+        except ValueError:
+            return await self.send_json(send, {'error': '请求格式错误'}, 400)
+        question = str(data.get('question', '')).strip()
+        if not question:
+            return await self.send_json(send, {'error': '问题不能为空'}, 400)
+
+        if data.get('stream') or 'text/event-stream' in header_value(scope, b'accept'):
+            return await self.stream(question, receive, send)
+
+        cached = await self.offload(answer_cache.lookup, question)
+        if cached is not None:
+            return await self.send_json(send, {'answer': cached, 'cached': True})
+        try:
+            start = time.perf_counter()
+            answer = await ai_gateway.acomplete(chat_messages(question), temperature=0.7, max_tokens=2000)
+        except FileNotFoundError:
+            return await self.send_json(send, {
+                'error': '未找到AI配置文件，请联系管理员',
+                'details': '请确保ai.json文件存在并包含有效的API密钥'
+            }, 500)
+        except Exception:
+            # 错误信息已由ai_gateway记录，提供备用回答
+            return await self.send_json(send, {'answer': backup_answer(question)})
+        answer_cache.record_upstream_latency((time.perf_counter() - start) * 1000)
+        await self.offload(answer_cache.store, question, answer)
+        return await self.send_json(send, {'answer': answer})
+
+    async def stream(self, question, receive, send):
+        async def send_event(payload):
+            await send({'type': 'http.response.body', 'body': sse_event(payload).encode('utf-8'), 'more_body': True})
+
+        async def start_events():
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [(b'content-type', b'text/event-stream; charset=utf-8'),
+                            (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')],
+            })
+
+        async def finish():
+            await send_event({'done': True})
+            await send({'type': 'http.response.body'})
+
+        cached = await self.offload(answer_cache.lookup, question)
+        if cached is not None:
+            await start_events()
+            await send_event({'delta': cached, 'cached': True})
+            await finish()
+            return 200
+
+        if self.active_streams >= self.max_streams:
+            return await self.send_json(send, {'error': '当前提问人数较多，请稍后再试'}, 429)
+        self.active_streams += 1
+        try:
+            start = time.perf_counter()
+            try:
+                upstream = await ai_gateway.astream(chat_messages(question), temperature=0.7, max_tokens=2000)
+            except Exception:
+                # 失败原因已由ai_gateway记录日志
+                upstream = None
+            await start_events()
+            if upstream is None:
+                await send_event({'delta': backup_answer(question), 'fallback': True})
+                await finish()
+                return 200
+
+            async def relay():
+                parts = []
+                sent = False
+                try:
+                    async for chunk in upstream:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            sent = True
+                            parts.append(delta)
+                            await send_event({'delta': delta})
+                    # 只缓存完整生成的回答
+                    answer_cache.record_upstream_latency((time.perf_counter() - start) * 1000)
+                    await self.offload(answer_cache.store, question, ''.join(parts))
+                except Exception as e:
+                    self.app.logger.warning(f"DeepSeek流式响应中断: {type(e).__name__}")
+                    if not sent:
+                        await send_event({'delta': backup_answer(question), 'fallback': True})
+                    else:
+                        await send_event({'error': '回答生成中断，请稍后重试'})
+                await finish()
+
+            relay_task = asyncio.ensure_future(relay())
+            disconnect_task = asyncio.ensure_future(wait_disconnect(receive))
+            try:
+                await asyncio.wait({relay_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                # 客户端断开时停止转发，随后关闭上游连接
+                for task in (relay_task, disconnect_task):
+                    task.cancel()
+                await asyncio.gather(relay_task, disconnect_task, return_exceptions=True)
+                await upstream.response.aclose()
+            return 200
+        finally:
+            self.active_streams -= 1
+
+    def stats(self):
+        return {'active_streams': self.active_streams, 'max_streams': self.max_streams}
+
+
+class Application:
+    """ASGI应用：/api/chat 走异步实现，其余请求交给Flask"""
+
+    def __init__(self, flask_app, native_chat=True):
+        for key, value in ASGI_DEFAULTS.items():
+            flask_app.config.setdefault(key, value)
+        # 每个线程最多持有一个连接，连接池不小于线程总数时不会有线程等待连接
+        pool_size = (flask_app.config['ASGI_WSGI_THREADS'] + flask_app.config['ASGI_DB_THREADS']
+                     + flask_app.config['ASGI_BACKGROUND_CONNECTIONS'])
+        if flask_app.config['SQLITE_POOL_SIZE'] < pool_size:
+            flask_app.config['SQLITE_POOL_SIZE'] = pool_size
+            configure_pool(flask_app.config)
+        self.wsgi_executor = ThreadPoolExecutor(flask_app.config['ASGI_WSGI_THREADS'], thread_name_prefix='asgi-wsgi')
+        self.db_executor = ThreadPoolExecutor(flask_app.config['ASGI_DB_THREADS'], thread_name_prefix='asgi-db')
+        self.wsgi = WsgiBridge(flask_app.wsgi_app, self.wsgi_executor, flask_app.config['MAX_CONTENT_LENGTH'])
+        self.chat = AsyncChat(flask_app, self.db_executor, flask_app.config['ASGI_CHAT_MAX_STREAMS'],
+                              flask_app.config['ASGI_CHAT_MAX_BODY']) if native_chat else None
+        if self.chat is not None:
+            metrics.register_collector('asgi_chat', self.chat.stats)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        path = scope['path']
+        root_path = scope.get('root_path', '')
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+        if self.chat is not None and path == CHAT_PATH and scope['method'] == 'POST':
+            await self.chat(scope, receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.wsgi_executor.shutdown(wait=False)
+                self.db_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+application = Application(app)
@@ -0,0 +1,160 @@
+import hashlib
+import io
+import os
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # 未安装Pillow时只保存原图，不生成缩略图
+    Image = None
+
+# 缩略图尺寸（按2倍屏预留），对应导航栏36px和个人中心120px的头像
+VARIANT_SIZES = {
+    'sm': 72,
+    'md': 240,
+}
+VARIANTS = ('original',) + tuple(VARIANT_SIZES)
+
+# 上传头像的大小上限
+MAX_UPLOAD_BYTES = 2 * 1024 * 1024
+
+DEFAULT_SVG_AVATAR = '''
+<svg width="100" height="100" xmlns="http://www.w3.org/2000/svg">
+    <circle cx="50" cy="50" r="40" fill="#8B7355"/>
+    <circle cx="50" cy="40" r="15" fill="#D2B48C"/>
+    <circle cx="40" cy="35" r="3" fill="white"/>
+    <circle cx="60" cy="35" r="3" fill="white"/>
+    <path d="M35,65 Q50,75 65,65" stroke="white" stroke-width="2" fill="none"/>
+</svg>
+'''.strip().encode('utf-8')
+
+
+class AvatarError(ValueError):
+    """上传的头像无法识别"""
+
+
+def read_upload(file, limit=MAX_UPLOAD_BYTES, chunk_size=64 * 1024):
+    """分块读取上传的文件，超过limit时立即停止读取并抛出AvatarError"""
+    chunks = []
+    size = 0
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            return b''.join(chunks)
+        size += len(chunk)
+        if size > limit:
+            raise AvatarError(f'文件大小不能超过{limit // (1024 * 1024)}MB')
+        chunks.append(chunk)
+
+
+def sniff_content_type(data):
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+def make_thumbnails(data):
+    """生成各尺寸的正方形缩略图，返回 {variant: (content_type, bytes)}"""
+    if Image is None:
+        return {}
+    try:
+        image = Image.open(io.BytesIO(data))
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+    except Exception:
+        return {}
+
+    if features.check('webp'):
+        fmt, content_type = 'WEBP', 'image/webp'
+    else:
+        fmt, content_type = 'PNG', 'image/png'
+
+    thumbnails = {}
+    for variant, size in VARIANT_SIZES.items():
+        thumb = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        buffer = io.BytesIO()
+        thumb.save(buffer, fmt, quality=85)
+        thumbnails[variant] = (content_type, buffer.getvalue())
+    return thumbnails
+
+
+def store_avatar(db, data):
+    """按内容哈希保存头像及其缩略图，相同内容只保存一次，返回哈希值"""
+    content_type = sniff_content_type(data)
+    if content_type is None:
+        raise AvatarError('无法识别的图片格式')
+
+    digest = hashlib.sha256(data).hexdigest()
+    exists = db.execute(
+        "SELECT 1 FROM avatar_blobs WHERE hash = ? AND variant = 'original'", (digest,)
+    ).fetchone()
+    if exists:
+        return digest
+
+    rows = [(digest, 'original', content_type, data)]
+    for variant, (thumb_type, thumb_data) in make_thumbnails(data).items():
+        rows.append((digest, variant, thumb_type, thumb_data))
+    db.executemany(
+        'INSERT OR IGNORE INTO avatar_blobs (hash, variant, content_type, data) VALUES (?, ?, ?, ?)',
+        rows
+    )
+    return digest
+
+
+def release_avatar(db, digest):
+    """没有用户再引用该头像时删除其数据"""
+    if not digest:
+        return
+    in_use = db.execute('SELECT 1 FROM users WHERE avatar_hash = ? LIMIT 1', (digest,)).fetchone()
+    if not in_use:
+        db.execute('DELETE FROM avatar_blobs WHERE hash = ?', (digest,))
+
+
+def load_avatar(db, digest, variant):
+    """读取指定尺寸的头像，缺少该尺寸时退回原图，返回 (content_type, bytes) 或 None"""
+    row = db.execute(
+        "SELECT content_type, data FROM avatar_blobs WHERE hash = ? AND variant IN (?, 'original') "
+        "ORDER BY variant = 'original' LIMIT 1",
+        (digest, variant)
+    ).fetchone()
+    if row is None:
+        return None
+    return row['content_type'], row['data']
+
+
+def migrate_legacy_avatars(db):
+    """把旧版存放在users.avatar_blob中的头像迁移到avatar_blobs表"""
+    rows = db.execute(
+        'SELECT id, avatar_blob FROM users WHERE avatar_blob IS NOT NULL AND avatar_hash IS NULL'
+    ).fetchall()
+    for row in rows:
+        try:
+            digest = store_avatar(db, row['avatar_blob'])
+        except AvatarError:
+            digest = None
+        db.execute('UPDATE users SET avatar_hash = ?, avatar_blob = NULL WHERE id = ?', (digest, row['id']))
+    db.commit()
+    return len(rows)
+
+
+_default_avatar = None
+
+
+def get_default_avatar(root_path):
+    """默认头像只从磁盘读取一次，之后常驻内存，返回 (content_type, bytes, etag)"""
+    global _default_avatar
+    if _default_avatar is None:
+        path = os.path.join(root_path, 'static', 'images', 'default.png')
+        try:
+            with open(path, 'rb') as f:
+                data, content_type = f.read(), 'image/png'
+        except FileNotFoundError:
+            # 如果没有默认头像文件，使用一个简单的SVG占位符头像
+            data, content_type = DEFAULT_SVG_AVATAR, 'image/svg+xml'
+        _default_avatar = (content_type, data, 'default-' + hashlib.sha256(data).hexdigest()[:16])
+    return _default_avatar
@@ -0,0 +1,112 @@
+"""按用户答题位图抽题的压测：位图拒绝采样 vs 每次用NOT IN子查询排除做过的题
+
+题库有10万道题，每个用户答过5万道题，比较两种方式抽10道题的耗时，
+并测量位图的存储大小和从数据库加载的耗时。
+
+用法: python benchmarks/bench_adaptive_sampler.py [--questions 100000] [--answered 50000] [--users 5]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import answered_sets
+import migrations
+from db_pool import ConnectionPool
+
+NAIVE_SAMPLE = """
+    SELECT id FROM questions
+    WHERE id NOT IN (SELECT question_id FROM answer_records WHERE user_id = ?)
+    ORDER BY RANDOM() LIMIT 10
+"""
+
+
+def populate(db, questions, users, answered):
+    db.executemany("""
+        INSERT INTO questions (question_text, option_a, option_b, option_c, option_d, correct_answer)
+        VALUES (?, 'A', 'B', 'C', 'D', 'A')
+    """, [(f'题目{i}',) for i in range(questions)])
+    db.executemany('INSERT INTO users (username, password) VALUES (?, ?)',
+                   [(f'user{i}', 'x') for i in range(users)])
+    for user in range(users):
+        ids = random.sample(range(1, questions + 1), answered)
+        db.executemany(
+            'INSERT INTO answer_records (user_id, question_id, user_answer, is_correct) VALUES (?, ?, ?, ?)',
+            [(user + 1, question_id, 'A', 1 if random.random() < 0.7 else 0) for question_id in ids]
+        )
+    db.commit()
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--questions', type=int, default=100000)
+    parser.add_argument('--answered', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    random.seed(1)
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = ConnectionPool(os.path.join(tmp, 'database.db'), max_size=1)
+        db = pool.acquire()
+        migrations.upgrade(db, target=1)
+        start = time.perf_counter()
+        populate(db, args.questions, args.users, args.answered)
+        print(f'生成 {args.users} 个用户 x {args.answered} 条答题记录: {time.perf_counter() - start:.1f} s')
+        migrations.upgrade(db)
+
+        ids = [row[0] for row in db.execute('SELECT id FROM questions')]
+        # 线上由QuestionSampler提供 in 判断，这里用集合代替
+        known = set(ids)
+        sizes = db.execute(
+            'SELECT AVG(LENGTH(answered)), AVG(LENGTH(wrong)) FROM user_answer_sets'
+        ).fetchone()
+        answer_set = answered_sets.load(db, 1)
+        users = list(range(1, args.users + 1))
+
+        naive_repeat = max(1, args.repeat // 10)
+        results = [
+            ('NOT IN 子查询', timed(lambda: db.execute(NAIVE_SAMPLE, (rng.choice(users),)).fetchall(),
+                                  naive_repeat)),
+            ('加载位图', timed(lambda: answered_sets.load(db, rng.choice(users)), args.repeat)),
+            ('缓存命中检查', timed(lambda: answered_sets.answer_sets.get(db, rng.choice(users)), args.repeat)),
+            ('位图抽题', timed(lambda: answer_set.choose(ids, 10, 0.3, rng, known=known), args.repeat)),
+            ('位图抽题(无复习)', timed(lambda: answer_set.choose(ids, 10, 0.0, rng, known=known), args.repeat)),
+        ]
+
+        # 抽到的题中没做过的和错题的比例
+        fresh = review = 0
+        for _ in range(100):
+            for question_id in answer_set.choose(ids, 10, 0.3, rng, known=known):
+                if question_id not in answer_set.answered:
+                    fresh += 1
+                elif question_id in answer_set.wrong:
+                    review += 1
+        pool.release(db)
+        pool.close_all()
+
+    print(f'位图平均大小: 已答 {sizes[0]:.0f} 字节, 错题 {sizes[1]:.0f} 字节')
+    print(f'抽出的1000道题中: 没做过 {fresh}, 复习错题 {review}, 其它 {1000 - fresh - review}')
+    print(f'{"操作":<20}{"中位耗时ms":>12}')
+    for name, ms in results:
+        print(f'{name:<20}{ms:>12.3f}')
+
+
+if __name__ == '__main__':
+    main()
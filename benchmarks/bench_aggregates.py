@@ -0,0 +1,132 @@
+"""排行榜和题目统计的压测：预计算汇总表 vs 每次请求对answer_records做GROUP BY
+
+在临时数据库中生成数百万条模拟答题记录，比较两种方式的查询耗时，
+并测量增量维护（每批答题写入时累加）和全量重建的开销：
+全量重建分别以一个写事务完成和按每段约 --chunk-records 条记录分段完成，
+后者的单段最长耗时即重建期间答题写入最多需要等待的时间。
+
+用法: python benchmarks/bench_aggregates.py [--records 2000000] [--users 5000] [--questions 500] [--chunk-records 10000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import aggregates
+import migrations
+import user_stats
+from db_pool import ConnectionPool
+
+NAIVE_LEADERBOARD = """
+    SELECT r.user_id, u.username, SUM(r.is_correct) AS correct_answers, COUNT(*) AS total_answers
+    FROM answer_records r JOIN users u ON u.id = r.user_id
+    GROUP BY r.user_id ORDER BY correct_answers DESC, total_answers ASC, r.user_id ASC LIMIT 10
+"""
+
+NAIVE_HARDEST = """
+    SELECT r.question_id, q.question_text, COUNT(*) AS attempts, SUM(r.is_correct) AS correct
+    FROM answer_records r JOIN questions q ON q.id = r.question_id
+    GROUP BY r.question_id HAVING attempts >= 5
+    ORDER BY CAST(correct AS REAL) / attempts LIMIT 10
+"""
+
+
+def populate(db, records, users, questions, batch=100000):
+    db.executemany('INSERT INTO users (username, password) VALUES (?, ?)',
+                   [(f'user{i}', 'x') for i in range(users)])
+    db.executemany("""
+        INSERT INTO questions (question_text, option_a, option_b, option_c, option_d, correct_answer)
+        VALUES (?, 'A', 'B', 'C', 'D', 'A')
+    """, [(f'题目{i}',) for i in range(questions)])
+    db.commit()
+    # 每道题有不同的难度，每个用户有不同的水平
+    difficulty = [random.random() for _ in range(questions)]
+    skill = [random.random() for _ in range(users)]
+    written = 0
+    while written < records:
+        rows = []
+        for _ in range(min(batch, records - written)):
+            user = random.randrange(users)
+            question = random.randrange(questions)
+            correct = 1 if random.random() < (skill[user] + 1 - difficulty[question]) / 2 else 0
+            rows.append((user + 1, question + 1, 'A', correct))
+        db.executemany(
+            'INSERT INTO answer_records (user_id, question_id, user_answer, is_correct) VALUES (?, ?, ?, ?)', rows
+        )
+        db.commit()
+        written += len(rows)
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=2000000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--questions', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--chunk-records', type=int, default=10000)
+    args = parser.parse_args()
+    random.seed(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = ConnectionPool(os.path.join(tmp, 'database.db'), max_size=1)
+        db = pool.acquire()
+        migrations.upgrade(db, target=1)
+        start = time.perf_counter()
+        populate(db, args.records, args.users, args.questions)
+        print(f'生成 {args.records} 条答题记录: {time.perf_counter() - start:.1f} s')
+        migrations.upgrade(db)
+
+        rebuilds = []
+        for name, chunk_records in (('一个写事务', 1 << 40), (f'每段约{args.chunk_records}条记录', args.chunk_records)):
+            start = time.perf_counter()
+            _, _, longest_ms = aggregates.rebuild(db, chunk_records)
+            rebuilds.append((name, (time.perf_counter() - start) * 1000, longest_ms))
+
+        naive_repeat = max(1, args.repeat // 5)
+        results = [
+            ('排行榜 GROUP BY', timed(lambda: db.execute(NAIVE_LEADERBOARD).fetchall(), naive_repeat)),
+            ('排行榜 汇总表', timed(lambda: aggregates.leaderboard(db, 10), args.repeat)),
+            ('个人名次 汇总表', timed(lambda: aggregates.user_rank(db, args.users // 2), args.repeat)),
+            ('最难题目 GROUP BY', timed(lambda: db.execute(NAIVE_HARDEST).fetchall(), naive_repeat)),
+            ('最难题目 汇总表', timed(lambda: aggregates.hardest_questions(db, 10), args.repeat)),
+            ('单题统计 汇总表', timed(lambda: aggregates.question_stats(db, 1), args.repeat)),
+        ]
+
+        # 模拟答题写入线程的一批记录：写入answer_records并增量更新两张汇总表
+        def write_batch():
+            batch = [(random.randrange(args.users) + 1, random.randrange(args.questions) + 1, 'A',
+                      random.randint(0, 1), '2024-01-01 00:00:00') for _ in range(100)]
+            with db:
+                db.executemany('INSERT INTO answer_records (user_id, question_id, user_answer, is_correct, '
+                               'answered_at) VALUES (?, ?, ?, ?, ?)', batch)
+                user_stats.record_answers(db, batch)
+                aggregates.record_answers(db, batch)
+
+        results.append(('写入100条+增量更新', timed(write_batch, args.repeat)))
+        pool.release(db)
+        pool.close_all()
+
+    for name, total_ms, longest_ms in rebuilds:
+        print(f'全量重建汇总表（{name}）: 合计 {total_ms:.0f} ms，单个写事务最长 {longest_ms:.0f} ms')
+    print(f'{"操作":<22}{"中位耗时ms":>12}')
+    for name, ms in results:
+        print(f'{name:<22}{ms:>12.3f}')
+
+
+if __name__ == '__main__':
+    main()
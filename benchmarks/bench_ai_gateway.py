@@ -0,0 +1,69 @@
+"""对比每次请求新建OpenAI客户端与复用AIGateway的单次调用开销
+
+使用本地模拟服务（零生成延迟），测得的差值即为配置读取、客户端创建和建立连接的开销。
+用法: python benchmarks/bench_ai_gateway.py [--requests 200]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ai_gateway import AIGateway
+from fake_openai_server import start_in_thread
+
+MESSAGES = [{'role': 'user', 'content': '福州为什么叫榕城'}]
+
+
+def per_request_client(config_path):
+    # 与改造前 api_chat 的做法相同：每次读取ai.json并创建新客户端
+    with open(config_path, 'r', encoding='utf-8') as f:
+        ai_config = json.load(f)
+    from openai import OpenAI
+    client = OpenAI(api_key=ai_config['deepseek_api_key'], base_url=ai_config['base_url'])
+    response = client.chat.completions.create(model='deepseek-chat', messages=MESSAGES, max_tokens=2000)
+    return response.choices[0].message.content
+
+
+def summarize(name, samples):
+    samples = sorted(samples)
+    p50 = samples[len(samples) // 2]
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f'{name:<22} mean {sum(samples) / len(samples):7.2f} ms   p50 {p50:7.2f} ms   p95 {p95:7.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    logging.getLogger('minpaixinyu.ai').setLevel(logging.ERROR)
+    server, base_url, _ = start_in_thread(tokens=1, token_delay=0)
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, 'ai.json')
+        with open(config_path, 'w', encoding='utf-8') as f:
+            json.dump({'deepseek_api_key': 'sk-bench', 'base_url': base_url}, f)
+
+        gateway = AIGateway(config_path=config_path)
+        per_request_client(config_path)
+        gateway.complete(MESSAGES)
+
+        for name, fn in (('per-request client', lambda: per_request_client(config_path)),
+                         ('AIGateway (reused)', lambda: gateway.complete(MESSAGES))):
+            samples = []
+            for _ in range(args.requests):
+                start = time.perf_counter()
+                fn()
+                samples.append((time.perf_counter() - start) * 1000)
+            summarize(name, samples)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""每个进程的AI问答并发能力：同步视图（线程池）vs ASGI原生异步视图
+
+两种模式都用uvicorn在子进程中运行 asgi.Application，线程池大小相同（--threads）：
+- sync：native_chat=False，/api/chat 仍由Flask同步视图处理，每个问答在等待上游期间占用一个线程；
+- asgi：/api/chat 由异步视图处理，等待上游时不占线程。
+上游为本地模拟服务，每个回答耗时约 tokens * token_delay 秒；关闭回答缓存，每个请求都访问上游。
+对每个并发级别统计完成的问答数/秒和延迟分位数。
+
+用法（需要 pip install uvicorn）:
+    python benchmarks/bench_asgi_chat.py [--concurrency 16,64,256] [--threads 16] [--stream]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+
+def serve(args):
+    import logging
+    os.environ['MINPAIXINYU_DATABASE'] = args.database
+    import uvicorn
+
+    from app import app
+    app.config['ASGI_WSGI_THREADS'] = args.threads
+    app.config['CHAT_MAX_STREAMS'] = 100000
+
+    import asgi
+    from ai_gateway import gateway
+    from answer_cache import answer_cache
+
+    gateway.config_path = args.ai_config
+    answer_cache.enabled = False
+    # 压测客户端用同一个用户并发提问，关闭限流和每用户并发名额
+    from request_limits import limiter
+    limiter.enabled = False
+    logging.getLogger('minpaixinyu.ai').setLevel(logging.ERROR)
+    application = asgi.Application(app, native_chat=args.mode == 'asgi')
+    if args.mode == 'sync':
+        # 同步视图的流式回答数量由 chat_stream_slots 限制，压测时放开
+        import app as app_module
+        import threading
+        app_module.chat_stream_slots = threading.BoundedSemaphore(100000)
+    print('ready', flush=True)
+    uvicorn.run(application, host='127.0.0.1', port=args.port, log_level='warning', lifespan='on',
+                backlog=4096, limit_concurrency=None)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, database, ai_config, threads):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'serve', '--mode', mode, '--database', database,
+         '--ai-config', ai_config, '--port', str(port), '--threads', str(threads)],
+        cwd=ROOT, stdout=subprocess.PIPE, text=True,
+    )
+    for line in process.stdout:
+        if line.strip() == 'ready':
+            break
+    else:
+        raise RuntimeError('服务启动失败')
+    base_url = f'http://127.0.0.1:{port}'
+    # 等待uvicorn开始监听
+    for _ in range(100):
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.1):
+                break
+        except OSError:
+            time.sleep(0.1)
+    return process, base_url
+
+
+async def drive(base_url, concurrency, duration, stream, warmup):
+    import httpx
+
+    limits = httpx.Limits(max_connections=concurrency + 10, max_keepalive_connections=concurrency + 10)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0, limits=limits) as client:
+        await client.post('/login', data={'username': 'bench', 'password': 'bench123'})
+        latencies, errors = [], 0
+        # 预热期间建立到服务端和上游的keep-alive连接，不计入统计
+        measure_start = time.perf_counter() + warmup
+        deadline = measure_start + duration
+        counter = [0]
+
+        async def one():
+            counter[0] += 1
+            payload = {'question': f'福建的第{counter[0]}个问题', 'stream': stream}
+            start = time.perf_counter()
+            if stream:
+                async with client.stream('POST', '/api/chat', json=payload) as response:
+                    text = ''.join([chunk async for chunk in response.aiter_text()])
+                    ok = response.status_code == 200 and '"done": true' in text and '"fallback"' not in text
+            else:
+                response = await client.post('/api/chat', json=payload)
+                ok = response.status_code == 200 and 'answer' in response.json()
+            return ok, time.perf_counter() - start
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    ok, elapsed = await one()
+                except Exception:
+                    ok, elapsed = False, 0
+                if started < measure_start:
+                    continue
+                if ok:
+                    latencies.append(elapsed * 1000)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - measure_start
+    latencies.sort()
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))], 1) if latencies else None
+
+    return {
+        'concurrency': concurrency,
+        'completed': len(latencies),
+        'errors': errors,
+        'chats_per_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': pct(50),
+        'p95_ms': pct(95),
+        'p99_ms': pct(99),
+    }
+
+
+def run(args):
+    from fake_openai_server import start_in_thread
+
+    ai_server, ai_base_url, _ = start_in_thread(tokens=args.tokens, token_delay=args.token_delay)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'database.db')
+        ai_config = os.path.join(tmp, 'ai.json')
+        with open(ai_config, 'w', encoding='utf-8') as f:
+            json.dump({'deepseek_api_key': 'sk-bench', 'base_url': ai_base_url}, f)
+        for mode in ('sync', 'asgi'):
+            process, base_url = start_server(mode, database, ai_config, args.threads)
+            try:
+                if mode == 'sync':
+                    import httpx
+                    httpx.post(f'{base_url}/register', data={'username': 'bench', 'password': 'bench123'})
+                results[mode] = [
+                    asyncio.run(drive(base_url, concurrency, args.duration, args.stream, args.warmup))
+                    for concurrency in (int(value) for value in args.concurrency.split(','))
+                ]
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+    ai_server.shutdown()
+
+    answer_s = args.tokens * args.token_delay
+    print(f'上游每个回答约 {answer_s:.2f} s，线程池 {args.threads} 个线程，'
+          f'{"流式" if args.stream else "非流式"}，每级 {args.duration:.0f} s')
+    print(f'{"模式":<6}{"并发":>6}{"完成":>8}{"错误":>6}{"问答/秒":>10}{"p50ms":>10}{"p95ms":>10}{"p99ms":>10}')
+    for mode, levels in results.items():
+        for level in levels:
+            print(f'{mode:<6}{level["concurrency"]:>6}{level["completed"]:>8}{level["errors"]:>6}'
+                  f'{level["chats_per_s"]:>10}{level["p50_ms"] or 0:>10}{level["p95_ms"] or 0:>10}'
+                  f'{level["p99_ms"] or 0:>10}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    server = subparsers.add_parser('serve', help='（内部使用）运行服务端')
+    server.add_argument('--mode', choices=('sync', 'asgi'), required=True)
+    server.add_argument('--database', required=True)
+    server.add_argument('--ai-config', required=True)
+    server.add_argument('--port', type=int, required=True)
+    server.add_argument('--threads', type=int, default=16)
+
+    parser.add_argument('--concurrency', default='16,64,256')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warmup', type=float, default=3.0)
+    parser.add_argument('--tokens', type=int, default=20)
+    parser.add_argument('--token-delay', type=float, default=0.025)
+    parser.add_argument('--stream', action='store_true')
+    args = parser.parse_args()
+    if args.command == 'serve':
+        serve(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""比较各精度地图数据的体积、压缩后大小、预计传输时间与解析耗时
+
+用法: python benchmarks/bench_geojson_variants.py [--bandwidth 2,10]
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import geo_assets
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bandwidth', default='2,10', help='估算传输时间使用的带宽（Mbps），逗号分隔')
+    args = parser.parse_args()
+    bandwidths = [float(b) for b in args.bandwidth.split(',')]
+
+    source = os.path.join(ROOT, 'static', geo_assets.SOURCE_NAME)
+    with open(source, 'rb') as f:
+        original = f.read()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, 'static'))
+        with open(os.path.join(tmp, 'static', geo_assets.SOURCE_NAME), 'wb') as f:
+            f.write(original)
+        start = time.perf_counter()
+        geo_assets.build(tmp, force=True)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        rows = [('original', 'geojson', original)]
+        for detail in geo_assets.DETAIL_LEVELS:
+            for fmt in geo_assets.FORMATS:
+                path = os.path.join(tmp, geo_assets.BUILD_DIR, geo_assets.artifact_name(detail, fmt))
+                with open(path, 'rb') as f:
+                    rows.append((detail, fmt, f.read()))
+
+    header = f"{'detail':<9}{'format':<10}{'raw KB':>9}{'gzip KB':>9}{'br KB':>8}{'parse ms':>10}"
+    header += ''.join(f'{f"@{b:g}Mbps ms":>14}' for b in bandwidths)
+    print(header)
+    for detail, fmt, data in rows:
+        gz = len(gzip.compress(data, compresslevel=9))
+        br = len(brotli.compress(data, quality=11)) if brotli else None
+        start = time.perf_counter()
+        for _ in range(20):
+            json.loads(data)
+        parse_ms = (time.perf_counter() - start) * 1000 / 20
+        wire = br or gz
+        line = f'{detail:<9}{fmt:<10}{len(data) / 1024:>9.1f}{gz / 1024:>9.1f}'
+        line += f'{br / 1024:>8.1f}' if br else f"{'-':>8}"
+        line += f'{parse_ms:>10.2f}'
+        line += ''.join(f'{wire * 8 / (b * 1000):>14.1f}' for b in bandwidths)
+        print(line)
+    print(f'\n构建全部版本耗时 {build_ms:.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""请求和SQL统计的开销测试
+
+用一个最小的Flask应用模拟典型接口（每个请求执行若干条SQL），比较不加统计、启用统计、
+以及启用统计并记录慢请求明细时每个请求的耗时；端到端耗时受机器抖动影响较大，
+因此另外直接测量统计钩子本身和一条语句经过TracedConnection回调的开销。
+
+用法: python benchmarks/bench_metrics_overhead.py [--requests 5000] [--statements 5]
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask, g, jsonify
+
+import metrics as metrics_module
+from db_pool import ConnectionPool
+from metrics import metrics
+
+
+def build_app(pool, statements, instrumented):
+    app = Flask(__name__)
+    if instrumented:
+        metrics_module.init_app(app)
+
+    @app.route('/item/<int:item_id>')
+    def item(item_id):
+        db = pool.acquire()
+        db.on_statement = metrics.statement_hook()
+        try:
+            rows = [db.execute('SELECT id, name FROM items WHERE id = ?', (item_id + i,)).fetchone()
+                    for i in range(statements)]
+        finally:
+            pool.release(db)
+        return jsonify({'count': sum(1 for row in rows if row)})
+
+    @app.teardown_appcontext
+    def teardown(e=None):
+        g.pop('_metrics_trace', None)
+
+    return app
+
+
+def per_request_us(app, requests):
+    client = app.test_client()
+    for i in range(200):
+        client.get(f'/item/{i % 1000}')
+    start = time.perf_counter()
+    for i in range(requests):
+        client.get(f'/item/{i % 1000}')
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def hooks_us(app, statements, repeat):
+    """直接测量 before_request + 记录语句 + after_request 的耗时，不受请求处理本身抖动的影响"""
+    response = app.response_class('{}')
+    with app.test_request_context('/item/1'):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            metrics.before_request()
+            hook = metrics.statement_hook()
+            for i in range(statements):
+                hook('SELECT id, name FROM items WHERE id = ?', 0.0001)
+            metrics.after_request(response)
+        return (time.perf_counter() - start) / repeat * 1e6
+
+
+def statement_us(conn, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        conn.execute('SELECT id, name FROM items WHERE id = ?', (i % 1000,)).fetchone()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--statements', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+    logging.getLogger('minpaixinyu.metrics').disabled = True
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        pool = ConnectionPool(path, max_size=1)
+        db = pool.acquire()
+        db.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)')
+        db.executemany('INSERT INTO items VALUES (?, ?)', [(i, f'item{i}') for i in range(2000)])
+        db.commit()
+        pool.release(db)
+
+        plain = build_app(pool, args.statements, instrumented=False)
+        instrumented = build_app(pool, args.statements, instrumented=True)
+        results = {}
+        # 交替运行多轮取最小值，减少机器抖动的影响
+        for _ in range(args.rounds):
+            for name, setup in (
+                ('不统计', lambda: plain),
+                ('启用统计', lambda: (setattr(metrics, 'slow_request_ms', 0), instrumented)[1]),
+                ('统计+慢请求日志', lambda: (setattr(metrics, 'slow_request_ms', 0.001), instrumented)[1]),
+            ):
+                us = per_request_us(setup(), args.requests)
+                results[name] = min(results.get(name, us), us)
+        metrics.slow_request_ms = 0
+        hook_cost = hooks_us(instrumented, args.statements, 20000)
+
+        conn = sqlite3.connect(path)
+        traced = pool.acquire()
+        plain_us = statement_us(conn, 50000)
+        traced_us = statement_us(traced, 50000)
+        trace = metrics_module.RequestTrace()
+        traced.on_statement = trace.record_statement
+        hooked_us = statement_us(traced, 50000)
+        traced.on_statement = None
+        pool.release(traced)
+        conn.close()
+        pool.close_all()
+
+    base = results['不统计']
+    print(f'每个请求执行 {args.statements} 条SQL，{args.requests} 个请求')
+    print(f'{"配置":<18}{"每请求us":>12}{"额外开销":>12}')
+    for name, us in results.items():
+        print(f'{name:<18}{us:>12.1f}{us - base:>+12.1f}')
+    print(f'统计钩子本身（每请求）: {hook_cost:.1f} us')
+    print(f'单条语句: sqlite3.Connection {plain_us:.2f} us, TracedConnection无回调 {traced_us:.2f} us, '
+          f'有回调 {hooked_us:.2f} us')
+
+
+if __name__ == '__main__':
+    main()
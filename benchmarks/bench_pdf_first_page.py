@@ -0,0 +1,114 @@
+"""比较电子书首屏需要传输的数据量与预计耗时：整本下载 vs 按页Range请求
+
+生成一个多页的测试PDF（不提供--pdf时），通过应用的 /source/ 路由分别测量
+整本下载和只请求首页对象所需字节范围的耗时，并按给定带宽估算首屏时间。
+
+用法: python benchmarks/bench_pdf_first_page.py [--pages 200] [--page-kb 60] [--bandwidth 2,10] [--pdf path]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pypdf import PdfWriter
+from pypdf.generic import NameObject, StreamObject
+
+from pdf_assets import PdfAssets, build_manifest
+
+
+def make_pdf(path, pages, page_kb):
+    """每页带一个不可压缩的内容流，模拟扫描版电子书"""
+    writer = PdfWriter()
+    for _ in range(pages):
+        page = writer.add_blank_page(595, 842)
+        stream = StreamObject()
+        # 注释行不影响渲染，只用来撑大页面体积
+        stream.set_data(b'% ' + os.urandom(page_kb * 1024).hex().encode()[:page_kb * 1024] + b'\n')
+        page[NameObject('/Contents')] = writer._add_object(stream)
+    with open(path, 'wb') as f:
+        writer.write(f)
+
+
+def timed_get(client, url, headers=None):
+    start = time.perf_counter()
+    response = client.get(url, headers=headers or {})
+    data = response.get_data()
+    return (time.perf_counter() - start) * 1000, response.status_code, len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--page-kb', type=int, default=60)
+    parser.add_argument('--bandwidth', default='2,10', help='估算传输时间使用的带宽（Mbps），逗号分隔')
+    parser.add_argument('--pdf', help='使用已有的PDF文件')
+    args = parser.parse_args()
+    bandwidths = [float(b) for b in args.bandwidth.split(',')]
+
+    from flask import Flask, request
+    from werkzeug.wsgi import wrap_file
+    from flask import Response
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, 'source'))
+        pdf_path = os.path.join(tmp, 'source', 'book.pdf')
+        if args.pdf:
+            shutil.copy(args.pdf, pdf_path)
+        else:
+            make_pdf(pdf_path, args.pages, args.page_kb)
+
+        start = time.perf_counter()
+        manifest = build_manifest(pdf_path)
+        manifest_ms = (time.perf_counter() - start) * 1000
+
+        # 与app.py中serve_pdf相同的响应方式，避免依赖项目数据库
+        assets = PdfAssets()
+        assets.root_path = tmp
+        app = Flask(__name__)
+
+        @app.route('/source/<path:filename>')
+        def serve(filename):
+            meta = assets.resolve(filename)
+            response = Response(wrap_file(request.environ, open(meta.path, 'rb')),
+                                mimetype='application/pdf', direct_passthrough=True)
+            response.content_length = meta.size
+            response.set_etag(meta.etag)
+            return response.make_conditional(request, accept_ranges=True, complete_length=meta.size)
+
+        client = app.test_client()
+        size = manifest['size']
+        full_ms, status, full_bytes = timed_get(client, '/source/book.pdf')
+        assert status == 200 and full_bytes == size
+
+        # PDF.js首屏：读取文件末尾的交叉引用表，再读取第一页对象
+        tail = min(size, 65536)
+        requests = [(size - tail, size - 1)] + [(start, end - 1) for start, end in manifest['pages'][0]['ranges']]
+        range_ms, range_bytes = 0.0, 0
+        for first, last in requests:
+            elapsed, status, length = timed_get(client, '/source/book.pdf',
+                                                {'Range': f'bytes={first}-{last}'})
+            assert status == 206
+            range_ms += elapsed
+            range_bytes += length
+
+        revalidate_ms, status, _ = timed_get(client, '/source/book.pdf',
+                                             {'If-None-Match': f'"{assets.resolve("book.pdf").etag}"'})
+        assert status == 304
+
+    print(f'PDF: {manifest["page_count"]} 页, {size / 1024 / 1024:.2f} MB, 生成分页索引 {manifest_ms:.1f} ms')
+    print(f'{"方式":<14}{"传输字节":>14}{"请求数":>8}{"服务端ms":>10}' +
+          ''.join(f'{f"{b:g}Mbps首屏ms":>16}' for b in bandwidths))
+    for name, count, nbytes, ms in (('整本下载', 1, full_bytes, full_ms),
+                                    ('Range首页', len(requests), range_bytes, range_ms)):
+        estimates = ''.join(f'{nbytes * 8 / (b * 1e6) * 1000:>16.0f}' for b in bandwidths)
+        print(f'{name:<14}{nbytes:>14}{count:>8}{ms:>10.1f}{estimates}')
+    print(f'304重新验证: {revalidate_ms:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
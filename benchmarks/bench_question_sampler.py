@@ -0,0 +1,79 @@
+"""对比 ORDER BY RANDOM() 与 QuestionSampler 的抽题耗时
+
+用法: python benchmarks/bench_question_sampler.py [--sizes 1000,100000,1000000] [--rounds 50]
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from question_sampler import QuestionSampler
+
+
+def build_db(path, rows):
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    db.execute("""
+        CREATE TABLE questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question_text TEXT NOT NULL,
+            option_a TEXT NOT NULL,
+            option_b TEXT NOT NULL,
+            option_c TEXT NOT NULL,
+            option_d TEXT NOT NULL,
+            correct_answer TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    db.executemany(
+        'INSERT INTO questions (question_text, option_a, option_b, option_c, option_d, correct_answer) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        ((f'第{i}题：福建省的省会是哪个城市？', '厦门市', '福州市', '泉州市', '漳州市', 'B')
+         for i in range(rows))
+    )
+    db.commit()
+    return db
+
+
+def timed(fn, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,100000,1000000')
+    parser.add_argument('--rounds', type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'order_by_random p50/p95 (ms)':>30} {'sampler p50/p95 (ms)':>24} {'index load (ms)':>16}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = build_db(os.path.join(tmp, 'bench.db'), size)
+
+            baseline = timed(
+                lambda: db.execute('SELECT * FROM questions ORDER BY RANDOM() LIMIT 10').fetchall(),
+                args.rounds)
+
+            sampler = QuestionSampler()
+            start = time.perf_counter()
+            sampler.refresh(db)
+            load_ms = (time.perf_counter() - start) * 1000
+            sampled = timed(lambda: sampler.sample(db, 10), args.rounds)
+
+            db.close()
+        print(f'{size:>10} {baseline[0]:>14.3f} / {baseline[1]:<13.3f} '
+              f'{sampled[0]:>11.3f} / {sampled[1]:<10.3f} {load_ms:>16.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""题库快照（mmap）vs 进程内题目缓存：每个worker的内存占用和按id取题的耗时
+
+生成N道题的数据库和快照后，从同一个父进程fork出W个worker（与gunicorn --preload相同），
+每个worker把全部题目读一遍：
+- cache：通过QuestionCache（容量足够大）把全部题目加载进进程内存；
+- snapshot：映射快照文件并逐题解码一次。
+全部worker加载完成后同时读取 /proc/self/smaps_rollup，比较私有内存（USS）和按比例分摊的PSS。
+另外测量单进程内 get_many(10个随机id) 的耗时：快照、缓存命中、直接查询SQLite。
+
+用法: python benchmarks/bench_question_snapshot.py [--questions 200000] [--workers 4]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import migrations
+import questions_io
+from db_pool import ConnectionPool
+from question_cache import QuestionCache
+from question_snapshot import QuestionSnapshot, QuestionStore
+
+
+def memory_kb():
+    values = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    return values.get('Private_Clean', 0) + values.get('Private_Dirty', 0), values.get('Pss', 0)
+
+
+def worker(mode, database, snapshot_path, ids, barrier, results):
+    before_uss, _ = memory_kb()
+    if mode == 'cache':
+        pool = ConnectionPool(database, max_size=1)
+        db = pool.acquire()
+        cache = QuestionCache(max_size=len(ids) + 1)
+        for start in range(0, len(ids), 500):
+            cache.get_many(db, ids[start:start + 500])
+        holder = cache
+    else:
+        snapshot = QuestionSnapshot(snapshot_path)
+        for i in range(len(snapshot)):
+            snapshot.record(i)
+        holder = snapshot
+    barrier.wait()
+    uss, pss = memory_kb()
+    results.put((mode, uss - before_uss, pss))
+    barrier.wait()
+    del holder
+
+
+def per_worker_memory(mode, database, snapshot_path, ids, workers):
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(mode, database, snapshot_path, ids, barrier, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    rows = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    uss = sum(row[1] for row in rows) / workers / 1024
+    pss = sum(row[2] for row in rows) / workers / 1024
+    return uss, pss
+
+
+def lookup_us(func, ids, rounds=2000):
+    rng = random.Random(1)
+    samples = [rng.sample(ids, 10) for _ in range(rounds)]
+    start = time.perf_counter()
+    for sample in samples:
+        func(sample)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--questions', type=int, default=200000)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'database.db')
+        pool = ConnectionPool(database, max_size=1)
+        db = pool.acquire()
+        migrations.upgrade(db)
+        questions_io.import_rows(db, (
+            (i, (f'第{i}题：下列关于福建的说法中，哪一项是正确的？', f'选项甲{i}', f'选项乙{i}', f'选项丙{i}',
+                 f'选项丁{i}', 'ABCD'[i % 4]))
+            for i in range(args.questions)
+        ))
+        ids = [row[0] for row in db.execute('SELECT id FROM questions')]
+
+        store = QuestionStore(QuestionCache(max_size=len(ids) + 1), auto_build=False)
+        store.directory = tmp
+        store.database = database
+        start = time.perf_counter()
+        path = store.build(db)
+        build_s = time.perf_counter() - start
+        snapshot = QuestionSnapshot(path)
+        print(f'{len(ids)} 道题目，快照 {snapshot.size / 1024 / 1024:.1f} MB，生成用时 {build_s:.2f} s')
+
+        cache = QuestionCache(max_size=len(ids) + 1)
+        for begin in range(0, len(ids), 500):
+            cache.get_many(db, ids[begin:begin + 500])
+        cold = QuestionCache(max_size=0)
+        print(f'get_many(10) 耗时: 快照 {lookup_us(snapshot.get_many, ids):.1f} us，'
+              f'缓存命中 {lookup_us(lambda s: cache.get_many(db, s), ids):.1f} us，'
+              f'SQLite查询 {lookup_us(lambda s: cold.get_many(db, s), ids):.1f} us')
+        del cache, cold
+        pool.release(db)
+        pool.close_all()
+
+        print(f'{args.workers} 个worker各自读取全部题目后的内存（每个worker平均）:')
+        for mode in ('cache', 'snapshot'):
+            uss, pss = per_worker_memory(mode, database, path, ids, args.workers)
+            print(f'  {mode:<9} 私有内存增加 {uss:7.1f} MB   PSS {pss:7.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""题库批量导入的吞吐量和峰值内存
+
+生成一个N行的CSV题库（约1%重复、0.1%无效行），分别在独立子进程中导入空数据库：
+- pipeline：questions_io.import_file，流式解析、executemany分批写入、每10万行一个事务；
+- naive：先把整个文件读进列表，再逐行execute（与 init_test_questions 的写法相同），
+  版本号触发器逐行执行，最后一次提交；只导入前 --naive-rows 行以控制耗时。
+峰值内存为子进程的 ru_maxrss，同时给出导入前的基线。
+
+用法: python benchmarks/bench_questions_import.py [--rows 1000000] [--naive-rows 200000]
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def generate(path, rows, seed=1):
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('question_text', 'option_a', 'option_b', 'option_c', 'option_d', 'correct_answer'))
+        for i in range(rows):
+            roll = rng.random()
+            if roll < 0.01 and i:
+                # 重复之前的某一道题
+                n = rng.randrange(i)
+            else:
+                n = i
+            answer = rng.choice('ABCD') if roll >= 0.001 else 'E'
+            writer.writerow((f'第{n}题：下列关于福建的说法中，哪一项是正确的？', f'选项甲{n}', f'选项乙{n}',
+                             f'选项丙{n}', f'选项丁{n}', answer))
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_import(args):
+    import migrations
+    import questions_io
+    from db_pool import ConnectionPool
+
+    pool = ConnectionPool(args.database, max_size=1)
+    db = pool.acquire()
+    migrations.upgrade(db)
+    db.execute('DELETE FROM questions')
+    db.commit()
+    baseline = max_rss_mb()
+    start = time.perf_counter()
+    if args.mode == 'pipeline':
+        report = questions_io.import_file(db, args.file)
+        read, inserted = report.read, report.inserted
+    else:
+        with open(args.file, encoding='utf-8', newline='') as f:
+            records = list(questions_io.read_csv(f))[:args.limit]
+        read, inserted = len(records), 0
+        for _line_no, record in records:
+            try:
+                row = questions_io.parse_row(record)
+            except questions_io.RowError:
+                continue
+            cursor = db.execute(questions_io.INSERT_SQL, row)
+            inserted += cursor.rowcount
+        db.commit()
+    seconds = time.perf_counter() - start
+    count = db.execute('SELECT COUNT(*) FROM questions').fetchone()[0]
+    pool.release(db)
+    print(json.dumps({
+        'read': read, 'inserted': inserted, 'rows_in_table': count, 'seconds': round(seconds, 2),
+        'rows_per_s': round(read / seconds), 'baseline_mb': round(baseline, 1), 'peak_mb': round(max_rss_mb(), 1),
+    }))
+
+
+def measure(mode, file, database, limit=None):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+    command = [sys.executable, os.path.abspath(__file__), 'import', '--mode', mode,
+               '--file', file, '--database', database]
+    if limit:
+        command += ['--limit', str(limit)]
+    output = subprocess.run(command, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command')
+    child = subparsers.add_parser('import', help='（内部使用）在子进程中导入')
+    child.add_argument('--mode', choices=('pipeline', 'naive'), required=True)
+    child.add_argument('--file', required=True)
+    child.add_argument('--database', required=True)
+    child.add_argument('--limit', type=int, default=None)
+
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--naive-rows', type=int, default=200000)
+    args = parser.parse_args()
+    if args.command == 'import':
+        run_import(args)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        file = os.path.join(tmp, 'questions.csv')
+        start = time.perf_counter()
+        generate(file, args.rows)
+        size_mb = os.path.getsize(file) / 1024 / 1024
+        print(f'生成 {args.rows} 行CSV（{size_mb:.0f} MB）用时 {time.perf_counter() - start:.1f} s')
+        database = os.path.join(tmp, 'database.db')
+        results = [('pipeline', measure('pipeline', file, database))]
+        if args.naive_rows:
+            results.append(('naive', measure('naive', file, database, args.naive_rows)))
+
+    print(f'{"方式":<10}{"读取行数":>10}{"导入":>10}{"耗时s":>8}{"行/秒":>10}{"基线MB":>9}{"峰值MB":>9}')
+    for mode, r in results:
+        print(f'{mode:<10}{r["read"]:>10}{r["inserted"]:>10}{r["seconds"]:>8}{r["rows_per_s"]:>10}'
+              f'{r["baseline_mb"]:>9}{r["peak_mb"]:>9}')
+
+
+if __name__ == '__main__':
+    main()
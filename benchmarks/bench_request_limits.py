@@ -0,0 +1,123 @@
+"""限流检查的开销，以及超大上传在各层限制下的内存峰值
+
+1. 每次 limiter.check 的耗时：进程内计数 vs SQLite计数文件（单进程、多进程同时写同一个文件）；
+2. 以已登录用户向 /api/upload-avatar 上传一个 --upload-mb 大小的文件，用tracemalloc记录处理请求期间的内存峰值：
+   - 不限制：MAX_CONTENT_LENGTH=None，视图一次性 file.read()（改动前的行为）；
+   - 分块读取：MAX_CONTENT_LENGTH=None，视图用 avatar_store.read_upload，读到上限即停止；
+   - MAX_CONTENT_LENGTH：按声明的长度在解析请求体之前返回413。
+
+用法: python benchmarks/bench_request_limits.py [--checks 20000] [--processes 4] [--upload-mb 20]
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from request_limits import MemoryBackend, RateLimiter, SqliteBackend
+
+RULES = {'bench': {'user': '1000000/second', 'ip': '1000000/second'}}
+
+
+def run_checks(limiter, checks, offset=0):
+    start = time.perf_counter()
+    for i in range(checks):
+        limiter.check('bench', offset + i % 1000, '127.0.0.1')
+    return time.perf_counter() - start
+
+
+def _worker(path, checks, offset, results):
+    limiter = RateLimiter(SqliteBackend(path), RULES)
+    results.put(run_checks(limiter, checks, offset))
+
+
+def bench_checks(tmp, checks, processes):
+    memory = run_checks(RateLimiter(MemoryBackend(), RULES), checks)
+    path = os.path.join(tmp, 'ratelimit.db')
+    single = run_checks(RateLimiter(SqliteBackend(path), RULES), checks)
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    start = time.perf_counter()
+    workers = [context.Process(target=_worker, args=(path, checks, n * 1000, results)) for n in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    wall = time.perf_counter() - start
+    print(f'limiter.check（每次检查2条规则）:')
+    print(f'  进程内计数         {memory / checks * 1e6:8.1f} us/次')
+    print(f'  SQLite 单进程      {single / checks * 1e6:8.1f} us/次')
+    print(f'  SQLite {processes}进程并发   {checks * processes / wall:8.0f} 次/秒（合计）')
+
+
+def bench_upload(upload_mb):
+    from werkzeug.test import EnvironBuilder
+
+    from app import app
+    import avatar_store
+
+    from request_limits import limiter
+    limiter.enabled = False
+    client = app.test_client()
+    client.post('/register', data={'username': 'bench', 'password': 'bench123'})
+    client.post('/login', data={'username': 'bench', 'password': 'bench123'})
+    session_cookie = client.get_cookie('session').value
+    payload = b'\x89PNG\r\n\x1a\n' + bytes(upload_mb * 1024 * 1024)
+
+    def whole_file(file, limit=None, chunk_size=None):
+        return file.read()
+
+    results = []
+    read_upload = avatar_store.read_upload
+    for name, max_length, reader in (
+        ('不限制', None, whole_file),
+        ('分块读取', None, read_upload),
+        ('MAX_CONTENT_LENGTH', app.config['MAX_CONTENT_LENGTH'], read_upload),
+    ):
+        app.config['MAX_CONTENT_LENGTH'] = max_length
+        avatar_store.read_upload = reader
+        # 请求体事先编码好，只统计应用处理请求期间的分配
+        builder = EnvironBuilder(path='/api/upload-avatar', method='POST',
+                                 data={'avatar': (io.BytesIO(payload), 'a.png')})
+        environ = builder.get_environ()
+        environ['HTTP_COOKIE'] = f'session={session_cookie}'
+        statuses = []
+        tracemalloc.start()
+        start = time.perf_counter()
+        body = app.wsgi_app(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        b''.join(body)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        builder.close()
+        results.append((name, statuses[0].split()[0], peak / 1024 / 1024, elapsed * 1000))
+    avatar_store.read_upload = read_upload
+
+    print(f'上传 {upload_mb} MB 文件到 /api/upload-avatar，处理请求期间的内存峰值:')
+    for name, status, peak, ms in results:
+        print(f'  {name:<20}状态 {status}  内存峰值 {peak:7.1f} MB  {ms:8.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checks', type=int, default=20000)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--upload-mb', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bench_checks(tmp, args.checks, args.processes)
+        os.environ['MINPAIXINYU_DATABASE'] = os.path.join(tmp, 'database.db')
+        bench_upload(args.upload_mb)
+        from answer_writer import answer_writer
+        answer_writer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""比较每次启动时的数据库结构检查耗时：旧版逐表检查 vs 基于user_version的迁移
+
+旧版方式在每个进程启动时重复执行全部建表语句、表结构检查和测试题计数，
+这里用重复执行各迁移函数（不含统计回填）来模拟；新方式在结构已是最新时只读取一次 PRAGMA user_version。
+每轮都新建连接，模拟一个新启动的worker进程。
+
+用法: python benchmarks/bench_startup_schema.py [--boots 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import migrations
+from db_pool import ConnectionPool
+
+
+def legacy_boot(db):
+    for version, _, func in sorted(migrations.MIGRATIONS):
+        if func is migrations.create_user_stats:
+            db.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='user_stats'").fetchone()
+        else:
+            func(db)
+    db.execute('SELECT COUNT(*) FROM questions').fetchone()
+    db.commit()
+
+
+def migrated_boot(db):
+    migrations._schema_current = False
+    migrations.ensure_schema(db)
+
+
+def measure(path, boot, boots):
+    timings = []
+    for _ in range(boots):
+        start = time.perf_counter()
+        pool = ConnectionPool(path, max_size=1)
+        db = pool.acquire()
+        boot(db)
+        pool.release(db)
+        timings.append((time.perf_counter() - start) * 1000)
+        pool.close_all()
+    timings.sort()
+    return sum(timings) / len(timings), timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--boots', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'database.db')
+        pool = ConnectionPool(path, max_size=1)
+        db = pool.acquire()
+        start = time.perf_counter()
+        migrations.upgrade(db)
+        first_ms = (time.perf_counter() - start) * 1000
+        pool.release(db)
+        pool.close_all()
+
+        print(f'新数据库首次迁移到版本 {migrations.LATEST_VERSION}: {first_ms:.2f} ms')
+        print(f'{"方式":<16}{"平均ms":>10}{"中位ms":>10}{"p95 ms":>10}')
+        for name, boot in (('逐表检查(旧)', legacy_boot), ('user_version', migrated_boot)):
+            mean, median, p95 = measure(path, boot, args.boots)
+            print(f'{name:<16}{mean:>10.3f}{median:>10.3f}{p95:>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""用户信息缓存对每个请求SQL语句数的影响
+
+在临时数据库上启动应用，登录一个用户后反复访问常用接口，从 /metrics 的
+minpaixinyu_sql_statements_per_request 直方图读取各路由平均每个请求执行的语句数，
+分别在关闭缓存（USER_CACHE_TTL=0，每个请求查询一次users表）和默认缓存下运行。
+
+用法: python benchmarks/bench_user_context.py [--requests 200]
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ROUTES = (
+    ('GET', '/get-avatar'),
+    ('GET', '/api/check-login'),
+    ('GET', '/api/get-questions'),
+    ('GET', '/api/explorations'),
+    ('GET', '/api/leaderboard'),
+    ('GET', '/user-center'),
+)
+
+METRIC = re.compile(r'^minpaixinyu_sql_statements_per_request_(sum|count)\{route="([^"]+)"\} (\S+)$')
+
+
+def statements_per_request(client):
+    totals = {}
+    for line in client.get('/metrics').get_data(as_text=True).splitlines():
+        match = METRIC.match(line)
+        if match:
+            kind, route, value = match.groups()
+            totals.setdefault(route, {})[kind] = float(value)
+    return totals
+
+
+def run(app, requests):
+    client = app.test_client()
+    client.post('/login', data={'username': 'bench', 'password': 'bench123'})
+    before = statements_per_request(client)
+    timings = {}
+    for method, path in ROUTES:
+        start = time.perf_counter()
+        for _ in range(requests):
+            client.open(path, method=method)
+        timings[path] = (time.perf_counter() - start) / requests * 1000
+    after = statements_per_request(client)
+    result = {}
+    for _method, path in ROUTES:
+        old = before.get(path, {'sum': 0, 'count': 0})
+        new = after[path]
+        result[path] = ((new['sum'] - old['sum']) / (new['count'] - old['count']), timings[path])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['MINPAIXINYU_DATABASE'] = os.path.join(tmp, 'database.db')
+        from app import app
+        import user_context
+
+        app.config['STATS_ENDPOINTS_ENABLED'] = True
+
+        app.test_client().post('/register', data={'username': 'bench', 'password': 'bench123'})
+        results = {}
+        for name, ttl in (('不缓存', 0), ('缓存', user_context.USER_CONTEXT_DEFAULTS['USER_CACHE_TTL'])):
+            user_context.user_cache.ttl = ttl
+            user_context.user_cache.clear()
+            results[name] = run(app, args.requests)
+        stats = user_context.user_cache.stats()
+        from answer_writer import answer_writer
+        answer_writer.close()
+
+    print(f'{"路由":<22}{"不缓存 语句/请求":>16}{"缓存 语句/请求":>16}{"不缓存ms":>10}{"缓存ms":>10}')
+    for _method, path in ROUTES:
+        (old_statements, old_ms), (new_statements, new_ms) = results['不缓存'][path], results['缓存'][path]
+        print(f'{path:<22}{old_statements:>16.2f}{new_statements:>16.2f}{old_ms:>10.3f}{new_ms:>10.3f}')
+    print(f'用户缓存: {stats}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""本地模拟的OpenAI兼容接口，用于在不访问DeepSeek的情况下测试和压测AI问答
+
+用法: python benchmarks/fake_openai_server.py [--port 8765] [--tokens 50] [--token-delay 0.02]
+然后在ai.json中设置 "base_url": "http://127.0.0.1:8765/v1"
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    # 由 make_server 设置
+    tokens = 50
+    token_delay = 0.02
+    latency = 0.0
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _answer_tokens(self, question):
+        return [f'关于“{question[:10]}”，'] + [f'第{i}段回答。' for i in range(self.tokens)]
+
+    def do_POST(self):
+        if not self.path.endswith('/chat/completions'):
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        question = body.get('messages', [{}])[-1].get('content', '')
+        self.stats['requests'] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        if body.get('stream'):
+            self._stream(body, question)
+        else:
+            self._complete(body, question)
+
+    def _complete(self, body, question):
+        time.sleep(self.token_delay * self.tokens)
+        payload = json.dumps({
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': ''.join(self._answer_tokens(question))},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 10, 'completion_tokens': self.tokens, 'total_tokens': self.tokens + 10}
+        }, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _stream(self, body, question):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        def write(data):
+            raw = data.encode('utf-8')
+            self.wfile.write(f'{len(raw):x}\r\n'.encode() + raw + b'\r\n')
+            self.wfile.flush()
+
+        try:
+            for token in self._answer_tokens(question):
+                time.sleep(self.token_delay)
+                chunk = {
+                    'id': 'chatcmpl-fake',
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': body.get('model', 'fake'),
+                    'choices': [{'index': 0, 'delta': {'content': token}, 'finish_reason': None}]
+                }
+                write(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n')
+            write('data: [DONE]\n\n')
+            self.wfile.write(b'0\r\n\r\n')
+            self.stats['completed'] += 1
+        except (BrokenPipeError, ConnectionResetError):
+            # 调用方提前关闭连接（客户端断开后取消上游请求）
+            self.stats['cancelled'] += 1
+            self.close_connection = True
+
+
+def make_server(port=0, tokens=50, token_delay=0.02, latency=0.0):
+    """创建模拟服务，返回 (server, base_url, stats)；port=0时自动分配端口"""
+    stats = {'requests': 0, 'completed': 0, 'cancelled': 0}
+    handler = type('Handler', (FakeOpenAIHandler,), {
+        'tokens': tokens, 'token_delay': token_delay, 'latency': latency, 'stats': stats
+    })
+    # 默认的监听队列只有5，高并发压测时新连接会因SYN重传而等待1秒以上
+    server_class = type('Server', (ThreadingHTTPServer,), {'request_queue_size': 1024})
+    server = server_class(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/v1'
+    return server, base_url, stats
+
+
+def start_in_thread(**kwargs):
+    server, base_url, stats = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base_url, stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--tokens', type=int, default=50)
+    parser.add_argument('--token-delay', type=float, default=0.02)
+    parser.add_argument('--latency', type=float, default=0.0, help='首个token前的额外延迟（秒）')
+    args = parser.parse_args()
+    server, base_url, _ = make_server(args.port, args.tokens, args.token_delay, args.latency)
+    print(f'模拟AI服务已启动: {base_url}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,497 @@
+"""整站压测：生成指定规模的数据库，启动应用，按真实比例混合请求并输出各接口的吞吐和延迟分位数
+
+流程：
+1. 在临时目录（或 --database 指定的路径）生成数据库：用户、题目、答题记录、城市探索记录，
+   再运行全部迁移，得到与线上相同的统计表和索引；
+2. 启动本地模拟AI服务，并在子进程中以多线程WSGI服务器运行应用（通过环境变量 MINPAIXINYU_DATABASE
+   指向生成的数据库），压测客户端与服务端不在同一个进程内，互不争抢GIL；
+3. 对每个并发级别，启动相应数量的虚拟用户：先登录，然后按权重随机访问首页、答题、提交答案、
+   探索同步、城市页面、排行榜、头像、AI问答等接口，预热后统计 --duration 秒；
+4. 结果写入JSON文件（--output），可用 --compare 与上一次的结果对比。
+
+用法:
+    python benchmarks/loadtest.py --users 1000 --questions 2000 --answers 200000 \\
+        --concurrency 1,8,32 --duration 20 --output loadtest.json
+    python benchmarks/loadtest.py --compare loadtest-old.json --output loadtest-new.json
+    python benchmarks/loadtest.py generate --database /tmp/load.db --users 5000
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+PASSWORD = 'loadtest'
+CITIES = ('fuzhou', 'xiamen', 'quanzhou', 'zhangzhou', 'putian', 'sanming', 'nanping', 'longyan', 'ningde')
+# 有详情页的城市
+CITY_PAGES = tuple(sorted(name[:-5] for name in os.listdir(os.path.join(ROOT, 'templates', 'cities'))
+                          if name.endswith('.html')))
+CHAT_QUESTIONS = (
+    '福州为什么叫榕城', '土楼是怎样建造的', '妈祖信仰起源于哪里', '武夷岩茶有什么特点',
+    '泉州为什么被称为海丝起点', '莆仙戏有哪些代表剧目', '闽南语和普通话有什么区别', '厦门鼓浪屿有什么历史',
+)
+
+# 各类请求的权重，大致对应页面上的实际访问比例
+DEFAULT_MIX = {
+    'index': 5,
+    'quiz_page': 5,
+    'get_questions': 15,
+    'submit_answer': 30,
+    'explorations_get': 10,
+    'explorations_sync': 4,
+    'city_page': 10,
+    'leaderboard': 5,
+    'question_stats': 3,
+    'avatar_get': 6,
+    'avatar_upload': 1,
+    'chat': 3,
+    'check_login': 3,
+    'login': 1,
+}
+
+
+# ===== 生成数据库 =====
+def generate_database(path, users, questions, answers, explore_ratio=0.5, seed=1):
+    """生成压测数据库，返回各表的行数"""
+    import migrations
+    from db_pool import ConnectionPool
+
+    rng = random.Random(seed)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    pool = ConnectionPool(path, max_size=1)
+    db = pool.acquire()
+    migrations.upgrade(db, target=1)
+
+    db.executemany('INSERT INTO users (username, password) VALUES (?, ?)',
+                   [(f'user{i}', PASSWORD) for i in range(users)])
+    db.executemany("""
+        INSERT INTO questions (question_text, option_a, option_b, option_c, option_d, correct_answer)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(f'压测题目{i}：以下哪一项正确？', f'选项A{i}', f'选项B{i}', f'选项C{i}', f'选项D{i}', rng.choice('ABCD'))
+          for i in range(questions)])
+    db.commit()
+
+    written = 0
+    while written < answers:
+        batch = []
+        for _ in range(min(100000, answers - written)):
+            batch.append((rng.randrange(users) + 1, rng.randrange(questions) + 1, rng.choice('ABCD'),
+                          1 if rng.random() < 0.6 else 0))
+        db.executemany(
+            'INSERT INTO answer_records (user_id, question_id, user_answer, is_correct) VALUES (?, ?, ?, ?)', batch
+        )
+        db.commit()
+        written += len(batch)
+
+    rows = []
+    for user_id in range(1, users + 1):
+        if rng.random() < explore_ratio:
+            for city in rng.sample(CITIES, rng.randint(1, len(CITIES))):
+                rows.append((user_id, city))
+    db.executemany('INSERT INTO city_explorations (user_id, city_name) VALUES (?, ?)', rows)
+    db.commit()
+
+    # 其余迁移会回填用户统计、题目统计和答题位图
+    migrations.upgrade(db)
+    counts = {
+        table: db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        for table in ('users', 'questions', 'answer_records', 'city_explorations')
+    }
+    pool.release(db)
+    pool.close_all()
+    return counts
+
+
+# ===== 应用服务端（子进程） =====
+def serve(args):
+    import logging
+    os.environ['MINPAIXINYU_DATABASE'] = args.database
+    from werkzeug.serving import make_server
+
+    from ai_gateway import gateway
+    from app import app
+
+    gateway.config_path = args.ai_config
+    # 虚拟用户都来自本机IP且请求频率远高于真实用户，压测时关闭限流
+    from request_limits import limiter
+    limiter.enabled = False
+    logging.getLogger('minpaixinyu.ai').setLevel(logging.ERROR)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', args.port, app, threaded=True)
+    print('ready', flush=True)
+    server.serve_forever()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_app_server(database, ai_config):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), 'serve', '--database', database,
+         '--ai-config', ai_config, '--port', str(port)],
+        cwd=ROOT, stdout=subprocess.PIPE, text=True,
+    )
+    # 应用导入时会检查数据库结构并构建静态资源，等待子进程报告就绪
+    for line in process.stdout:
+        if line.strip() == 'ready':
+            break
+    else:
+        raise RuntimeError('应用启动失败')
+    threading.Thread(target=process.stdout.read, daemon=True).start()
+    return process, f'http://127.0.0.1:{port}'
+
+
+# ===== 虚拟用户 =====
+def tiny_png(rng):
+    """随机颜色的8x8 PNG，每次上传内容不同，避免全部命中已存储的头像"""
+    color = bytes(rng.randrange(256) for _ in range(3))
+    raw = b''.join(b'\x00' + color * 8 for _ in range(8))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 8, 8, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+class VirtualUser:
+    def __init__(self, base_url, username, rng, recorder):
+        import httpx
+        self.client = httpx.Client(base_url=base_url, timeout=30.0, follow_redirects=False)
+        self.username = username
+        self.rng = rng
+        self.recorder = recorder
+        self.questions = []
+        self.version = 0
+        self.etag = None
+
+    def request(self, name, method, url, ok=(200,), **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.client.request(method, url, **kwargs)
+            error = response.status_code not in ok
+        except Exception:
+            response, error = None, True
+        self.recorder.record(name, time.perf_counter() - start, error)
+        return response
+
+    def login(self):
+        self.request('login', 'POST', '/login', ok=(302,), data={'username': self.username, 'password': PASSWORD})
+
+    def index(self):
+        self.request('index', 'GET', '/')
+
+    def quiz_page(self):
+        self.request('quiz_page', 'GET', '/quiz')
+
+    def get_questions(self):
+        response = self.request('get_questions', 'GET', '/api/get-questions')
+        if response is not None and response.status_code == 200:
+            self.questions = [question['id'] for question in response.json()['questions']]
+
+    def submit_answer(self):
+        if not self.questions:
+            self.get_questions()
+            return
+        self.request('submit_answer', 'POST', '/api/submit-answer',
+                     json={'question_id': self.questions.pop(), 'user_answer': self.rng.choice('ABCD')})
+
+    def explorations_get(self):
+        headers = {'If-None-Match': self.etag} if self.etag else {}
+        response = self.request('explorations_get', 'GET', '/api/explorations', ok=(200, 304),
+                                params={'since': self.version}, headers=headers)
+        if response is not None and response.status_code == 200:
+            self.version = response.json()['version']
+            self.etag = response.headers.get('ETag')
+
+    def explorations_sync(self):
+        response = self.request('explorations_sync', 'POST', '/api/explorations',
+                                json={'since': self.version, 'cities': [self.rng.choice(CITIES)]})
+        if response is not None and response.status_code == 200:
+            self.version = response.json()['version']
+
+    def city_page(self):
+        self.request('city_page', 'GET', f'/city/{self.rng.choice(CITY_PAGES)}')
+
+    def leaderboard(self):
+        self.request('leaderboard', 'GET', '/api/leaderboard')
+
+    def question_stats(self):
+        self.request('question_stats', 'GET', '/api/questions/stats',
+                     params={'order': self.rng.choice(('hardest', 'easiest'))})
+
+    def avatar_get(self):
+        self.request('avatar_get', 'GET', '/get-avatar', ok=(200, 302), params={'size': 'sm'})
+
+    def avatar_upload(self):
+        self.request('avatar_upload', 'POST', '/api/upload-avatar',
+                     files={'avatar': ('avatar.png', tiny_png(self.rng), 'image/png')})
+
+    def chat(self):
+        # 一部分问题会重复（命中回答缓存），一部分带随机后缀（需要请求上游）
+        question = self.rng.choice(CHAT_QUESTIONS)
+        if self.rng.random() < 0.5:
+            question += f'（{self.rng.randrange(100000)}）'
+        self.request('chat', 'POST', '/api/chat', json={'question': question})
+
+    def check_login(self):
+        self.request('check_login', 'GET', '/api/check-login')
+
+    def close(self):
+        self.client.close()
+
+
+class Recorder:
+    """按接口记录延迟，统计期之外（预热）的请求不计入"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = False
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, name, seconds, error):
+        if not self.active:
+            return
+        with self._lock:
+            self.samples[name].append(seconds * 1000)
+            if error:
+                self.errors[name] += 1
+
+
+def percentile(sorted_samples, p):
+    if not sorted_samples:
+        return None
+    index = max(0, min(len(sorted_samples) - 1, int(round(p / 100 * len(sorted_samples) + 0.5)) - 1))
+    return round(sorted_samples[index], 3)
+
+
+def run_level(base_url, concurrency, duration, warmup, mix, user_count, seed):
+    recorder = Recorder()
+    stop = threading.Event()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        user = VirtualUser(base_url, f'user{rng.randrange(user_count)}', rng, recorder)
+        try:
+            user.login()
+            while not stop.is_set():
+                getattr(user, rng.choices(names, weights)[0])()
+        finally:
+            user.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup)
+    recorder.active = True
+    start = time.perf_counter()
+    time.sleep(duration)
+    recorder.active = False
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    endpoints = {}
+    total = errors = 0
+    for name in sorted(recorder.samples):
+        samples = sorted(recorder.samples[name])
+        total += len(samples)
+        errors += recorder.errors[name]
+        endpoints[name] = {
+            'count': len(samples),
+            'errors': recorder.errors[name],
+            'rps': round(len(samples) / elapsed, 2),
+            'mean_ms': round(sum(samples) / len(samples), 3),
+            'p50_ms': percentile(samples, 50),
+            'p95_ms': percentile(samples, 95),
+            'p99_ms': percentile(samples, 99),
+            'max_ms': round(samples[-1], 3),
+        }
+    return {
+        'concurrency': concurrency,
+        'duration_s': round(elapsed, 2),
+        'requests': total,
+        'errors': errors,
+        'throughput_rps': round(total / elapsed, 2),
+        'endpoints': endpoints,
+    }
+
+
+# ===== 输出 =====
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_level(level):
+    print(f'\n并发 {level["concurrency"]}: {level["throughput_rps"]} req/s，'
+          f'{level["requests"]} 个请求，{level["errors"]} 个错误')
+    print(f'{"接口":<20}{"次数":>8}{"错误":>6}{"req/s":>9}{"p50ms":>9}{"p95ms":>9}{"p99ms":>9}')
+    for name, item in level['endpoints'].items():
+        print(f'{name:<20}{item["count"]:>8}{item["errors"]:>6}{item["rps"]:>9.1f}'
+              f'{item["p50_ms"]:>9.2f}{item["p95_ms"]:>9.2f}{item["p99_ms"]:>9.2f}')
+
+
+def compare(previous, current):
+    """按并发级别和接口对比两次结果的吞吐和p95"""
+    old_levels = {level['concurrency']: level for level in previous['levels']}
+    for level in current['levels']:
+        old = old_levels.get(level['concurrency'])
+        if old is None:
+            continue
+        change = (level['throughput_rps'] / old['throughput_rps'] - 1) * 100 if old['throughput_rps'] else 0
+        print(f'\n并发 {level["concurrency"]} 对比: 吞吐 {old["throughput_rps"]} -> {level["throughput_rps"]} '
+              f'req/s ({change:+.1f}%)')
+        print(f'{"接口":<20}{"旧p95ms":>10}{"新p95ms":>10}{"变化":>9}')
+        for name, item in level['endpoints'].items():
+            old_item = old['endpoints'].get(name)
+            if old_item is None or not old_item['p95_ms']:
+                continue
+            delta = (item['p95_ms'] / old_item['p95_ms'] - 1) * 100
+            print(f'{name:<20}{old_item["p95_ms"]:>10.2f}{item["p95_ms"]:>10.2f}{delta:>+8.1f}%')
+
+
+def parse_mix(text):
+    mix = dict(DEFAULT_MIX)
+    for part in filter(None, (text or '').split(',')):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f'未知的请求类型: {name}，可选: {", ".join(DEFAULT_MIX)}')
+        mix[name] = float(weight)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def run(args):
+    from fake_openai_server import start_in_thread
+
+    mix = parse_mix(args.mix)
+    concurrency_levels = [int(value) for value in args.concurrency.split(',')]
+    with tempfile.TemporaryDirectory() as tmp:
+        database = args.database or os.path.join(tmp, 'loadtest.db')
+        if args.database and os.path.exists(database) and not args.regenerate:
+            with sqlite3.connect(database) as conn:
+                counts = {
+                    table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+                    for table in ('users', 'questions', 'answer_records', 'city_explorations')
+                }
+            print(f'使用已有数据库 {database}: {counts}')
+        else:
+            start = time.perf_counter()
+            counts = generate_database(database, args.users, args.questions, args.answers, seed=args.seed)
+            print(f'生成数据库 {counts}: {time.perf_counter() - start:.1f} s')
+
+        ai_server, ai_base_url, ai_stats = start_in_thread(tokens=args.ai_tokens, token_delay=args.ai_token_delay)
+        ai_config = os.path.join(tmp, 'ai.json')
+        with open(ai_config, 'w', encoding='utf-8') as f:
+            json.dump({'deepseek_api_key': 'sk-loadtest', 'base_url': ai_base_url}, f)
+
+        process, base_url = start_app_server(database, ai_config)
+        try:
+            levels = []
+            for concurrency in concurrency_levels:
+                level = run_level(base_url, concurrency, args.duration, args.warmup, mix, counts['users'], args.seed)
+                print_level(level)
+                levels.append(level)
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+            ai_server.shutdown()
+
+    result = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'dataset': counts,
+            'mix': mix,
+            'duration_s': args.duration,
+            'warmup_s': args.warmup,
+            'seed': args.seed,
+            'ai_upstream_requests': ai_stats['requests'],
+        },
+        'levels': levels,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f'\n结果已写入 {args.output}')
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(json.load(f), result)
+
+
+def add_dataset_arguments(parser):
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--questions', type=int, default=2000)
+    parser.add_argument('--answers', type=int, default=200000)
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+
+    generate = subparsers.add_parser('generate', help='只生成压测数据库')
+    generate.add_argument('--database', required=True)
+    add_dataset_arguments(generate)
+
+    server = subparsers.add_parser('serve', help='（内部使用）运行应用服务端')
+    server.add_argument('--database', required=True)
+    server.add_argument('--ai-config', required=True)
+    server.add_argument('--port', type=int, required=True)
+
+    add_dataset_arguments(parser)
+    parser.add_argument('--database', help='数据库路径，已存在时直接使用（除非指定 --regenerate）；默认在临时目录生成')
+    parser.add_argument('--regenerate', action='store_true')
+    parser.add_argument('--concurrency', default='1,8,32', help='逗号分隔的并发级别')
+    parser.add_argument('--duration', type=float, default=20.0, help='每个并发级别的统计时长（秒）')
+    parser.add_argument('--warmup', type=float, default=3.0)
+    parser.add_argument('--mix', help='调整请求权重，如 chat=0,submit_answer=50')
+    parser.add_argument('--ai-tokens', type=int, default=20)
+    parser.add_argument('--ai-token-delay', type=float, default=0.005)
+    parser.add_argument('--output', default='loadtest.json')
+    parser.add_argument('--compare', help='上一次结果的JSON文件')
+    args = parser.parse_args()
+
+    if args.command == 'generate':
+        counts = generate_database(args.database, args.users, args.questions, args.answers, seed=args.seed)
+        print(f'已生成 {args.database}: {counts}')
+    elif args.command == 'serve':
+        serve(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
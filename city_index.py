@@ -0,0 +1,271 @@
+import glob
+import json
+import math
+import os
+import re
+from html.parser import HTMLParser
+
+import click
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # 未安装pypdf时不索引PDF
+    PdfReader = None
+
+ARTIFACT_PATH = os.path.join('build', 'city_index.json')
+ARTIFACT_VERSION = 1
+
+_JINJA = re.compile(r'{%.*?%}|{{.*?}}|{#.*?#}', re.S)
+_SPACES = re.compile(r'\s+')
+_CJK = re.compile(r'[\u4e00-\u9fff]+')
+_WORD = re.compile(r'[a-z0-9]+')
+
+# 提问中常见、对检索没有帮助的词
+QUERY_STOPWORDS = {
+    '什么', '为什', '么叫', '么是', '怎么', '怎样', '哪里', '在哪', '哪些', '有什', '请问',
+    '是什', '介绍', '一下', '如何', '为何', '多少', '有哪', '吗', '呢', '的',
+}
+
+# BM25参数
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text):
+    """中文按相邻二字切分（单字也保留，便于匹配短查询），英文和数字按单词切分"""
+    text = text.lower()
+    tokens = []
+    for run in _CJK.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.extend(_WORD.findall(text))
+    return tokens
+
+
+def query_tokens(query):
+    return set(tokenize(query)) - QUERY_STOPWORDS
+
+
+class _PassageParser(HTMLParser):
+    """从城市页面中提取段落，每段附带所在的小标题"""
+
+    BLOCK_TAGS = {'p', 'li', 'span', 'td'}
+    HEADING_TAGS = {'h1', 'h2', 'h3', 'h4'}
+
+    def __init__(self):
+        super().__init__()
+        self.city = None
+        self.heading = ''
+        self.passages = []
+        self._stack = []
+        self._buffer = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self._skip += 1
+        if tag in self.BLOCK_TAGS or tag in self.HEADING_TAGS:
+            self._stack.append(tag)
+            self._buffer = []
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style'):
+            self._skip -= 1
+            return
+        if not self._stack or self._stack[-1] != tag:
+            return
+        self._stack.pop()
+        text = _SPACES.sub(' ', ''.join(self._buffer)).strip()
+        self._buffer = []
+        if not text:
+            return
+        if tag == 'h1' and self.city is None:
+            self.city = text
+        elif tag in self.HEADING_TAGS:
+            self.heading = text
+        elif len(text) >= 6:
+            self.passages.append((self.heading, text))
+
+    def handle_data(self, data):
+        if self._stack and not self._skip:
+            self._buffer.append(data)
+
+
+def extract_template_passages(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        html = _JINJA.sub(' ', f.read())
+    parser = _PassageParser()
+    parser.feed(html)
+    city = parser.city or os.path.splitext(os.path.basename(path))[0]
+    return [
+        {'source': os.path.basename(path), 'city': city, 'heading': heading, 'text': text}
+        for heading, text in parser.passages
+    ]
+
+
+def extract_pdf_passages(path, max_chars=300):
+    if PdfReader is None:
+        return []
+    passages = []
+    reader = PdfReader(path)
+    for page_number, page in enumerate(reader.pages, 1):
+        text = _SPACES.sub(' ', page.extract_text() or '').strip()
+        for start in range(0, len(text), max_chars):
+            chunk = text[start:start + max_chars]
+            if len(chunk) >= 20:
+                passages.append({
+                    'source': f'{os.path.basename(path)}#page={page_number}',
+                    'city': '',
+                    'heading': f'第{page_number}页',
+                    'text': chunk
+                })
+    return passages
+
+
+def source_files(root_path):
+    templates = sorted(glob.glob(os.path.join(root_path, 'templates', 'cities', '*.html')))
+    pdfs = sorted(glob.glob(os.path.join(root_path, 'source', '**', '*.pdf'), recursive=True))
+    return templates, pdfs
+
+
+def source_signature(files):
+    signature = []
+    for path in files:
+        stat = os.stat(path)
+        signature.append([os.path.basename(path), stat.st_mtime_ns, stat.st_size])
+    return signature
+
+
+def build_passages(root_path, force=False):
+    """提取全部段落；源文件未变化时直接读取之前生成的构建产物"""
+    templates, pdfs = source_files(root_path)
+    signature = {
+        'version': ARTIFACT_VERSION,
+        'pdf_support': PdfReader is not None,
+        'files': source_signature(templates + pdfs),
+    }
+    artifact = os.path.join(root_path, ARTIFACT_PATH)
+    if not force and os.path.exists(artifact):
+        with open(artifact, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('signature') == signature:
+            return data['passages']
+
+    passages = []
+    for path in templates:
+        passages.extend(extract_template_passages(path))
+    for path in pdfs:
+        try:
+            passages.extend(extract_pdf_passages(path))
+        except Exception as e:
+            print(f"PDF文本提取失败 {path}: {e}")
+
+    os.makedirs(os.path.dirname(artifact), exist_ok=True)
+    with open(artifact, 'w', encoding='utf-8') as f:
+        json.dump({'signature': signature, 'passages': passages}, f, ensure_ascii=False)
+    return passages
+
+
+class CityIndex:
+    """城市内容的倒排索引，使用BM25为段落打分"""
+
+    def __init__(self, passages=()):
+        self.load(passages)
+
+    def load(self, passages):
+        self.passages = list(passages)
+        self._postings = {}
+        self._lengths = []
+        for doc_id, passage in enumerate(self.passages):
+            tokens = tokenize(passage['heading'] + ' ' + passage['text'])
+            self._lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                self._postings.setdefault(token, []).append((doc_id, tf))
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+
+    def __len__(self):
+        return len(self.passages)
+
+    def _rank(self, query, k):
+        n = len(self.passages)
+        if not n:
+            return []
+        scores = {}
+        matched = {}
+        for token in query_tokens(query):
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings:
+                norm = tf * (K1 + 1) / (tf + K1 * (1 - B + B * self._lengths[doc_id] / self._avg_length))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * norm
+                matched[doc_id] = matched.get(doc_id, 0) + 1
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(doc_id, score, matched[doc_id]) for doc_id, score in ranked]
+
+    def search(self, query, k=3):
+        """返回得分最高的k个段落，每项为 (score, passage)"""
+        return [(round(score, 4), self.passages[doc_id]) for doc_id, score, _ in self._rank(query, k)]
+
+    def _relevant(self, query, k, min_score):
+        # 较长的查询至少要命中两个不同的词，避免只因一个常见词（如“北京”）匹配上
+        required = 2 if len(query_tokens(query)) > 2 else 1
+        return [
+            (score, self.passages[doc_id]) for doc_id, score, matched in self._rank(query, k)
+            if score >= min_score and matched >= required
+        ]
+
+    def answer(self, query, min_score=2.0):
+        """把最相关的段落组织成备用回答，没有足够相关的内容时返回None"""
+        results = self._relevant(query, 2, min_score)
+        if not results:
+            return None
+        best_score, best = results[0]
+        parts = [best['text']]
+        # 第二段同样相关时一并给出
+        if len(results) > 1 and results[1][0] >= best_score * 0.8 and results[1][1]['text'] != best['text']:
+            parts.append(results[1][1]['text'])
+        return '\n'.join(parts)
+
+    def cities(self):
+        return sorted({passage['city'] for passage in self.passages if passage['city']})
+
+    def context(self, query, k=3, min_score=2.0):
+        """生成供大模型参考的资料文本"""
+        lines = []
+        for _, passage in self._relevant(query, k, min_score):
+            title = '·'.join(part for part in (passage['city'], passage['heading']) if part)
+            lines.append(f'【{title}】{passage["text"]}')
+        return '\n'.join(lines)
+
+
+city_index = CityIndex()
+
+
+def init_app(app):
+    try:
+        city_index.load(build_passages(app.root_path))
+    except OSError as e:
+        print(f"城市内容索引构建失败: {e}")
+
+    @app.cli.group('search')
+    def search_cli():
+        """城市内容检索索引"""
+
+    @search_cli.command('build')
+    def build_command():
+        """重新提取城市页面和电子书文本"""
+        passages = build_passages(app.root_path, force=True)
+        click.echo(f'已索引 {len(passages)} 个段落')
+
+    @search_cli.command('query')
+    @click.argument('text')
+    def query_command(text):
+        """检索与问题最相关的段落"""
+        for score, passage in city_index.search(text, k=5):
+            click.echo(f'{score:7.3f}  {passage["city"]}/{passage["heading"]}  {passage["text"][:60]}')
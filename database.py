@@ -1,83 +1,75 @@
-import sqlite3
 import os
 import sys
 from flask import g
 
-# 获取数据库绝对路径
+from db_pool import ConnectionPool
+import migrations
+from metrics import metrics
+
+# 获取数据库绝对路径，可用环境变量 MINPAIXINYU_DATABASE 指定其它数据库（如压测时生成的数据库）
 def get_database_path():
+    path = os.environ.get('MINPAIXINYU_DATABASE')
+    if path:
+        return os.path.abspath(path)
     return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database.db')
 
 DATABASE = get_database_path()
 
+# 连接池默认配置，可在app.config中覆盖
+POOL_DEFAULTS = {
+    'SQLITE_POOL_SIZE': 8,
+    'SQLITE_POOL_TIMEOUT': 10.0,
+    'SQLITE_BUSY_TIMEOUT_MS': 5000,
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_CACHE_SIZE': -16000,
+    'SQLITE_MMAP_SIZE': 64 * 1024 * 1024,
+}
+
+_pool = None
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(DATABASE)
+    return _pool
+
+def configure_pool(config):
+    global _pool
+    if _pool is not None:
+        _pool.close_all()
+    _pool = ConnectionPool(
+        DATABASE,
+        max_size=config['SQLITE_POOL_SIZE'],
+        timeout=config['SQLITE_POOL_TIMEOUT'],
+        busy_timeout=config['SQLITE_BUSY_TIMEOUT_MS'],
+        synchronous=config['SQLITE_SYNCHRONOUS'],
+        cache_size=config['SQLITE_CACHE_SIZE'],
+        mmap_size=config['SQLITE_MMAP_SIZE'],
+    )
+    return _pool
+
+def get_pool_stats():
+    return get_pool().stats()
+
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
+        db = g._database = get_pool().acquire()
+        # 请求内执行的语句计入当前请求的SQL统计
+        db.on_statement = metrics.statement_hook()
     return db
 
 def init_app(app):
+    for key, value in POOL_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    configure_pool(app.config)
     app.teardown_appcontext(close_db)
-    # 初始化数据库表结构
+    app.config.setdefault('DB_AUTO_MIGRATE', True)
+    app.cli.add_command(migrations.db_cli)
+    # 检查数据库结构，已是最新时只读取一次 PRAGMA user_version
     with app.app_context():
-        db = get_db()
         try:
-            # 创建用户表
-            db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    avatar_blob BLOB,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # 创建问题表
-            db.execute("""
-                CREATE TABLE IF NOT EXISTS questions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    question_text TEXT NOT NULL,
-                    option_a TEXT NOT NULL,
-                    option_b TEXT NOT NULL,
-                    option_c TEXT NOT NULL,
-                    option_d TEXT NOT NULL,
-                    correct_answer TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # 创建答题记录表
-            db.execute("""
-                CREATE TABLE IF NOT EXISTS answer_records (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    question_id INTEGER NOT NULL,
-                    user_answer TEXT NOT NULL,
-                    is_correct INTEGER NOT NULL,
-                    answered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id),
-                    FOREIGN KEY (question_id) REFERENCES questions (id)
-                )
-            """)
-            
-            # 创建地区探索记录表
-            db.execute("""
-                CREATE TABLE IF NOT EXISTS city_explorations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    city_name TEXT NOT NULL,
-                    explored_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (id),
-                    UNIQUE(user_id, city_name)
-                )
-            """)
-            
-            db.commit()
-            
-            # 初始化测试问题
-            init_test_questions(db)
-            
+            migrations.ensure_schema(get_db(), auto_migrate=app.config['DB_AUTO_MIGRATE'])
         except Exception as e:
             print(f"数据库初始化错误: {e}")
             raise
@@ -147,6 +139,10 @@ def init_test_questions(db):
         print("已初始化测试问题数据")
 
 def close_db(e=None):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        get_pool().release(db)
+
+def release_db():
+    """提前把本请求持有的连接归还连接池，用于视图等待上游网络响应之前；之后再调用get_db()会重新取得连接"""
+    close_db()
@@ -0,0 +1,169 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    """等待空闲连接超时"""
+
+
+class TracedConnection(sqlite3.Connection):
+    """设置了 on_statement 时，每次 execute/executemany 后回调 (sql, 耗时秒)
+
+    耗时只包含执行到第一行结果为止，不含之后fetch的时间；未设置回调时与普通连接相同。
+    """
+
+    on_statement = None
+
+    def execute(self, sql, parameters=()):
+        hook = self.on_statement
+        if hook is None:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            hook(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, parameters):
+        hook = self.on_statement
+        if hook is None:
+            return super().executemany(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, parameters)
+        finally:
+            hook(sql, time.perf_counter() - start)
+
+
+class ConnectionPool:
+    """SQLite连接池
+
+    每个进程保留一组已打开并完成PRAGMA设置的连接，请求结束后归还而不是关闭。
+    进程fork之后（gunicorn preload）会自动丢弃从父进程继承来的连接。
+    """
+
+    def __init__(self, database, max_size=8, timeout=10.0, busy_timeout=5000,
+                 synchronous='NORMAL', cache_size=-16000, mmap_size=64 * 1024 * 1024):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self.cache_size = cache_size
+        self.mmap_size = mmap_size
+
+        self._lock = threading.Lock()
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._hits = 0
+        self._misses = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    def _check_pid(self):
+        # fork后的子进程不能复用父进程的sqlite连接
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset_state()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.database, timeout=self.busy_timeout / 1000.0,
+                               check_same_thread=False, factory=TracedConnection)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.busy_timeout)}')
+        conn.execute(f'PRAGMA synchronous={self.synchronous}')
+        conn.execute(f'PRAGMA cache_size={int(self.cache_size)}')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        # 外键约束保持SQLite默认的关闭状态（与改用连接池之前一致），
+        # 删除用户时由 delete_account 显式删除各表中的关联记录
+        return conn
+
+    def acquire(self):
+        self._check_pid()
+
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self._hits += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.max_size
+            if can_create:
+                self._created += 1
+                self._misses += 1
+
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # 连接数已达上限，等待其他请求归还
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(f'等待数据库连接超时（{self.timeout}秒）')
+        waited = time.perf_counter() - start
+        with self._lock:
+            self._waits += 1
+            self._wait_time += waited
+            self._max_wait_time = max(self._max_wait_time, waited)
+        return conn
+
+    def release(self, conn):
+        if self._pid != os.getpid():
+            return
+        conn.on_statement = None
+        try:
+            # 未提交的事务一律回滚，保证下一个请求拿到干净的连接
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+        self._idle.put(conn)
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def close_all(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'open': self._created,
+                'idle': self._idle.qsize(),
+                'hits': self._hits,
+                'misses': self._misses,
+                'waits': self._waits,
+                'total_wait_ms': round(self._wait_time * 1000, 3),
+                'max_wait_ms': round(self._max_wait_time * 1000, 3),
+            }
@@ -0,0 +1,74 @@
+import user_stats
+
+# 单次同步最多接受的城市数，防止异常请求写入大量数据
+MAX_SYNC_CITIES = 100
+
+
+def current_version(db, user_id):
+    """用户探索记录的版本号：每次有新增记录时加一，没有记录时为0"""
+    row = db.execute(
+        'SELECT MAX(version) FROM city_explorations WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    return row[0] or 0
+
+
+def explored_since(db, user_id, since=0):
+    """返回 (版本号, 该版本之后新增的城市列表)，since为0时返回全部"""
+    rows = db.execute(
+        'SELECT city_name, version FROM city_explorations WHERE user_id = ? AND version > ? ORDER BY version, id',
+        (user_id, since)
+    ).fetchall()
+    version = rows[-1]['version'] if rows else current_version(db, user_id)
+    return version, [row['city_name'] for row in rows]
+
+
+def is_explored(db, user_id, city_name):
+    return db.execute(
+        'SELECT 1 FROM city_explorations WHERE user_id = ? AND city_name = ?', (user_id, city_name)
+    ).fetchone() is not None
+
+
+def mark_explored(db, user_id, city_names):
+    """在一个事务中写入多条探索记录，返回新增的城市列表（已存在的忽略）"""
+    names = list(dict.fromkeys(name for name in city_names if name))
+    if not names:
+        return []
+    if db.in_transaction:
+        db.commit()
+    # 立即获取写锁，保证读取已有记录和版本号后写入期间不被其他请求插入
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        existing = {
+            row['city_name'] for row in db.execute(
+                'SELECT city_name FROM city_explorations WHERE user_id = ?', (user_id,)
+            )
+        }
+        added = [name for name in names if name not in existing]
+        if added:
+            version = current_version(db, user_id) + 1
+            db.executemany(
+                'INSERT INTO city_explorations (user_id, city_name, version) VALUES (?, ?, ?)',
+                [(user_id, name, version) for name in added]
+            )
+            user_stats.record_explorations(db, user_id, added)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return added
+
+
+def sync(db, user_id, city_names=(), since=0):
+    """客户端同步：上传离线期间标记的城市，返回服务端在since版本之后新增的全部城市
+
+    返回的字典包含 version（同步后的版本号）、explorations（新增城市，since为0时为全部）、
+    added（本次上传中真正新增的城市）；客户端保存version，下次只需获取增量。
+    """
+    added = mark_explored(db, user_id, city_names)
+    version, cities = explored_since(db, user_id, since)
+    return {
+        'version': version,
+        'since': since,
+        'explorations': cities,
+        'added': added,
+    }
@@ -0,0 +1,342 @@
+import gzip
+import hashlib
+import json
+import os
+
+import click
+
+try:
+    import brotli
+except ImportError:  # 未安装brotli时只生成gzip版本
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # Windows上没有fcntl，多个进程可能同时构建，每个文件仍是整体替换
+    fcntl = None
+
+# 各精度等级的简化容差（经纬度）与坐标保留的小数位数
+# Leaflet在第7级缩放时一个像素约0.01度，第9级约0.0027度，第11级约0.0007度
+DETAIL_LEVELS = {
+    'low': (0.01, 3),
+    'medium': (0.0025, 4),
+    'high': (0.0006, 5),
+    'full': (0, 6),
+}
+DEFAULT_DETAIL = 'full'
+FORMATS = ('geojson', 'topojson')
+ENCODINGS = ('br', 'gzip', 'identity')
+
+SOURCE_NAME = 'fujian.json'
+BUILD_DIR = os.path.join('static', 'build', 'geo')
+
+
+# ===== 拓扑保持的简化 =====
+
+def _ring_points(ring):
+    points = [tuple(p) for p in ring]
+    if len(points) > 1 and points[0] == points[-1]:
+        points.pop()
+    return points
+
+
+def find_junctions(rings):
+    """找出边界的分叉点：同一个点在不同环中的相邻点不同，说明公共边界在此开始或结束"""
+    neighbours = {}
+    for points in rings:
+        n = len(points)
+        for i, p in enumerate(points):
+            pair = frozenset((points[i - 1], points[(i + 1) % n]))
+            neighbours.setdefault(p, set()).add(pair)
+    return {p for p, pairs in neighbours.items() if len(pairs) > 1}
+
+
+def split_ring(points, junctions):
+    """在分叉点处把环切成若干条弧，没有分叉点的环整体作为一条闭合弧"""
+    starts = [i for i, p in enumerate(points) if p in junctions]
+    if not starts:
+        # 从最小的点开始，保证同一个闭合环在不同多边形中得到相同的弧
+        k = points.index(min(points))
+        points = points[k:] + points[:k]
+        return [points + [points[0]]]
+    arcs = []
+    n = len(points)
+    for k, start in enumerate(starts):
+        end = starts[(k + 1) % len(starts)]
+        length = (end - start) % n or n
+        arcs.append([points[(start + j) % n] for j in range(length + 1)])
+    return arcs
+
+
+def _perpendicular_distance(p, a, b):
+    (x, y), (x1, y1), (x2, y2) = p, a, b
+    dx, dy = x2 - x1, y2 - y1
+    if dx == 0 and dy == 0:
+        return ((x - x1) ** 2 + (y - y1) ** 2) ** 0.5
+    return abs(dy * x - dx * y + x2 * y1 - y2 * x1) / (dx * dx + dy * dy) ** 0.5
+
+
+def douglas_peucker(points, tolerance):
+    """非递归的Douglas-Peucker折线简化，保留首尾端点"""
+    if tolerance <= 0 or len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_dist, index = 0.0, None
+        for i in range(first + 1, last):
+            dist = _perpendicular_distance(points[i], points[first], points[last])
+            if dist > max_dist:
+                max_dist, index = dist, i
+        if index is not None and max_dist > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+
+def build_topology(collection):
+    """把FeatureCollection拆成共享弧（与TopoJSON相同的结构）
+
+    返回 (arcs, features)，features中每个多边形的环用弧编号列表表示，
+    编号取反码(~i)表示反向使用该弧。
+    """
+    rings = []
+    for feature in collection['features']:
+        geometry = feature['geometry']
+        polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        for polygon in polygons:
+            rings.extend(_ring_points(ring) for ring in polygon)
+    junctions = find_junctions(rings)
+
+    arcs = []
+    arc_index = {}
+
+    def add_arc(arc):
+        key = tuple(arc)
+        if key in arc_index:
+            return arc_index[key]
+        reverse = tuple(reversed(arc))
+        if reverse in arc_index:
+            return ~arc_index[reverse]
+        arc_index[key] = len(arcs)
+        arcs.append(arc)
+        return len(arcs) - 1
+
+    features = []
+    for feature in collection['features']:
+        geometry = feature['geometry']
+        polygons = geometry['coordinates'] if geometry['type'] == 'MultiPolygon' else [geometry['coordinates']]
+        topo_polygons = []
+        for polygon in polygons:
+            topo_polygons.append([
+                [add_arc(arc) for arc in split_ring(_ring_points(ring), junctions)]
+                for ring in polygon
+            ])
+        features.append((feature, topo_polygons))
+    return arcs, features
+
+
+def _resolve_ring(arc_ids, arcs):
+    coords = []
+    for arc_id in arc_ids:
+        arc = arcs[arc_id] if arc_id >= 0 else list(reversed(arcs[~arc_id]))
+        coords.extend(arc if not coords else arc[1:])
+    return coords
+
+
+def simplify_collection(collection, tolerance, precision):
+    """按容差简化，相邻地市共用的边界只简化一次，保证简化后没有缝隙和重叠"""
+    arcs, features = build_topology(collection)
+    simplified = [
+        [[round(x, precision), round(y, precision)] for x, y in douglas_peucker(arc, tolerance)]
+        for arc in arcs
+    ]
+
+    result = {'type': 'FeatureCollection', 'features': []}
+    for feature, polygons in features:
+        out_polygons = []
+        for polygon in polygons:
+            out_rings = []
+            for ring_arcs in polygon:
+                ring = _resolve_ring(ring_arcs, simplified)
+                if len(ring) >= 4:
+                    out_rings.append(ring)
+                elif not out_rings:
+                    break
+            # 外环退化（过小的岛屿）时整个多边形舍弃
+            if out_rings:
+                out_polygons.append(out_rings)
+        if not out_polygons:
+            continue
+        result['features'].append({
+            'type': 'Feature',
+            'properties': feature['properties'],
+            'geometry': {'type': 'MultiPolygon', 'coordinates': out_polygons}
+        })
+    return result
+
+
+def to_topojson(collection, precision):
+    """编码为量化后的TopoJSON（弧坐标使用差分整数）"""
+    arcs, features = build_topology(collection)
+    xs = [p[0] for arc in arcs for p in arc]
+    ys = [p[1] for arc in arcs for p in arc]
+    scale = 10 ** precision
+    x0, y0 = min(xs), min(ys)
+
+    encoded_arcs = []
+    for arc in arcs:
+        encoded, px, py = [], 0, 0
+        for x, y in arc:
+            qx, qy = round((x - x0) * scale), round((y - y0) * scale)
+            if encoded and qx == px and qy == py:
+                continue
+            encoded.append([qx - px, qy - py])
+            px, py = qx, qy
+        encoded_arcs.append(encoded)
+
+    geometries = [{
+        'type': 'MultiPolygon',
+        'properties': feature['properties'],
+        'arcs': polygons
+    } for feature, polygons in features]
+
+    return {
+        'type': 'Topology',
+        'transform': {'scale': [1 / scale, 1 / scale], 'translate': [x0, y0]},
+        'objects': {'fujian': {'type': 'GeometryCollection', 'geometries': geometries}},
+        'arcs': encoded_arcs
+    }
+
+
+# ===== 构建与加载 =====
+
+def _dump(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def artifact_name(detail, fmt):
+    return f'fujian.{detail}.{fmt}.json'
+
+
+def _write_file(path, data):
+    # 先写临时文件再整体替换，其它进程读到的总是完整的旧文件或新文件
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _is_current(stamp, digest):
+    if not os.path.exists(stamp):
+        return False
+    with open(stamp) as f:
+        return f.read().strip() == digest
+
+
+def build(root_path, force=False):
+    """生成各精度的简化版本及其gzip/brotli预压缩文件，源文件未变化时跳过
+
+    多个worker同时启动时由文件锁保证只构建一次，其余进程等待构建完成后发现已是最新直接返回。
+    """
+    source = os.path.join(root_path, 'static', SOURCE_NAME)
+    build_dir = os.path.join(root_path, BUILD_DIR)
+    stamp = os.path.join(build_dir, 'source.sha256')
+
+    with open(source, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    if not force and _is_current(stamp, digest):
+        return False
+
+    os.makedirs(build_dir, exist_ok=True)
+    with open(os.path.join(build_dir, '.lock'), 'a+b') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        if not force and _is_current(stamp, digest):
+            return False
+        _build(raw, build_dir)
+        # 全部文件就位后才写入源文件摘要
+        _write_file(stamp, digest.encode('ascii'))
+    return True
+
+
+def _build(raw, build_dir):
+    collection = json.loads(raw)
+    for detail, (tolerance, precision) in DETAIL_LEVELS.items():
+        simplified = simplify_collection(collection, tolerance, precision)
+        outputs = {
+            'geojson': _dump(simplified),
+            'topojson': _dump(to_topojson(simplified, precision)),
+        }
+        for fmt, data in outputs.items():
+            path = os.path.join(build_dir, artifact_name(detail, fmt))
+            _write_file(path, data)
+            _write_file(path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                _write_file(path + '.br', brotli.compress(data, quality=11))
+
+
+class GeoAssets:
+    """已构建的地图数据，按 (精度, 格式, 编码) 常驻内存"""
+
+    def __init__(self):
+        self._artifacts = {}
+
+    def load(self, root_path):
+        build_dir = os.path.join(root_path, BUILD_DIR)
+        artifacts = {}
+        for detail in DETAIL_LEVELS:
+            for fmt in FORMATS:
+                base = os.path.join(build_dir, artifact_name(detail, fmt))
+                for encoding, suffix in (('identity', ''), ('gzip', '.gz'), ('br', '.br')):
+                    path = base + suffix
+                    if not os.path.exists(path):
+                        continue
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    etag = hashlib.sha256(data).hexdigest()[:20]
+                    artifacts[(detail, fmt, encoding)] = (data, etag)
+        self._artifacts = artifacts
+
+    def __bool__(self):
+        return bool(self._artifacts)
+
+    def get(self, detail, fmt, accept_encodings):
+        """按客户端的Accept-Encoding选择最合适的预压缩版本，返回 (data, etag, encoding)"""
+        for encoding in ENCODINGS:
+            if encoding != 'identity' and not accept_encodings[encoding]:
+                continue
+            artifact = self._artifacts.get((detail, fmt, encoding))
+            if artifact is not None:
+                return artifact[0], artifact[1], encoding
+        return None
+
+
+artifacts = GeoAssets()
+
+
+def init_app(app):
+    try:
+        build(app.root_path)
+    except (OSError, ValueError) as e:
+        print(f"地图数据构建失败: {e}")
+    artifacts.load(app.root_path)
+
+    @app.cli.group('geo')
+    def geo_cli():
+        """地图数据构建"""
+
+    @geo_cli.command('build')
+    @click.option('--force', is_flag=True, help='源文件未变化也重新构建')
+    def build_command(force):
+        """生成简化及预压缩的地图数据"""
+        built = build(app.root_path, force=force)
+        click.echo('地图数据已重新构建' if built else '地图数据已是最新')
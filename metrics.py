@@ -0,0 +1,301 @@
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from flask import Response, current_app, g, has_request_context, jsonify, request
+
+logger = logging.getLogger('minpaixinyu.metrics')
+
+# 默认配置，可在app.config中覆盖
+METRICS_DEFAULTS = {
+    'METRICS_ENABLED': True,
+    # 超过该耗时的请求写入慢请求日志（含SQL明细），为0时关闭
+    'METRICS_SLOW_REQUEST_MS': 0,
+    'METRICS_SLOW_SAMPLE_RATE': 1.0,
+    'METRICS_SLOW_TOP_STATEMENTS': 10,
+    # /metrics 和 /api/stats/* 会暴露连接池、缓存、限流和上游服务的细节，默认关闭；
+    # 开启后只允许本机直接访问，或在 Authorization: Bearer 中携带 STATS_TOKEN
+    'STATS_ENDPOINTS_ENABLED': False,
+    'STATS_TOKEN': None,
+    'STATS_ALLOW_LOCALHOST': True,
+}
+
+LOCAL_ADDRESSES = frozenset({'127.0.0.1', '::1'})
+
+PREFIX = 'minpaixinyu_'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = PREFIX + name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self, lines):
+        lines.append(f'# HELP {self.name} {self.help_text}')
+        lines.append(f'# TYPE {self.name} counter')
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}')
+
+
+class Histogram:
+    """固定分桶的直方图，输出格式与Prometheus客户端一致"""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [各分桶计数（非累计，最后一个为+Inf）, 总和, 次数]
+        self._series = {}
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self, lines):
+        lines.append(f'# HELP {self.name} {self.help_text}')
+        lines.append(f'# TYPE {self.name} histogram')
+        with self._lock:
+            items = sorted((labels, (list(s[0]), s[1], s[2])) for labels, s in self._series.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_number(bound)}"'
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+
+
+class RequestTrace:
+    """一个请求内执行的SQL语句和上游AI调用耗时"""
+
+    __slots__ = ('start', 'statements', 'sql_count', 'sql_seconds', 'ai_seconds')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = {}
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.ai_seconds = 0.0
+
+    def record_statement(self, sql, seconds):
+        self.sql_count += 1
+        self.sql_seconds += seconds
+        item = self.statements.get(sql)
+        if item is None:
+            self.statements[sql] = [1, seconds]
+        else:
+            item[0] += 1
+            item[1] += seconds
+
+
+def _operation(sql):
+    head = sql.lstrip().split(None, 1)
+    return head[0].upper() if head else ''
+
+
+class Metrics:
+    """进程内的请求耗时、SQL和上游AI调用统计，通过 /metrics 以Prometheus文本格式输出
+
+    每个请求在before_request中创建RequestTrace；从连接池取出的连接在该请求内执行语句时回调记录耗时，
+    请求结束时一次性汇总进直方图，记录单条语句只做字典累加，不加锁。
+    """
+
+    def __init__(self, enabled=True, slow_request_ms=0, slow_sample_rate=1.0, slow_top_statements=10):
+        self.enabled = enabled
+        self.slow_request_ms = slow_request_ms
+        self.slow_sample_rate = slow_sample_rate
+        self.slow_top_statements = slow_top_statements
+        self._collectors = {}
+
+        self.request_seconds = Histogram(
+            'http_request_duration_seconds', '请求处理耗时（不含流式响应体的发送）', ('method', 'route', 'status'))
+        self.sql_statements = Histogram(
+            'sql_statements_per_request', '每个请求执行的SQL语句数', ('route',), COUNT_BUCKETS)
+        self.sql_request_seconds = Histogram(
+            'sql_request_duration_seconds', '每个请求中SQL语句的总耗时', ('route',))
+        self.sql_statements_total = Counter('sql_statements_total', '请求中执行的SQL语句数', ('operation',))
+        self.sql_seconds_total = Counter('sql_seconds_total', '请求中SQL语句的累计耗时', ('operation',))
+        self.ai_seconds = Histogram(
+            'ai_upstream_duration_seconds', '上游AI调用耗时（流式调用为建立连接到收到响应头）', ('call', 'outcome'))
+        self.slow_requests = Counter('slow_requests_total', '超过慢请求阈值的请求数', ('route',))
+
+    # ===== 请求生命周期 =====
+    def before_request(self):
+        if self.enabled:
+            g._metrics_trace = RequestTrace()
+
+    def after_request(self, response):
+        trace = g.pop('_metrics_trace', None)
+        if trace is None:
+            return response
+        seconds = time.perf_counter() - trace.start
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        self.request_seconds.observe((request.method, route, str(response.status_code)), seconds)
+        self.sql_statements.observe((route,), trace.sql_count)
+        self.sql_request_seconds.observe((route,), trace.sql_seconds)
+        if trace.statements:
+            by_operation = {}
+            for sql, (count, total) in trace.statements.items():
+                item = by_operation.setdefault(_operation(sql), [0, 0.0])
+                item[0] += count
+                item[1] += total
+            for operation, (count, total) in by_operation.items():
+                self.sql_statements_total.inc((operation,), count)
+                self.sql_seconds_total.inc((operation,), total)
+        if self.slow_request_ms and seconds * 1000 >= self.slow_request_ms:
+            self.slow_requests.inc((route,))
+            if random.random() < self.slow_sample_rate:
+                self._log_slow(trace, route, response.status_code, seconds)
+        return response
+
+    def _log_slow(self, trace, route, status, seconds):
+        top = sorted(trace.statements.items(), key=lambda item: item[1][1], reverse=True)
+        logger.warning(json.dumps({
+            'event': 'slow_request',
+            'method': request.method,
+            'route': route,
+            'path': request.path,
+            'status': status,
+            'duration_ms': round(seconds * 1000, 1),
+            'sql_count': trace.sql_count,
+            'sql_ms': round(trace.sql_seconds * 1000, 1),
+            'ai_ms': round(trace.ai_seconds * 1000, 1),
+            'statements': [
+                {'sql': ' '.join(sql.split())[:300], 'count': count, 'ms': round(total * 1000, 2)}
+                for sql, (count, total) in top[:self.slow_top_statements]
+            ],
+        }, ensure_ascii=False))
+
+    # ===== 供其它模块调用 =====
+    def statement_hook(self):
+        """当前请求记录SQL语句的回调，不在请求中或未启用时返回None"""
+        if not has_request_context():
+            return None
+        trace = g.get('_metrics_trace')
+        return trace.record_statement if trace is not None else None
+
+    def record_ai_call(self, call, seconds, outcome='ok'):
+        if not self.enabled:
+            return
+        self.ai_seconds.observe((call, outcome), seconds)
+        if has_request_context():
+            trace = g.get('_metrics_trace')
+            if trace is not None:
+                trace.ai_seconds += seconds
+
+    def register_collector(self, component, func):
+        """把返回dict的统计函数（如各缓存的stats()）中的数值导出为gauge，同名组件后注册的覆盖先注册的"""
+        self._collectors[component] = func
+
+    # ===== 输出 =====
+    def render(self):
+        lines = []
+        for metric in (self.request_seconds, self.sql_statements, self.sql_request_seconds,
+                       self.sql_statements_total, self.sql_seconds_total, self.ai_seconds, self.slow_requests):
+            metric.render(lines)
+        for component, func in list(self._collectors.items()):
+            try:
+                stats = func()
+            except Exception as e:
+                lines.append(f'# {component} 统计读取失败: {type(e).__name__}')
+                continue
+            for key, value in stats.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f'{PREFIX}{component}_{key}'
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def _stats_access_allowed():
+    config = current_app.config
+    token = config['STATS_TOKEN']
+    if token:
+        scheme, _, supplied = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8')):
+            return True
+    # 经本机反向代理转发的请求remote_addr也是127.0.0.1，带有X-Forwarded-For时不算本机访问
+    return (config['STATS_ALLOW_LOCALHOST'] and request.remote_addr in LOCAL_ADDRESSES
+            and 'X-Forwarded-For' not in request.headers)
+
+
+def stats_endpoint(view):
+    """运行统计接口的访问控制：未开启时返回404，开启后只允许本机或携带令牌的请求"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_app.config['STATS_ENDPOINTS_ENABLED']:
+            return jsonify({'error': '接口不存在'}), 404
+        if not _stats_access_allowed():
+            return jsonify({'error': '无权访问运行统计'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@stats_endpoint
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8',
+                    headers={'Cache-Control': 'no-store'})
+
+
+def init_app(app):
+    for key, value in METRICS_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    metrics.enabled = app.config['METRICS_ENABLED']
+    metrics.slow_request_ms = app.config['METRICS_SLOW_REQUEST_MS']
+    metrics.slow_sample_rate = app.config['METRICS_SLOW_SAMPLE_RATE']
+    metrics.slow_top_statements = app.config['METRICS_SLOW_TOP_STATEMENTS']
+    app.before_request(metrics.before_request)
+    app.after_request(metrics.after_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
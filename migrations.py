@@ -0,0 +1,290 @@
+import click
+from flask.cli import AppGroup
+
+import answered_sets
+import avatar_store
+import questions_io
+import user_stats
+
+# 按版本号顺序执行的数据库迁移，已应用的版本记录在 PRAGMA user_version 中。
+# 旧版本的数据库（user_version为0）可能已经有部分表，所以每个迁移都要能重复执行。
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+
+def column_names(db, table):
+    return {row[1] for row in db.execute(f'PRAGMA table_info({table})')}
+
+
+@migration(1, '创建用户、题目、答题记录和地区探索表')
+def create_base_tables(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            avatar_blob BLOB,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # 最早的版本没有头像字段
+    if 'avatar_blob' not in column_names(db, 'users'):
+        db.execute('ALTER TABLE users ADD COLUMN avatar_blob BLOB')
+
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS questions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question_text TEXT NOT NULL,
+            option_a TEXT NOT NULL,
+            option_b TEXT NOT NULL,
+            option_c TEXT NOT NULL,
+            option_d TEXT NOT NULL,
+            correct_answer TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS answer_records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            user_answer TEXT NOT NULL,
+            is_correct INTEGER NOT NULL,
+            answered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (question_id) REFERENCES questions (id)
+        )
+    """)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS city_explorations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            city_name TEXT NOT NULL,
+            explored_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            UNIQUE(user_id, city_name)
+        )
+    """)
+
+
+@migration(2, '初始化测试题目')
+def seed_test_questions(db):
+    from database import init_test_questions
+    init_test_questions(db)
+
+
+@migration(3, '头像按内容哈希存储')
+def content_addressed_avatars(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS avatar_blobs (
+            hash TEXT NOT NULL,
+            variant TEXT NOT NULL,
+            content_type TEXT NOT NULL,
+            data BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (hash, variant)
+        )
+    """)
+    if 'avatar_hash' not in column_names(db, 'users'):
+        db.execute('ALTER TABLE users ADD COLUMN avatar_hash TEXT')
+    # 迁移旧版存放在用户表中的头像
+    avatar_store.migrate_legacy_avatars(db)
+
+
+@migration(4, '用户统计汇总表')
+def create_user_stats(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            total_answers INTEGER NOT NULL DEFAULT 0,
+            correct_answers INTEGER NOT NULL DEFAULT 0,
+            exploration_count INTEGER NOT NULL DEFAULT 0,
+            explored_cities TEXT,
+            last_activity_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+    # 按用户查询答题记录的覆盖索引
+    db.execute('CREATE INDEX IF NOT EXISTS idx_answer_records_user ON answer_records (user_id, is_correct)')
+    # 已有数据的旧数据库根据历史记录回填统计
+    user_stats.backfill(db)
+
+
+@migration(5, 'AI回答缓存表')
+def create_ai_answer_cache(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS ai_answer_cache (
+            question_key TEXT PRIMARY KEY,
+            question TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_hit_at REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    db.execute('CREATE INDEX IF NOT EXISTS idx_ai_answer_cache_last_hit ON ai_answer_cache (last_hit_at)')
+
+
+@migration(6, '数据版本表，用于多进程缓存失效')
+def create_data_versions(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    # questions表发生任何变化时递增版本号
+    questions_io.create_version_triggers(db)
+
+
+@migration(7, '探索记录版本号，用于客户端增量同步')
+def exploration_versions(db):
+    if 'version' not in column_names(db, 'city_explorations'):
+        db.execute('ALTER TABLE city_explorations ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+    db.execute(
+        'CREATE INDEX IF NOT EXISTS idx_city_explorations_user_version ON city_explorations (user_id, version)'
+    )
+
+
+@migration(8, '题目统计表和排行榜索引')
+def create_question_stats(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS question_stats (
+            question_id INTEGER PRIMARY KEY,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            correct INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    # 按正确率排序的表达式索引，表达式需与aggregates.ACCURACY_EXPR一致
+    db.execute(
+        'CREATE INDEX IF NOT EXISTS idx_question_stats_accuracy ON question_stats ((CAST(correct AS REAL) / attempts))'
+    )
+    db.execute(
+        'CREATE INDEX IF NOT EXISTS idx_user_stats_rank '
+        'ON user_stats (correct_answers DESC, total_answers ASC, user_id ASC)'
+    )
+    db.execute('DELETE FROM question_stats')
+    db.execute("""
+        INSERT INTO question_stats (question_id, attempts, correct)
+        SELECT question_id, COUNT(*), SUM(is_correct) FROM answer_records GROUP BY question_id
+    """)
+
+
+@migration(9, '用户答题位图，用于抽题时避开做过的题')
+def create_user_answer_sets(db):
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS user_answer_sets (
+            user_id INTEGER PRIMARY KEY,
+            answered BLOB NOT NULL,
+            wrong BLOB NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    """)
+    answered_sets.backfill(db)
+
+
+@migration(10, '题目内容哈希，用于批量导入时去重')
+def add_question_content_hash(db):
+    if 'content_hash' not in column_names(db, 'questions'):
+        db.execute('ALTER TABLE questions ADD COLUMN content_hash TEXT')
+    # 已有的重复题目只有最早一道写入哈希，其余保持NULL，不影响唯一索引
+    questions_io.backfill_hashes(db)
+    db.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_questions_content_hash ON questions (content_hash)')
+
+
+@migration(11, '按题目的答题记录索引，汇总统计可按题目id分段重建')
+def add_answer_records_question_index(db):
+    db.execute('CREATE INDEX IF NOT EXISTS idx_answer_records_question ON answer_records (question_id, is_correct)')
+
+
+LATEST_VERSION = max(version for version, _, _ in MIGRATIONS)
+
+
+def current_version(db):
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def pending_migrations(db):
+    version = current_version(db)
+    return [item for item in sorted(MIGRATIONS) if item[0] > version]
+
+
+def upgrade(db, target=None, echo=None):
+    """依次执行未应用的迁移，返回已执行的版本号列表
+
+    每个迁移在一个 BEGIN IMMEDIATE 事务中执行，并在同一事务里写入 user_version，
+    多个进程同时启动时只有一个会真正执行，其余进程拿到锁后发现版本已是最新便直接返回。
+    """
+    target = LATEST_VERSION if target is None else target
+    applied = []
+    for version, description, func in sorted(MIGRATIONS):
+        if version > target:
+            break
+        if db.in_transaction:
+            db.commit()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if current_version(db) >= version:
+                db.rollback()
+                continue
+            db.execute(f'PRAGMA user_version = {int(version)}')
+            func(db)
+            if db.in_transaction:
+                db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        applied.append(version)
+        if echo:
+            echo(f'已应用迁移 {version}: {description}')
+    return applied
+
+
+_schema_current = False
+
+
+def ensure_schema(db, auto_migrate=True):
+    """启动时检查数据库结构：已是最新时只读取一次user_version"""
+    global _schema_current
+    if _schema_current:
+        return
+    version = current_version(db)
+    if version < LATEST_VERSION:
+        if not auto_migrate:
+            # 不自动迁移时由部署流程执行 flask db upgrade，这里只提示
+            print(f'数据库结构版本为 {version}，需要升级到 {LATEST_VERSION}，请运行 flask db upgrade')
+            return
+        upgrade(db, echo=print)
+    elif version > LATEST_VERSION:
+        raise RuntimeError(f'数据库结构版本 {version} 高于当前代码支持的版本 {LATEST_VERSION}')
+    _schema_current = True
+
+
+db_cli = AppGroup('db', help='数据库结构迁移')
+
+
+@db_cli.command('upgrade')
+@click.option('--to', 'target', type=int, default=None, help='只升级到指定版本')
+def upgrade_command(target):
+    """执行尚未应用的数据库迁移"""
+    from database import get_db
+    applied = upgrade(get_db(), target=target, echo=click.echo)
+    if not applied:
+        click.echo(f'数据库已是最新版本 {current_version(get_db())}')
+
+
+@db_cli.command('version')
+def version_command():
+    """显示当前数据库结构版本和待执行的迁移"""
+    from database import get_db
+    db = get_db()
+    click.echo(f'当前版本 {current_version(db)}，最新版本 {LATEST_VERSION}')
+    for version, description, _ in pending_migrations(db):
+        click.echo(f'  待执行 {version}: {description}')
@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+
+from pdf_assets import build_manifest, ebook_cli, pdf_assets
+
+try:
+    from PIL import Image, features
+except ImportError:  # 未安装Pillow时不生成页面图片
+    Image = None
+
+try:
+    import pypdfium2
+except ImportError:  # 未安装pypdfium2时尝试使用poppler的pdftoppm
+    pypdfium2 = None
+
+BUILD_DIR = os.path.join('build', 'pages')
+
+# 默认配置，可在app.config中覆盖
+PAGE_IMAGE_DEFAULTS = {
+    'PAGE_IMAGE_WIDTHS': (480, 960, 1440),
+    'PAGE_IMAGE_WORKERS': None,
+}
+
+_DIGEST = re.compile(r'^[0-9a-f]{32}$')
+
+
+def renderer_name():
+    if Image is None:
+        return None
+    if pypdfium2 is not None:
+        return 'pdfium'
+    if shutil.which('pdftoppm'):
+        return 'pdftoppm'
+    return None
+
+
+def image_format():
+    if Image is not None and features.check('webp'):
+        return 'webp'
+    return 'png'
+
+
+def page_digests(pdf_path):
+    """按每页引用的对象字节计算页面哈希，PDF修改后只有内容变化的页面需要重新渲染"""
+    manifest = build_manifest(pdf_path)
+    digests = []
+    with open(pdf_path, 'rb') as f:
+        for page in manifest['pages']:
+            sha = hashlib.sha256()
+            for start, end in page['ranges']:
+                f.seek(start)
+                sha.update(f.read(end - start))
+            digests.append(sha.hexdigest()[:32])
+    return digests
+
+
+def page_sizes(pdf_path):
+    from pypdf import PdfReader
+    return [(float(page.mediabox.width), float(page.mediabox.height)) for page in PdfReader(pdf_path).pages]
+
+
+_worker_documents = {}
+
+
+def _rasterize(pdf_path, index, width, page_width):
+    if pypdfium2 is not None:
+        document = _worker_documents.get(pdf_path)
+        if document is None:
+            document = _worker_documents[pdf_path] = pypdfium2.PdfDocument(pdf_path)
+        return document[index].render(scale=width / page_width).to_pil()
+    with tempfile.TemporaryDirectory() as tmp:
+        prefix = os.path.join(tmp, 'page')
+        subprocess.run(['pdftoppm', '-f', str(index + 1), '-l', str(index + 1), '-singlefile',
+                        '-scale-to-x', str(width), '-scale-to-y', '-1', '-png', pdf_path, prefix],
+                       check=True, capture_output=True)
+        with Image.open(prefix + '.png') as image:
+            image.load()
+            return image
+
+
+def _render_page(task):
+    """在子进程中渲染一页：按最大宽度栅格化一次，再缩小出其余尺寸"""
+    pdf_path, index, page_width, widths, fmt, page_dir = task
+    widths = sorted(widths, reverse=True)
+    image = _rasterize(pdf_path, index, widths[0], page_width).convert('RGB')
+    os.makedirs(page_dir, exist_ok=True)
+    for width in widths:
+        if image.width != width:
+            image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        target = os.path.join(page_dir, f'{width}.{fmt}')
+        tmp = target + '.tmp'
+        if fmt == 'webp':
+            image.save(tmp, 'WEBP', quality=82, method=4)
+        else:
+            image.save(tmp, 'PNG', optimize=True)
+        os.replace(tmp, target)
+    return index
+
+
+class PageImages:
+    """电子书页面图片的预渲染产物，按页面内容哈希存放在 build/pages/<哈希前两位>/<哈希>/ 下"""
+
+    def __init__(self, widths=(480, 960, 1440), workers=None):
+        self.widths = tuple(widths)
+        self.workers = workers
+        self.root_path = None
+        self._indexes = {}
+
+    @property
+    def build_dir(self):
+        return os.path.join(self.root_path, BUILD_DIR)
+
+    def page_dir(self, digest):
+        return os.path.join(self.build_dir, digest[:2], digest)
+
+    def index_path(self, filename):
+        return os.path.join(self.build_dir, filename + '.pages.json')
+
+    def image_path(self, digest, width, fmt):
+        if not _DIGEST.match(digest):
+            return None
+        path = os.path.join(self.page_dir(digest), f'{width}.{fmt}')
+        return path if os.path.exists(path) else None
+
+    def render(self, filename, force=False):
+        """渲染一个PDF的全部页面，已存在的页面图片直接复用；返回 (页数, 新渲染页数)"""
+        pdf_path = pdf_assets.source_path(filename)
+        fmt = image_format()
+        digests = page_digests(pdf_path)
+        sizes = page_sizes(pdf_path)
+
+        tasks = []
+        for index, digest in enumerate(digests):
+            page_dir = self.page_dir(digest)
+            if force or not all(os.path.exists(os.path.join(page_dir, f'{w}.{fmt}')) for w in self.widths):
+                tasks.append((pdf_path, index, sizes[index][0], self.widths, fmt, page_dir))
+        if tasks:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(_render_page, tasks))
+
+        index = {
+            'format': fmt,
+            'widths': list(self.widths),
+            'page_count': len(digests),
+            'pages': [
+                {'page': number, 'hash': digest, 'width': round(w, 2), 'height': round(h, 2)}
+                for number, (digest, (w, h)) in enumerate(zip(digests, sizes), 1)
+            ],
+        }
+        path = self.index_path(filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(path + '.tmp', path)
+        self._indexes.pop(filename, None)
+        return len(digests), len(tasks)
+
+    def render_all(self, force=False):
+        if renderer_name() is None:
+            raise click.ClickException('没有可用的PDF渲染器，请安装Pillow和pypdfium2（或poppler-utils）')
+        source_dir = os.path.join(self.root_path, 'source')
+        results = {}
+        if os.path.isdir(source_dir):
+            for dirpath, _, files in os.walk(source_dir):
+                for name in files:
+                    if name.endswith('.pdf'):
+                        filename = os.path.relpath(os.path.join(dirpath, name), source_dir)
+                        results[filename] = self.render(filename, force=force)
+        self.collect_garbage()
+        return results
+
+    def collect_garbage(self):
+        """删除不再被任何索引引用的页面图片目录"""
+        referenced = set()
+        for dirpath, _, files in os.walk(self.build_dir):
+            for name in files:
+                if name.endswith('.pages.json'):
+                    with open(os.path.join(dirpath, name), 'r', encoding='utf-8') as f:
+                        referenced.update(page['hash'] for page in json.load(f)['pages'])
+        removed = 0
+        for prefix in os.listdir(self.build_dir) if os.path.isdir(self.build_dir) else ():
+            prefix_dir = os.path.join(self.build_dir, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+            for digest in os.listdir(prefix_dir):
+                if _DIGEST.match(digest) and digest not in referenced:
+                    shutil.rmtree(os.path.join(prefix_dir, digest))
+                    removed += 1
+        return removed
+
+    def index(self, filename):
+        """返回 (etag, 索引JSON文本)，尚未渲染时返回None"""
+        meta = pdf_assets.meta.get(self.index_path(filename))
+        if meta is None:
+            return None
+        cached = self._indexes.get(filename)
+        if cached is None or cached[0] != meta.etag:
+            with open(meta.path, 'r', encoding='utf-8') as f:
+                cached = (meta.etag, f.read())
+            self._indexes[filename] = cached
+        return cached
+
+
+page_images = PageImages()
+
+
+def init_app(app):
+    for key, value in PAGE_IMAGE_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    page_images.root_path = app.root_path
+    page_images.widths = tuple(app.config['PAGE_IMAGE_WIDTHS'])
+    page_images.workers = app.config['PAGE_IMAGE_WORKERS']
+
+    @ebook_cli.command('render')
+    @click.option('--force', is_flag=True, help='忽略已有图片，全部重新渲染')
+    def render_command(force):
+        """把source/下的PDF逐页渲染为图片，供电子书快速显示"""
+        for filename, (pages, rendered) in page_images.render_all(force=force).items():
+            click.echo(f'{filename}: 共 {pages} 页，新渲染 {rendered} 页')
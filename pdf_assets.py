@@ -0,0 +1,228 @@
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+import click
+from flask.cli import AppGroup
+
+try:
+    from pypdf import PdfReader
+    from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject
+except ImportError:  # 未安装pypdf时不生成分页索引
+    PdfReader = None
+
+BUILD_DIR = os.path.join('build', 'pdf')
+
+
+class FileMeta:
+    __slots__ = ('path', 'size', 'mtime', 'etag', 'checked_at')
+
+    def __init__(self, path, size, mtime, etag, checked_at):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.etag = etag
+        self.checked_at = checked_at
+
+
+class FileMetaCache:
+    """文件元数据缓存，同一文件在 ttl 秒内不再重复stat"""
+
+    def __init__(self, ttl=2.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, path):
+        now = time.monotonic()
+        meta = self._entries.get(path)
+        if meta is not None and now - meta.checked_at < self.ttl:
+            return meta
+        try:
+            stat = os.stat(path)
+        except OSError:
+            with self._lock:
+                self._entries.pop(path, None)
+            return None
+        if meta is not None and meta.size == stat.st_size and meta.mtime == stat.st_mtime:
+            meta.checked_at = now
+            return meta
+        etag = hashlib.sha1(f'{path}:{stat.st_size}:{stat.st_mtime_ns}'.encode()).hexdigest()[:20]
+        meta = FileMeta(path, stat.st_size, stat.st_mtime, etag, now)
+        with self._lock:
+            self._entries[path] = meta
+        return meta
+
+
+def _collect_refs(obj, refs, seen):
+    """收集一个页面直接或间接引用的全部对象编号（不沿/Parent向上遍历整个页面树）"""
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, IndirectObject):
+            if item.idnum in seen:
+                continue
+            seen.add(item.idnum)
+            refs.add(item.idnum)
+            stack.append(item.get_object())
+        elif isinstance(item, DictionaryObject):
+            stack.extend(value for key, value in item.items() if key != '/Parent')
+        elif isinstance(item, ArrayObject):
+            stack.extend(item)
+        elif hasattr(item, 'get') and hasattr(item, 'items'):
+            # 流对象同样是字典结构
+            stack.extend(value for key, value in item.items() if key != '/Parent')
+
+
+def _merge_ranges(ranges, gap=1024):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def build_manifest(pdf_path):
+    """生成每一页所需对象的字节范围，供阅读器按页预取"""
+    reader = PdfReader(pdf_path)
+    size = os.path.getsize(pdf_path)
+
+    offsets = {}
+    for generation in reader.xref.values():
+        offsets.update(generation)
+    # 压缩在对象流中的对象，以所在对象流的位置为准
+    for idnum, (stream_id, _) in getattr(reader, 'xref_objStm', {}).items():
+        if stream_id in offsets:
+            offsets.setdefault(idnum, offsets[stream_id])
+    boundaries = sorted(set(offsets.values()) | {size})
+
+    def object_range(idnum):
+        start = offsets.get(idnum)
+        if start is None:
+            return None
+        end = boundaries[bisect.bisect_right(boundaries, start)] if start < size else size
+        return start, end
+
+    pages = []
+    for number, page in enumerate(reader.pages, 1):
+        refs, seen = set(), set()
+        if page.indirect_reference is not None:
+            refs.add(page.indirect_reference.idnum)
+            seen.add(page.indirect_reference.idnum)
+        _collect_refs(page, refs, seen)
+        ranges = [r for r in (object_range(idnum) for idnum in refs) if r]
+        merged = _merge_ranges(ranges)
+        pages.append({
+            'page': number,
+            'ranges': merged,
+            'bytes': sum(end - start for start, end in merged),
+        })
+    return {'size': size, 'page_count': len(pages), 'pages': pages}
+
+
+def linearize(pdf_path, output_path):
+    """使用qpdf生成线性化（快速网页查看）的副本，未安装qpdf时返回False"""
+    qpdf = shutil.which('qpdf')
+    if qpdf is None:
+        return False
+    result = subprocess.run([qpdf, '--linearize', pdf_path, output_path], capture_output=True)
+    # qpdf返回3表示有警告但已成功输出
+    return result.returncode in (0, 3) and os.path.exists(output_path)
+
+
+class PdfAssets:
+    """电子书PDF的分发：优先使用线性化副本，并提供分页字节范围索引"""
+
+    def __init__(self):
+        self.meta = FileMetaCache()
+        self._manifests = {}
+        self.root_path = None
+
+    def source_path(self, filename):
+        return os.path.join(self.root_path, 'source', filename)
+
+    def build_path(self, filename, suffix):
+        return os.path.join(self.root_path, BUILD_DIR, filename + suffix)
+
+    def resolve(self, filename):
+        """返回实际要发送的文件元数据，线性化副本比源文件新时使用副本"""
+        source = self.meta.get(self.source_path(filename))
+        if source is None:
+            return None
+        linearized = self.meta.get(self.build_path(filename, '.linearized.pdf'))
+        if linearized is not None and linearized.mtime >= source.mtime:
+            return linearized
+        return source
+
+    def build(self, filename, force=False):
+        source = self.source_path(filename)
+        source_mtime = os.path.getmtime(source)
+        os.makedirs(os.path.dirname(self.build_path(filename, '')), exist_ok=True)
+
+        linearized = self.build_path(filename, '.linearized.pdf')
+        if force or not os.path.exists(linearized) or os.path.getmtime(linearized) < source_mtime:
+            linearize(source, linearized)
+
+        manifest_path = self.build_path(filename, '.manifest.json')
+        if PdfReader is not None and (force or not os.path.exists(manifest_path)
+                                      or os.path.getmtime(manifest_path) < source_mtime):
+            target = self.resolve(filename)
+            manifest = build_manifest(target.path)
+            manifest['etag'] = target.etag
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+        self._manifests.pop(filename, None)
+
+    def build_all(self, force=False):
+        source_dir = os.path.join(self.root_path, 'source')
+        if not os.path.isdir(source_dir):
+            return []
+        built = []
+        for dirpath, _, files in os.walk(source_dir):
+            for name in files:
+                if name.endswith('.pdf'):
+                    filename = os.path.relpath(os.path.join(dirpath, name), source_dir)
+                    try:
+                        self.build(filename, force=force)
+                        built.append(filename)
+                    except Exception as e:
+                        print(f"PDF预处理失败 {filename}: {e}")
+        return built
+
+    def manifest(self, filename):
+        path = self.build_path(filename, '.manifest.json')
+        meta = self.meta.get(path)
+        if meta is None:
+            return None
+        cached = self._manifests.get(filename)
+        if cached is None or cached[0] != meta.etag:
+            with open(path, 'r', encoding='utf-8') as f:
+                cached = (meta.etag, f.read())
+            self._manifests[filename] = cached
+        return cached
+
+
+pdf_assets = PdfAssets()
+
+ebook_cli = AppGroup('ebook', help='电子书PDF预处理')
+
+
+@ebook_cli.command('build')
+@click.option('--force', is_flag=True, help='源文件未变化也重新生成')
+def build_command(force):
+    """生成线性化副本和分页字节范围索引"""
+    built = pdf_assets.build_all(force=force)
+    click.echo(f'已处理 {len(built)} 个PDF文件')
+
+
+def init_app(app):
+    pdf_assets.root_path = app.root_path
+    pdf_assets.build_all()
+    app.cli.add_command(ebook_cli)
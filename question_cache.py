@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class QuestionRecord:
+    """缓存中的题目记录，使用__slots__减少内存占用"""
+
+    __slots__ = ('id', 'question_text', 'option_a', 'option_b', 'option_c', 'option_d', 'correct_answer')
+
+    def __init__(self, id, question_text, option_a, option_b, option_c, option_d, correct_answer):
+        self.id = id
+        self.question_text = question_text
+        self.option_a = option_a
+        self.option_b = option_b
+        self.option_c = option_c
+        self.option_d = option_d
+        self.correct_answer = correct_answer
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row['id'], row['question_text'], row['option_a'], row['option_b'],
+                   row['option_c'], row['option_d'], row['correct_answer'])
+
+    def __getitem__(self, key):
+        # 兼容原先 sqlite3.Row 的下标访问方式
+        return getattr(self, key)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'question': self.question_text,
+            'option_a': self.option_a,
+            'option_b': self.option_b,
+            'option_c': self.option_c,
+            'option_d': self.option_d,
+            'correct_answer': self.correct_answer
+        }
+
+
+QUESTION_COLUMNS = 'id, question_text, option_a, option_b, option_c, option_d, correct_answer'
+
+
+def get_data_version(db, name):
+    row = db.execute('SELECT version FROM data_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_data_version(db, name):
+    db.execute(
+        'INSERT INTO data_versions (name, version) VALUES (?, 1) '
+        'ON CONFLICT(name) DO UPDATE SET version = version + 1',
+        (name,)
+    )
+
+
+class QuestionCache:
+    """进程内题目LRU缓存
+
+    questions表的任何改动都会通过触发器递增 data_versions 中的 'questions' 版本号，
+    各个worker进程定期比对版本号，发现变化就整体清空缓存，从而保持多进程一致。
+    """
+
+    def __init__(self, max_size=10000, version_check_interval=1.0):
+        self.max_size = max_size
+        self.version_check_interval = version_check_interval
+        self._lock = threading.Lock()
+        self._records = OrderedDict()
+        self._version = None
+        self._last_check = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._version = None
+            self._last_check = 0.0
+
+    def _check_version(self, db):
+        now = time.monotonic()
+        if self._version is not None and now - self._last_check < self.version_check_interval:
+            return
+        version = get_data_version(db, 'questions')
+        with self._lock:
+            if self._version is not None and version != self._version:
+                self._records.clear()
+                self.invalidations += 1
+            self._version = version
+            self._last_check = now
+
+    def _put(self, record):
+        self._records[record.id] = record
+        self._records.move_to_end(record.id)
+        while len(self._records) > self.max_size:
+            self._records.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, db, question_id):
+        return self.get_many(db, [question_id]).get(question_id)
+
+    def get_many(self, db, question_ids):
+        """按id批量取题，返回 {id: QuestionRecord}，未命中的部分用一次IN查询补齐"""
+        self._check_version(db)
+        found = {}
+        missing = []
+        with self._lock:
+            for qid in question_ids:
+                record = self._records.get(qid)
+                if record is None:
+                    missing.append(qid)
+                else:
+                    self._records.move_to_end(qid)
+                    found[qid] = record
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing:
+            placeholders = ','.join('?' * len(missing))
+            rows = db.execute(
+                f'SELECT {QUESTION_COLUMNS} FROM questions WHERE id IN ({placeholders})', missing
+            ).fetchall()
+            with self._lock:
+                for row in rows:
+                    record = QuestionRecord.from_row(row)
+                    self._put(record)
+                    found[record.id] = record
+        return found
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._records),
+                'max_size': self.max_size,
+                'version': self._version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+
+question_cache = QuestionCache()
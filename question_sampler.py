@@ -0,0 +1,128 @@
+import random
+import threading
+import time
+
+
+class QuestionSampler:
+    """随机抽题器
+
+    在内存中维护题目id数组，抽题时直接从数组中取k个不重复的id，
+    再用一次 WHERE id IN (...) 查询取回题目，避免 ORDER BY RANDOM() 的全表扫描排序。
+
+    id索引按增量方式维护：
+    - 新增题目：定期用 MAX(id) 检查，只加载比已知最大id更大的新行；
+    - 删除题目：查询结果缺失的id会被当场移出索引并补抽。
+    """
+
+    def __init__(self, refresh_interval=1.0, rng=None):
+        self.refresh_interval = refresh_interval
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._ids = []
+        self._positions = {}
+        self._max_id = 0
+        self._loaded = False
+        self._last_refresh = 0.0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, question_id):
+        # 只读一次字典，不加锁，可在choose回调中（已持有锁时）使用
+        return question_id in self._positions
+
+    def add(self, question_id):
+        with self._lock:
+            self._add(question_id)
+
+    def remove(self, question_id):
+        with self._lock:
+            self._remove(question_id)
+
+    def reset(self):
+        with self._lock:
+            self._ids = []
+            self._positions = {}
+            self._max_id = 0
+            self._loaded = False
+            self._last_refresh = 0.0
+
+    def _add(self, question_id):
+        if question_id in self._positions:
+            return
+        self._positions[question_id] = len(self._ids)
+        self._ids.append(question_id)
+        if question_id > self._max_id:
+            self._max_id = question_id
+
+    def _remove(self, question_id):
+        # 与末尾元素交换后弹出，O(1)删除
+        pos = self._positions.pop(question_id, None)
+        if pos is None:
+            return
+        last = self._ids.pop()
+        if last != question_id:
+            self._ids[pos] = last
+            self._positions[last] = pos
+
+    def refresh(self, db, force=False):
+        now = time.monotonic()
+        if not force and self._loaded and now - self._last_refresh < self.refresh_interval:
+            return
+        with self._lock:
+            if not self._loaded:
+                for row in db.execute('SELECT id FROM questions'):
+                    self._add(row[0])
+                self._loaded = True
+            else:
+                max_id = db.execute('SELECT MAX(id) FROM questions').fetchone()[0] or 0
+                if max_id > self._max_id:
+                    for row in db.execute('SELECT id FROM questions WHERE id > ?', (self._max_id,)):
+                        self._add(row[0])
+            self._last_refresh = now
+
+    def sample_ids(self, k, choose=None):
+        with self._lock:
+            if choose is not None:
+                return choose(self._ids, k, self._rng)
+            k = min(k, len(self._ids))
+            return self._rng.sample(self._ids, k)
+
+    def sample(self, db, k=10, fetch=None, choose=None):
+        """随机抽取k道题目，返回按抽样顺序排列的题目
+
+        fetch(db, ids) 返回 {id: 题目}，默认直接查询questions表，
+        可替换为带缓存的取题函数。
+        choose(ids, k, rng) 从全部题目id中挑选k个，默认均匀随机抽取。
+        """
+        fetch = fetch or fetch_rows
+        self.refresh(db)
+        ids = self.sample_ids(k, choose)
+        rows = []
+        # 少量重试以补齐被删除题目留下的空缺
+        for _ in range(3):
+            if not ids:
+                break
+            found = fetch(db, ids)
+            missing = [qid for qid in ids if qid not in found]
+            rows.extend(found[qid] for qid in ids if qid in found)
+            if not missing:
+                break
+            with self._lock:
+                for qid in missing:
+                    self._remove(qid)
+            chosen = {row['id'] for row in rows}
+            pool = [qid for qid in self.sample_ids(k * 2, choose) if qid not in chosen]
+            ids = pool[:k - len(rows)]
+        return rows
+
+
+def fetch_rows(db, ids):
+    placeholders = ','.join('?' * len(ids))
+    return {
+        row['id']: row for row in
+        db.execute(f'SELECT * FROM questions WHERE id IN ({placeholders})', ids)
+    }
+
+
+sampler = QuestionSampler()
@@ -0,0 +1,345 @@
+import glob
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+import click
+
+from question_cache import QuestionRecord, get_data_version, question_cache
+from questions_io import questions_cli
+
+try:
+    import fcntl
+except ImportError:  # Windows上没有fcntl，多个进程可能同时生成同一版本的快照，结果相同
+    fcntl = None
+
+BUILD_DIR = os.path.join('build', 'questions')
+
+# 默认配置，可在app.config中覆盖
+QUESTION_SNAPSHOT_DEFAULTS = {
+    'QUESTION_SNAPSHOT_ENABLED': True,
+    # 发现快照版本落后于数据库时，在后台线程中重新生成
+    'QUESTION_SNAPSHOT_AUTO_BUILD': True,
+    'QUESTION_SNAPSHOT_CHECK_INTERVAL': 1.0,
+}
+
+# 文件头：魔数、格式版本、题目数、data_versions中的题目版本号、最大题目id、索引区偏移
+MAGIC = b'MPXYQSNP'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIIQQQ')
+# 题干和四个选项用NUL连接成一个字符串存放，读取时一次切片、一次解码
+SEPARATOR = '\x00'
+
+
+def _align(offset):
+    return (offset + 3) & ~3
+
+
+class QuestionSnapshot:
+    """映射到内存的只读题库快照
+
+    文件布局（整数均为本机字节序的uint32，快照只在本机生成和读取）：
+        文件头 | UTF-8字符串堆 | 题目id（升序）| 答案（每题1字节）| 每题字符串的起始偏移（另加结尾1个）
+    按id二分查找下标后直接从映射内存中解码所需字段，进程内不为整个题库分配对象；
+    fork出的各worker映射同一个文件，共享操作系统的页缓存。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt, count, version, max_id, index_offset = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            self._mmap.close()
+            raise ValueError(f'不是有效的题库快照: {path}')
+        self.count = count
+        self.version = version
+        self.max_id = max_id
+        self.size = len(self._mmap)
+
+        view = memoryview(self._mmap)
+        pos = index_offset
+        self.ids = view[pos:pos + 4 * count].cast('I')
+        pos += 4 * count
+        self._answers = view[pos:pos + count]
+        pos = _align(pos + count)
+        self._offsets = view[pos:pos + 4 * (count + 1)].cast('I')
+        self._first_id = self.ids[0] if count else 0
+
+    def __len__(self):
+        return self.count
+
+    def index(self, question_id):
+        # 题目id通常连续自增，先按位置直接猜一次，猜不中再二分查找
+        guess = question_id - self._first_id
+        if 0 <= guess < self.count and self.ids[guess] == question_id:
+            return guess
+        i = bisect_left(self.ids, question_id)
+        if i < self.count and self.ids[i] == question_id:
+            return i
+        return -1
+
+    def record(self, i):
+        offsets = self._offsets
+        text = self._mmap[offsets[i]:offsets[i + 1]].decode('utf-8')
+        return QuestionRecord(self.ids[i], *text.split(SEPARATOR), chr(self._answers[i]))
+
+    def get(self, question_id):
+        i = self.index(question_id)
+        return self.record(i) if i >= 0 else None
+
+    def get_many(self, question_ids):
+        found = {}
+        for qid in question_ids:
+            i = self.index(qid)
+            if i >= 0:
+                found[qid] = self.record(i)
+        return found
+
+
+def write_snapshot(db, f):
+    """在一个读事务内把questions表写入已打开的二进制文件f，返回 (题目数, 版本号)
+
+    字符串堆边读边写入文件，内存中只保留id、答案和偏移数组（每题9字节）。
+    """
+    ids = array('I')
+    answers = bytearray()
+    offsets = array('I')
+    began = not db.in_transaction
+    if began:
+        db.execute('BEGIN')
+    try:
+        version = get_data_version(db, 'questions')
+        f.write(bytes(HEADER.size))
+        # 偏移为相对文件开头的绝对位置
+        position = HEADER.size
+        cursor = db.execute('SELECT id, question_text, option_a, option_b, option_c, option_d, correct_answer '
+                            'FROM questions ORDER BY id')
+        while True:
+            rows = cursor.fetchmany(5000)
+            if not rows:
+                break
+            for row in rows:
+                if any(SEPARATOR in text for text in row[1:6]):
+                    raise ValueError(f'题目{row[0]}中含有NUL字符，无法生成快照')
+                data = SEPARATOR.join(row[1:6]).encode('utf-8')
+                ids.append(row[0])
+                answers.append(ord(row[6][:1] or ' '))
+                offsets.append(position)
+                f.write(data)
+                position += len(data)
+        offsets.append(position)
+        index_offset = _align(position)
+        f.write(bytes(index_offset - position))
+        f.write(ids.tobytes())
+        f.write(answers)
+        f.write(bytes(_align(len(answers)) - len(answers)))
+        f.write(offsets.tobytes())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(ids), version, ids[-1] if ids else 0, index_offset))
+    finally:
+        if began:
+            db.rollback()
+    return len(ids), version
+
+
+class QuestionStore:
+    """按id取题：有与数据库题目版本一致的快照时直接读快照，否则回退到question_cache
+
+    快照文件名带有数据库路径的哈希和题目版本号，题目有任何改动（触发器递增版本号）后，
+    各worker在下一次版本检查时发现文件不存在，先回退到数据库查询，
+    同时由其中一个进程在后台生成新快照（文件锁保证只生成一次），之后各进程自动映射新文件。
+    """
+
+    def __init__(self, fallback, enabled=True, auto_build=True, check_interval=1.0):
+        self.fallback = fallback
+        self.enabled = enabled
+        self.auto_build = auto_build
+        self.check_interval = check_interval
+        self.directory = BUILD_DIR
+        self.database = None
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._version = None
+        self._last_check = 0.0
+        self._building = False
+        self._failed_version = None
+        self.hits = 0
+        self.fallbacks = 0
+        self.logger = logging.getLogger(__name__)
+        self.loads = 0
+        self.builds = 0
+        self.last_build_ms = None
+
+    def configure(self, directory, database, enabled=True, auto_build=True, check_interval=1.0):
+        with self._lock:
+            self.directory = directory
+            self.database = database
+            self.enabled = enabled
+            self.auto_build = auto_build
+            self.check_interval = check_interval
+            self._snapshot = None
+            self._version = None
+            self._last_check = 0.0
+
+    def path_for(self, version):
+        key = hashlib.sha1(os.path.abspath(self.database or '').encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.directory, f'questions-{key}-{version}.snap')
+
+    # ===== 取题 =====
+    def get(self, db, question_id):
+        return self.get_many(db, [question_id]).get(question_id)
+
+    def get_many(self, db, question_ids):
+        # 非整数的id不可能命中，也不能参与快照中的下标计算
+        question_ids = [qid for qid in question_ids if isinstance(qid, int) and not isinstance(qid, bool)]
+        snapshot = self.current(db)
+        if snapshot is None:
+            self.fallbacks += 1
+            return self.fallback.get_many(db, question_ids)
+        self.hits += 1
+        return snapshot.get_many(question_ids)
+
+    def current(self, db):
+        """与数据库题目版本一致的快照，没有时返回None"""
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        if self._version is not None and now - self._last_check < self.check_interval:
+            return self._snapshot
+        version = get_data_version(db, 'questions')
+        with self._lock:
+            self._last_check = now
+            if version == self._version and self._snapshot is not None:
+                return self._snapshot
+            self._version = version
+            self._snapshot = self._open(version, db)
+            if (self._snapshot is None and self.auto_build and not self._building
+                    and version != self._failed_version):
+                self._building = True
+                threading.Thread(target=self._build_in_background, name='question-snapshot',
+                                 daemon=True).start()
+            return self._snapshot
+
+    def _open(self, version, db):
+        snapshot = self._load(self.path_for(version), version, db)
+        if snapshot is not None:
+            self.loads += 1
+        return snapshot
+
+    def _load(self, path, version, db):
+        if not os.path.exists(path):
+            return None
+        try:
+            snapshot = QuestionSnapshot(path)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f'题库快照读取失败: {e}')
+            return None
+        # 数据库被重建后版本号可能与旧快照重复，用最大题目id再核对一次
+        max_id = db.execute('SELECT MAX(id) FROM questions').fetchone()[0] or 0
+        if snapshot.version != version or snapshot.max_id != max_id:
+            return None
+        return snapshot
+
+    # ===== 生成 =====
+    def build(self, db):
+        """生成当前版本的快照（已存在时直接返回），并删除本数据库的旧版本快照；返回文件路径"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'a+b') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            version = get_data_version(db, 'questions')
+            path = self.path_for(version)
+            if self._load(path, version, db) is None:
+                start = time.perf_counter()
+                tmp = os.path.join(self.directory, f'.questions-{os.getpid()}.tmp')
+                try:
+                    with open(tmp, 'wb') as f:
+                        _, version = write_snapshot(db, f)
+                    # 以快照事务内读到的版本号命名，期间若有新的改动，下一次检查会再生成一次
+                    path = self.path_for(version)
+                    os.replace(tmp, path)
+                finally:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                self.builds += 1
+                self.last_build_ms = round((time.perf_counter() - start) * 1000, 1)
+            self._remove_old(path)
+        return path
+
+    def _remove_old(self, keep):
+        # 其它进程仍映射着的旧文件在Unix上可以安全删除，Windows上删除失败时留待下次清理
+        for old in glob.glob(self.path_for('*')):
+            if old != keep:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    def _build_in_background(self):
+        from database import get_pool
+        pool = get_pool()
+        db = pool.acquire()
+        try:
+            self.build(db)
+        except Exception as e:
+            self.logger.error(f'题库快照生成失败: {e}')
+            # 同一版本不再重试，题目再次变化时才重新生成
+            with self._lock:
+                self._failed_version = self._version
+        else:
+            with self._lock:
+                # 下一次取题时立即检查新文件
+                self._version = None
+        finally:
+            pool.release(db)
+            with self._lock:
+                self._building = False
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'enabled': self.enabled,
+            'version': snapshot.version if snapshot is not None else None,
+            'questions': snapshot.count if snapshot is not None else 0,
+            'file_bytes': snapshot.size if snapshot is not None else 0,
+            'hits': self.hits,
+            'fallbacks': self.fallbacks,
+            'loads': self.loads,
+            'builds': self.builds,
+            'last_build_ms': self.last_build_ms,
+        }
+
+
+question_store = QuestionStore(question_cache)
+
+
+@questions_cli.command('snapshot')
+def snapshot_command():
+    """立即生成当前版本的题库快照，并删除旧版本"""
+    from database import get_db
+    start = time.perf_counter()
+    path = question_store.build(get_db())
+    snapshot = QuestionSnapshot(path)
+    click.echo(f'题库快照 {path}：{snapshot.count} 道题目，版本 {snapshot.version}，'
+               f'{snapshot.size / 1024 / 1024:.1f} MB，用时 {time.perf_counter() - start:.1f} s')
+
+
+def init_app(app):
+    from database import DATABASE
+    for key, value in QUESTION_SNAPSHOT_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    question_store.configure(
+        os.path.join(app.root_path, BUILD_DIR),
+        DATABASE,
+        enabled=app.config['QUESTION_SNAPSHOT_ENABLED'],
+        auto_build=app.config['QUESTION_SNAPSHOT_AUTO_BUILD'],
+        check_interval=app.config['QUESTION_SNAPSHOT_CHECK_INTERVAL'],
+    )
+    question_store.logger = app.logger
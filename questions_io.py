@@ -0,0 +1,349 @@
+import csv
+import gzip
+import hashlib
+import io
+import json
+import sys
+import time
+from itertools import islice
+
+import click
+from flask.cli import AppGroup
+
+from question_cache import bump_data_version
+
+# 导入导出文件中的字段，导出文件可以直接再导入
+FIELDS = ('question_text', 'option_a', 'option_b', 'option_c', 'option_d', 'correct_answer')
+# 导入时接受的别名
+FIELD_ALIASES = {'question': 'question_text', 'answer': 'correct_answer'}
+ANSWERS = frozenset('ABCD')
+MAX_TEXT_LENGTH = 1000
+MAX_OPTION_LENGTH = 200
+
+INSERT_SQL = """
+    INSERT OR IGNORE INTO questions
+        (content_hash, question_text, option_a, option_b, option_c, option_d, correct_answer)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+class RowError(ValueError):
+    """导入文件中的一行数据不合法"""
+
+
+def normalize(value):
+    return ' '.join(value.split())
+
+
+def content_hash(question_text, option_a, option_b, option_c, option_d):
+    """题干和四个选项的哈希，用于去重；不含答案，修正答案后重新导入不会产生重复题目"""
+    key = '\x1f'.join(map(normalize, (question_text, option_a, option_b, option_c, option_d)))
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+
+
+# ===== 题目版本触发器 =====
+def create_version_triggers(db):
+    """questions表发生任何变化时递增 data_versions 中的版本号，各进程据此清空题目缓存"""
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        db.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS questions_version_{event.lower()}
+            AFTER {event} ON questions
+            BEGIN
+                INSERT INTO data_versions (name, version) VALUES ('questions', 1)
+                ON CONFLICT(name) DO UPDATE SET version = version + 1;
+            END
+        """)
+
+
+def drop_version_triggers(db):
+    """批量写入时在同一事务内临时删除触发器，写完后重建并只递增一次版本号
+
+    DDL同样受事务保护，事务回滚或进程中途退出时触发器不会丢失。
+    """
+    for event in ('insert', 'update', 'delete'):
+        db.execute(f'DROP TRIGGER IF EXISTS questions_version_{event}')
+
+
+def backfill_hashes(db):
+    """为已有题目计算content_hash，重复的题目只保留最早一道的哈希，返回写入的行数"""
+    seen = set()
+    updates = []
+    for row in db.execute('SELECT id, question_text, option_a, option_b, option_c, option_d '
+                          'FROM questions WHERE content_hash IS NULL ORDER BY id'):
+        digest = content_hash(*row[1:])
+        if digest not in seen:
+            seen.add(digest)
+            updates.append((digest, row[0]))
+    drop_version_triggers(db)
+    db.executemany('UPDATE questions SET content_hash = ? WHERE id = ?', updates)
+    create_version_triggers(db)
+    if updates:
+        bump_data_version(db, 'questions')
+    return len(updates)
+
+
+# ===== 读取 =====
+class _StandardStream(io.TextIOWrapper):
+    """包装标准输入/输出的二进制流，关闭时只刷新并分离，不关闭进程的stdin/stdout"""
+
+    _detached = False
+
+    def close(self):
+        if not self._detached:
+            # detach()会先刷新缓冲区
+            self.detach()
+            self._detached = True
+
+    @property
+    def closed(self):
+        return self._detached or super().closed
+
+
+def open_text(path, mode):
+    """'-' 表示标准输入/输出，.gz 结尾的文件按gzip读写"""
+    if path == '-':
+        stream = sys.stdin if mode == 'r' else sys.stdout
+        if mode != 'r':
+            # 先写出sys.stdout中尚未刷新的内容，保持输出顺序
+            stream.flush()
+        return _StandardStream(stream.buffer, encoding='utf-8-sig' if mode == 'r' else 'utf-8',
+                               newline='', write_through=True)
+    # utf-8-sig 兼容Excel另存的带BOM的CSV
+    encoding = 'utf-8-sig' if mode == 'r' else 'utf-8'
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding=encoding, newline='')
+    return open(path, mode, encoding=encoding, newline='')
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    raise click.BadParameter('无法从文件名判断格式，请用 --format 指定 csv 或 jsonl')
+
+
+def read_csv(f):
+    """逐行产出 (行号, 按FIELDS顺序的字段元组)，表头只解析一次"""
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [FIELD_ALIASES.get(name.strip(), name.strip()) for name in header]
+    missing = [field for field in FIELDS if field not in columns]
+    if missing:
+        raise click.ClickException(f'CSV表头缺少字段: {", ".join(missing)}')
+    indexes = [columns.index(field) for field in FIELDS]
+    width = len(columns)
+    # 表头所在为第1行
+    for line_no, record in enumerate(reader, start=2):
+        if len(record) != width:
+            if not record:
+                continue
+            yield line_no, RowError(f'应有{width}列，实际为{len(record)}列')
+        else:
+            yield line_no, tuple(record[index] for index in indexes)
+
+
+def read_jsonl(f):
+    for line_no, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_no, RowError(f'JSON格式错误: {e}')
+            continue
+        if not isinstance(record, dict):
+            yield line_no, RowError('每行必须是一个对象')
+            continue
+        for alias, field in FIELD_ALIASES.items():
+            if alias in record and field not in record:
+                record[field] = record[alias]
+        yield line_no, tuple(record.get(field) for field in FIELDS)
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def parse_row(values):
+    """校验按FIELDS顺序排列的一行，返回可直接插入的元组 (content_hash, 题干, A, B, C, D, 答案)"""
+    if isinstance(values, RowError):
+        raise values
+    row = []
+    for field, value in zip(FIELDS, values):
+        if not isinstance(value, str) or not (value := value.strip()):
+            raise RowError(f'缺少 {field}')
+        row.append(value)
+    question_text, option_a, option_b, option_c, option_d, answer = row
+    if len(question_text) > MAX_TEXT_LENGTH:
+        raise RowError(f'题干超过{MAX_TEXT_LENGTH}个字符')
+    if max(len(option_a), len(option_b), len(option_c), len(option_d)) > MAX_OPTION_LENGTH:
+        raise RowError(f'选项超过{MAX_OPTION_LENGTH}个字符')
+    answer = answer.upper()
+    if answer not in ANSWERS:
+        raise RowError(f'答案必须是A、B、C、D之一，实际为 {answer!r}')
+    return (content_hash(question_text, option_a, option_b, option_c, option_d),
+            question_text, option_a, option_b, option_c, option_d, answer)
+
+
+class ImportReport:
+    """导入过程的计数，errors只保留前max_errors条"""
+
+    def __init__(self, max_errors=20):
+        self.max_errors = max_errors
+        self.read = 0
+        self.invalid = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.errors = []
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+
+    def error(self, line_no, message):
+        self.invalid += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line_no, message))
+
+    @property
+    def rows_per_s(self):
+        return self.read / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        return (f'读取 {self.read} 行，导入 {self.inserted} 道，重复 {self.duplicates} 道，'
+                f'无效 {self.invalid} 行，用时 {self.seconds:.1f} s（{self.rows_per_s:,.0f} 行/秒）')
+
+
+def valid_rows(records, report):
+    for line_no, record in records:
+        report.read += 1
+        try:
+            yield parse_row(record)
+        except RowError as e:
+            report.error(line_no, str(e))
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+# ===== 导入导出 =====
+def import_rows(db, records, batch_size=5000, commit_every=100000, report=None, progress=None):
+    """把 (行号, 记录) 流式写入questions表
+
+    每批用一次executemany写入，每commit_every行提交一个事务；已存在相同内容哈希的题目
+    由唯一索引忽略。每个事务内临时去掉逐行触发的版本号触发器，提交前递增一次版本号。
+    """
+    report = report or ImportReport()
+    pending = 0
+
+    def begin():
+        db.execute('BEGIN IMMEDIATE')
+        drop_version_triggers(db)
+
+    def commit():
+        create_version_triggers(db)
+        bump_data_version(db, 'questions')
+        db.commit()
+        report.seconds = time.perf_counter() - report.start
+
+    if db.in_transaction:
+        db.commit()
+    begin()
+    try:
+        for batch in batches(valid_rows(records, report), batch_size):
+            inserted = db.executemany(INSERT_SQL, batch).rowcount
+            report.inserted += inserted
+            report.duplicates += len(batch) - inserted
+            pending += len(batch)
+            if pending >= commit_every:
+                commit()
+                if progress:
+                    progress(report)
+                begin()
+                pending = 0
+        commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return report
+
+
+def import_file(db, path, fmt=None, **kwargs):
+    fmt = detect_format(path, fmt)
+    with open_text(path, 'r') as f:
+        return import_rows(db, READERS[fmt](f), **kwargs)
+
+
+def export_rows(db, f, fmt):
+    """按id顺序逐行写出全部题目，返回导出的行数"""
+    cursor = db.execute(f'SELECT {", ".join(FIELDS)} FROM questions ORDER BY id')
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        while True:
+            rows = cursor.fetchmany(5000)
+            if not rows:
+                break
+            writer.writerows(tuple(row) for row in rows)
+            count += len(rows)
+    else:
+        for row in cursor:
+            f.write(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False))
+            f.write('\n')
+            count += 1
+    return count
+
+
+questions_cli = AppGroup('questions', help='题库导入导出')
+
+
+@questions_cli.command('import')
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(('csv', 'jsonl')), default=None,
+              help='文件格式，默认按扩展名判断（支持.gz）')
+@click.option('--batch-size', type=int, default=5000, show_default=True, help='每次executemany的行数')
+@click.option('--commit-every', type=int, default=100000, show_default=True, help='每个事务写入的行数')
+def import_command(path, fmt, batch_size, commit_every):
+    """从CSV或JSONL文件导入题目，PATH为 - 时读取标准输入
+
+    CSV需要表头 question_text,option_a,option_b,option_c,option_d,correct_answer；
+    JSONL每行一个含相同字段的对象。题干和选项相同的题目只导入一次。
+    """
+    from database import get_db
+    report = import_file(get_db(), path, fmt, batch_size=batch_size, commit_every=commit_every,
+                         progress=lambda r: click.echo(r.summary(), err=True))
+    for line_no, message in report.errors:
+        click.echo(f'  第{line_no}行: {message}', err=True)
+    if report.invalid > len(report.errors):
+        click.echo(f'  另有 {report.invalid - len(report.errors)} 行无效', err=True)
+    click.echo(report.summary())
+
+
+@questions_cli.command('export')
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(('csv', 'jsonl')), default=None,
+              help='文件格式，默认按扩展名判断（支持.gz）')
+def export_command(path, fmt):
+    """把全部题目导出为CSV或JSONL文件，PATH为 - 时写到标准输出"""
+    from database import get_db
+    if path == '-' and fmt is None:
+        fmt = 'jsonl'
+    fmt = detect_format(path, fmt)
+    start = time.perf_counter()
+    with open_text(path, 'w') as f:
+        count = export_rows(get_db(), f, fmt)
+    click.echo(f'已导出 {count} 道题目，用时 {time.perf_counter() - start:.1f} s', err=True)
+
+
+def init_app(app):
+    app.cli.add_command(questions_cli)
@@ -0,0 +1,154 @@
+import glob
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, make_response, render_template, request
+from jinja2 import meta
+
+# 默认配置，可在app.config中覆盖
+RENDER_CACHE_DEFAULTS = {
+    'RENDER_CACHE_ENABLED': True,
+    'RENDER_CACHE_CHECK_INTERVAL': 1.0,
+    'RENDER_CACHE_MAX_ENTRIES': 256,
+}
+
+# 小于该长度的页面不值得压缩
+MIN_GZIP_SIZE = 1024
+
+
+class RenderedPage:
+    __slots__ = ('signature', 'body', 'gzip_body', 'etag')
+
+    def __init__(self, signature, body):
+        self.signature = signature
+        self.body = body
+        self.gzip_body = gzip.compress(body, compresslevel=6, mtime=0) if len(body) >= MIN_GZIP_SIZE else None
+        self.etag = hashlib.sha1(body).hexdigest()[:20]
+
+
+class RenderCache:
+    """只依赖模板本身的页面缓存渲染结果
+
+    以 (模板名, 模板参数, 脚本根路径) 为键保存渲染好的页面及其gzip版本；
+    模板及其继承/包含的模板文件修改时间作为签名，最多每 check_interval 秒检查一次，文件变化后自动重新渲染。
+    """
+
+    def __init__(self, enabled=True, check_interval=1.0, max_entries=256):
+        self.enabled = enabled
+        self.check_interval = check_interval
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._pages = OrderedDict()
+        self._dependencies = {}
+        self._signatures = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _template_files(self, env, name):
+        """模板及其通过extends/include/import引用的全部模板文件"""
+        files = self._dependencies.get(name)
+        if files is None:
+            files, pending, seen = [], [name], set()
+            while pending:
+                current = pending.pop()
+                if current in seen:
+                    continue
+                seen.add(current)
+                source, filename, _ = env.loader.get_source(env, current)
+                files.append(filename)
+                pending.extend(ref for ref in meta.find_referenced_templates(env.parse(source)) if ref)
+            self._dependencies[name] = files
+        return files
+
+    def _stat_files(self, env, name):
+        try:
+            return tuple(os.stat(path).st_mtime_ns for path in self._template_files(env, name))
+        except OSError:
+            return None
+
+    def _signature(self, env, name):
+        now = time.monotonic()
+        cached = self._signatures.get(name)
+        if cached is not None and now - cached[0] < self.check_interval:
+            return cached[1]
+        signature = self._stat_files(env, name)
+        if cached is not None and cached[1] != signature:
+            # 模板内容变了，引用关系也可能变了
+            self._dependencies.pop(name, None)
+            signature = self._stat_files(env, name)
+        self._signatures[name] = (now, signature)
+        return signature
+
+    def render(self, template_name, **context):
+        """返回渲染好的响应，支持gzip和ETag/304"""
+        if not self.enabled:
+            return render_template(template_name, **context)
+
+        signature = self._signature(current_app.jinja_env, template_name)
+        key = (template_name, tuple(sorted(context.items())), request.script_root)
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None and page.signature == signature:
+                self._pages.move_to_end(key)
+                self.hits += 1
+            else:
+                page = None
+                self.misses += 1
+        if page is None:
+            page = RenderedPage(signature, render_template(template_name, **context).encode('utf-8'))
+            with self._lock:
+                self._pages[key] = page
+                self._pages.move_to_end(key)
+                while len(self._pages) > self.max_entries:
+                    self._pages.popitem(last=False)
+
+        if page.gzip_body is not None and request.accept_encodings['gzip']:
+            response = make_response(page.gzip_body)
+            response.headers['Content-Encoding'] = 'gzip'
+            response.set_etag(page.etag + '-gz')
+        else:
+            response = make_response(page.body)
+            response.set_etag(page.etag)
+        response.headers['Content-Type'] = 'text/html; charset=utf-8'
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._dependencies.clear()
+            self._signatures.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._pages),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'bytes': sum(len(page.body) + len(page.gzip_body or b'') for page in self._pages.values()),
+            }
+
+
+render_cache = RenderCache()
+
+
+def city_names(root_path):
+    """templates/cities/下已有页面的城市名"""
+    pattern = os.path.join(root_path, 'templates', 'cities', '*.html')
+    return frozenset(os.path.splitext(os.path.basename(path))[0] for path in glob.glob(pattern))
+
+
+def init_app(app):
+    for key, value in RENDER_CACHE_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    render_cache.enabled = app.config['RENDER_CACHE_ENABLED']
+    render_cache.check_interval = app.config['RENDER_CACHE_CHECK_INTERVAL']
+    render_cache.max_entries = app.config['RENDER_CACHE_MAX_ENTRIES']
@@ -0,0 +1,368 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from functools import wraps
+
+from flask import jsonify, make_response, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import avatar_store
+from user_context import load_user
+
+# 默认配置，可在app.config中覆盖
+REQUEST_LIMIT_DEFAULTS = {
+    'RATE_LIMIT_ENABLED': True,
+    # sqlite：各worker进程共享同一个计数文件；memory：只在本进程内计数，适合单进程开发
+    'RATE_LIMIT_BACKEND': 'sqlite',
+    # 计数文件路径，为None时使用 build/ratelimit.db
+    'RATE_LIMIT_DATABASE': None,
+    # 每个接口按用户、按IP的令牌桶，'10/minute' 表示最多连续10次，之后每6秒恢复1次
+    'RATE_LIMITS': {
+        'chat': {'user': '10/minute', 'ip': '30/minute'},
+        'upload_avatar': {'user': '5/minute', 'ip': '20/minute'},
+        'register': {'ip': '10/hour'},
+        'submit_answer': {'user': '60/minute', 'ip': '600/minute'},
+    },
+    # 每个用户同时进行的请求数上限（跨worker），超过租约时间仍未释放的占用视为已失效
+    'CONCURRENCY_LIMITS': {
+        'chat': 2,
+    },
+    'CONCURRENCY_LEASE_SECONDS': 300,
+}
+
+# 请求体大小上限，超过时在读取请求体之前返回413；头像本身的上限见 avatar_store.MAX_UPLOAD_BYTES
+DEFAULT_MAX_CONTENT_LENGTH = avatar_store.MAX_UPLOAD_BYTES + 64 * 1024
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+_RULE = re.compile(r'^\s*(\d+)\s*/\s*(second|minute|hour|day)\s*$')
+
+
+def parse_rule(rule):
+    """'10/minute' -> (容量10, 每秒恢复10/60个令牌)"""
+    match = _RULE.match(rule)
+    if not match:
+        raise ValueError(f'无法解析的限流规则: {rule!r}')
+    count = int(match.group(1))
+    return count, count / PERIODS[match.group(2)]
+
+
+def client_ip():
+    # 部署在反向代理之后时需要用ProxyFix等中间件修正remote_addr，否则所有请求都来自代理的IP
+    return request.remote_addr or ''
+
+
+class MemoryBackend:
+    """进程内的令牌桶和并发租约，多worker部署时每个进程各自计数"""
+
+    name = 'memory'
+
+    def __init__(self, prune_every=10000):
+        self.prune_every = prune_every
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self._leases = {}
+        self._operations = 0
+
+    def take(self, key, capacity, rate, now):
+        """取一个令牌，成功返回0，否则返回需要等待的秒数"""
+        with self._lock:
+            self._operations += 1
+            if self._operations % self.prune_every == 0:
+                # 已经恢复满的桶与不存在等价，定期清理避免按IP计数时无限增长
+                self._buckets = {k: v for k, v in self._buckets.items() if v[0] + (now - v[1]) * v[2] < v[3]}
+            tokens, updated, _, _ = self._buckets.get(key, (capacity, now, rate, capacity))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens < 1:
+                return (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1, now, rate, capacity)
+            return 0
+
+    def acquire(self, key, limit, ttl, now):
+        with self._lock:
+            leases = {k: v for k, v in self._leases.get(key, {}).items() if v > now}
+            if len(leases) >= limit:
+                self._leases[key] = leases
+                return None
+            lease_id = uuid.uuid4().hex
+            leases[lease_id] = now + ttl
+            self._leases[key] = leases
+            return lease_id
+
+    def release(self, key, lease_id):
+        with self._lock:
+            leases = self._leases.get(key)
+            if leases is not None:
+                leases.pop(lease_id, None)
+                if not leases:
+                    del self._leases[key]
+
+
+class SqliteBackend:
+    """计数存放在单独的SQLite文件中，同一台机器上的各worker进程共享
+
+    计数只是临时状态，使用 synchronous=OFF，不与业务数据库争用写锁；每个线程一个连接，fork后重新连接。
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path, busy_timeout=1000, prune_every=1000, prune_after=86400):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.prune_every = prune_every
+        self.prune_after = prune_after
+        self._local = threading.local()
+        self._operations = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        db = self._connection()
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS rate_buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS concurrency_leases (
+                key TEXT NOT NULL,
+                lease_id TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (key, lease_id)
+            ) WITHOUT ROWID
+        """)
+
+    def _connection(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout / 1000.0, isolation_level=None,
+                                 check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=OFF')
+            local.db = db
+            local.pid = os.getpid()
+        return local.db
+
+    def take(self, key, capacity, rate, now):
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute('SELECT tokens, updated_at FROM rate_buckets WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+            if tokens < 1:
+                db.execute('COMMIT')
+                return (1 - tokens) / rate
+            db.execute('INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                       (key, tokens - 1, now))
+            self._operations += 1
+            if self._operations % self.prune_every == 0:
+                db.execute('DELETE FROM rate_buckets WHERE updated_at < ?', (now - self.prune_after,))
+            db.execute('COMMIT')
+            return 0
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def acquire(self, key, limit, ttl, now):
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('DELETE FROM concurrency_leases WHERE key = ? AND expires_at <= ?', (key, now))
+            active = db.execute('SELECT COUNT(*) FROM concurrency_leases WHERE key = ?', (key,)).fetchone()[0]
+            lease_id = None
+            if active < limit:
+                lease_id = uuid.uuid4().hex
+                db.execute('INSERT INTO concurrency_leases (key, lease_id, expires_at) VALUES (?, ?, ?)',
+                           (key, lease_id, now + ttl))
+            db.execute('COMMIT')
+            return lease_id
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def release(self, key, lease_id):
+        self._connection().execute('DELETE FROM concurrency_leases WHERE key = ? AND lease_id = ?', (key, lease_id))
+
+
+class Lease:
+    __slots__ = ('key', 'lease_id')
+
+    def __init__(self, key, lease_id):
+        self.key = key
+        self.lease_id = lease_id
+
+
+# 没有配置并发上限时返回的占位租约
+NO_LEASE = Lease(None, None)
+
+
+class RateLimiter:
+    """按用户和IP的令牌桶限流，以及按用户的并发数限制
+
+    计数存储出错（如计数文件被锁住超时）时放行请求并计入errors，限流不应导致接口不可用。
+    """
+
+    def __init__(self, backend=None, rules=None, concurrency=None, lease_seconds=300, enabled=True):
+        self.backend = backend or MemoryBackend()
+        self.enabled = enabled
+        self.lease_seconds = lease_seconds
+        self.rules = {}
+        self.concurrency = dict(concurrency or {})
+        self.set_rules(rules or {})
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = {}
+        self.errors = 0
+
+    def set_rules(self, rules):
+        self.rules = {
+            name: [(scope, *parse_rule(rule)) for scope, rule in scopes.items()]
+            for name, scopes in rules.items()
+        }
+
+    def _count_limited(self, name):
+        with self._lock:
+            self.limited[name] = self.limited.get(name, 0) + 1
+
+    def check(self, name, user_id=None, ip=None):
+        """按name的规则各取一个令牌，全部成功返回0，否则返回建议的重试等待秒数"""
+        rules = self.rules.get(name)
+        if not self.enabled or not rules:
+            return 0
+        keys = {'user': user_id, 'ip': ip}
+        now = time.time()
+        for scope, capacity, rate in rules:
+            value = keys.get(scope)
+            if value is None or value == '':
+                continue
+            try:
+                wait = self.backend.take(f'{name}:{scope}:{value}', capacity, rate, now)
+            except sqlite3.Error:
+                self.errors += 1
+                continue
+            if wait:
+                self._count_limited(name)
+                return wait
+        self.allowed += 1
+        return 0
+
+    def acquire(self, name, user_id):
+        """占用一个并发名额，返回Lease；名额已满时返回None"""
+        limit = self.concurrency.get(name)
+        if not self.enabled or not limit or user_id is None:
+            return NO_LEASE
+        key = f'{name}:user:{user_id}'
+        try:
+            lease_id = self.backend.acquire(key, limit, self.lease_seconds, time.time())
+        except sqlite3.Error:
+            self.errors += 1
+            return NO_LEASE
+        if lease_id is None:
+            self._count_limited(f'{name}_concurrency')
+            return None
+        return Lease(key, lease_id)
+
+    def release(self, lease):
+        if lease is None or lease.key is None:
+            return
+        try:
+            self.backend.release(lease.key, lease.lease_id)
+        except sqlite3.Error:
+            # 释放失败时等租约过期
+            self.errors += 1
+
+    def stats(self):
+        with self._lock:
+            limited = dict(self.limited)
+        return {
+            'enabled': self.enabled,
+            'backend': self.backend.name,
+            'allowed': self.allowed,
+            'limited': sum(limited.values()),
+            'errors': self.errors,
+            **{f'limited_{name}': count for name, count in limited.items()},
+        }
+
+
+limiter = RateLimiter()
+
+TOO_MANY_REQUESTS = '请求过于频繁，请稍后再试'
+TOO_MANY_CONCURRENT = '您有其它提问正在进行，请稍后再试'
+
+
+def _too_many(message, retry_after, as_text):
+    response = make_response(message if as_text else jsonify({'error': message}), 429)
+    if retry_after:
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def rate_limited(name, methods=None, as_text=False):
+    """按 RATE_LIMITS[name] 限流，超过时返回429和Retry-After
+
+    放在 @login_required 之后，未登录的请求不消耗令牌；methods指定时只对这些请求方法计数，
+    as_text为True时返回纯文本错误（表单页面）。
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if methods is not None and request.method not in methods:
+                return view(*args, **kwargs)
+            user = load_user()
+            wait = limiter.check(name, user.id if user else None, client_ip())
+            if wait:
+                return _too_many(TOO_MANY_REQUESTS, wait, as_text)
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def concurrency_limited(name):
+    """限制每个用户同时进行的请求数，流式响应在响应关闭时才释放名额"""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            user = load_user()
+            lease = limiter.acquire(name, user.id if user else None)
+            if lease is None:
+                return _too_many(TOO_MANY_CONCURRENT, None, False)
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                limiter.release(lease)
+                raise
+            if response.is_streamed:
+                response.call_on_close(lambda: limiter.release(lease))
+            else:
+                limiter.release(lease)
+            return response
+        return wrapped
+    return decorator
+
+
+def request_too_large(error):
+    limit = request.max_content_length
+    message = f'上传内容过大，不能超过{limit // (1024 * 1024)}MB' if limit else '上传内容过大'
+    if request.path.startswith('/api/') or request.is_json:
+        return jsonify({'error': message}), 413
+    return message, 413
+
+
+def init_app(app):
+    for key, value in REQUEST_LIMIT_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    # Flask自带MAX_CONTENT_LENGTH配置项，默认为None（不限制）
+    if app.config.get('MAX_CONTENT_LENGTH') is None:
+        app.config['MAX_CONTENT_LENGTH'] = DEFAULT_MAX_CONTENT_LENGTH
+    if app.config['RATE_LIMIT_BACKEND'] == 'sqlite':
+        path = app.config['RATE_LIMIT_DATABASE'] or os.path.join(app.root_path, 'build', 'ratelimit.db')
+        limiter.backend = SqliteBackend(path)
+    else:
+        limiter.backend = MemoryBackend()
+    limiter.enabled = app.config['RATE_LIMIT_ENABLED']
+    limiter.set_rules(app.config['RATE_LIMITS'])
+    limiter.concurrency = dict(app.config['CONCURRENCY_LIMITS'])
+    limiter.lease_seconds = app.config['CONCURRENCY_LEASE_SECONDS']
+    app.register_error_handler(RequestEntityTooLarge, request_too_large)
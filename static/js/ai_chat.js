@@ -66,29 +66,33 @@ function initChatForm() {
             // 显示加载状态
             showLoading();
             
-            // 发送到后端API
+            // 发送到后端API，以流式方式接收回答
             const response = await fetch('/api/chat', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream'
                 },
-                body: JSON.stringify({ question: message })
+                body: JSON.stringify({ question: message, stream: true })
             });
             
-            if (!response.ok) {
-                throw new Error('网络响应不正常');
-            }
-            
-            const data = await response.json();
-            
-            // 隐藏加载状态
-            hideLoading();
-            
-            // 添加AI回复
-            if (data.answer) {
-                addAIMessage(data.answer);
+            const contentType = response.headers.get('Content-Type') || '';
+            if (response.ok && contentType.includes('text/event-stream') && response.body) {
+                await readStreamingAnswer(response);
             } else {
-                addAIMessage('抱歉，我暂时无法回答这个问题。请尝试其他问题。');
+                const data = await response.json();
+                
+                // 隐藏加载状态
+                hideLoading();
+                
+                // 添加AI回复
+                if (data.answer) {
+                    addAIMessage(data.answer);
+                } else if (data.error) {
+                    addAIMessage(data.error);
+                } else {
+                    addAIMessage('抱歉，我暂时无法回答这个问题。请尝试其他问题。');
+                }
             }
             
         } catch (error) {
@@ -152,6 +156,81 @@ function addMessage(message, type) {
     scrollToBottom();
 }
 
+// 读取服务端推送的回答片段，边接收边显示
+async function readStreamingAnswer(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+    let answer = '';
+    let messageDiv = null;
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        // 每个事件以空行结尾
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        
+        for (const event of events) {
+            if (!event.startsWith('data: ')) continue;
+            const data = JSON.parse(event.slice(6));
+            
+            if (data.delta) {
+                if (!messageDiv) {
+                    hideLoading();
+                    messageDiv = createStreamingMessage();
+                }
+                answer += data.delta;
+                messageDiv.querySelector('.streaming-content').textContent = answer;
+                scrollToBottom();
+            } else if (data.error) {
+                answer += `\n（${data.error}）`;
+            }
+        }
+    }
+    
+    hideLoading();
+    if (!messageDiv) {
+        addAIMessage(answer || '抱歉，我暂时无法回答这个问题。请尝试其他问题。');
+        return;
+    }
+    messageDiv.querySelector('.streaming-content').textContent = answer;
+    
+    // 回答完成后显示复制按钮
+    const copyBtn = messageDiv.querySelector('.copy-btn');
+    copyBtn.style.display = 'block';
+    copyBtn.addEventListener('click', function() {
+        copyToClipboard(answer);
+        showCopySuccess(this);
+    });
+}
+
+// 创建用于流式显示的AI消息
+function createStreamingMessage() {
+    const chatMessages = document.getElementById('chat-messages');
+    const messageDiv = document.createElement('div');
+    
+    messageDiv.className = 'message ai-message';
+    messageDiv.innerHTML = `
+        <div class="message-avatar">
+            <i class="fas fa-robot"></i>
+        </div>
+        <div class="message-content">
+            <div class="streaming-content" style="white-space: pre-wrap;"></div>
+            <button class="copy-btn" title="复制回复" style="display: none;">
+                <i class="fas fa-copy"></i>
+            </button>
+            <div class="message-time">${getCurrentTime()}</div>
+        </div>
+    `;
+    
+    chatMessages.appendChild(messageDiv);
+    scrollToBottom();
+    return messageDiv;
+}
+
 // 添加AI消息（带打字机效果）
 function addAIMessage(message) {
     const chatMessages = document.getElementById('chat-messages');
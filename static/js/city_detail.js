@@ -237,56 +237,43 @@ function initMarkExploredButton() {
                 cityName = '闽派新语 - 福州'; // 默认值，使用新格式
             }
             
-            // 首先检查是否已经探索过
-            fetch('/api/check-explored?city_name=' + encodeURIComponent(cityName))
-                .then(response => response.json())
-                .then(checkData => {
-                    if (checkData.explored) {
-                        // 已经探索过，直接更新UI
+            // 一次请求完成检查和标记：added为空说明之前已经探索过
+            fetch('/api/explorations', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({ since: 0, cities: [cityName] })
+            })
+                .then(response => response.json().then(data => ({ ok: response.ok, data: data })))
+                .then(({ ok, data }) => {
+                    if (!ok) {
+                        alert('标记失败：' + (data.error || '未知错误'));
+                        return;
+                    }
+                    
+                    // 禁用按钮，防止重复点击
+                    markButton.disabled = true;
+                    markButton.innerHTML = '<i class="fas fa-check"></i> 已探索';
+                    markButton.classList.add('btn-success');
+                    markButton.classList.remove('btn-primary');
+                    
+                    if (data.added.length === 0) {
                         alert('该城市已经探索过了！');
-                        markButton.disabled = true;
-                        markButton.innerHTML = '<i class="fas fa-check"></i> 已探索';
-                        markButton.classList.add('btn-success');
-                        markButton.classList.remove('btn-primary');
                         return;
                     }
                     
-                    // 使用AJAX提交标记探索请求
-                    fetch('/api/mark-explored', {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                        },
-                        body: JSON.stringify({ city_name: cityName })
-                    })
-                    .then(response => response.json())
-                    .then(data => {
-                        if (data.success) {
-                            // 显示成功消息
-                            alert('标记为已探索成功！');
-                            
-                            // 禁用按钮，防止重复点击
-                            markButton.disabled = true;
-                            markButton.innerHTML = '<i class="fas fa-check"></i> 已探索';
-                            markButton.classList.add('btn-success');
-                            markButton.classList.remove('btn-primary');
-                            
-                            // 尝试调用主页面的reloadExploredCities函数来更新地图
-                            if (window.parent && window.parent.reloadExploredCities) {
-                                window.parent.reloadExploredCities();
-                            }
-                        } else {
-                            alert('标记失败：' + (data.error || '未知错误'));
-                        }
-                    })
-                    .catch(error => {
-                        console.error('标记探索失败:', error);
-                        alert('标记失败，请检查网络连接');
-                    });
+                    // 显示成功消息
+                    alert('标记为已探索成功！');
+                    
+                    // 尝试调用主页面的reloadExploredCities函数来更新地图
+                    if (window.parent && window.parent.reloadExploredCities) {
+                        window.parent.reloadExploredCities();
+                    }
                 })
                 .catch(error => {
-                    console.error('检查探索状态失败:', error);
-                    alert('检查探索状态失败，请刷新页面重试');
+                    console.error('标记探索失败:', error);
+                    alert('标记失败，请检查网络连接');
                 });
         });
     }
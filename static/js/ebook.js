@@ -7,6 +7,9 @@ let pageNumPending = null;
 let scale = 1.2;
 let canvas = null;
 let ctx = null;
+let pdfSource = null;
+// 服务端预渲染的页面图片索引，可用时优先直接显示图片，不在浏览器中渲染PDF
+let pageImages = null;
 
 // PDF.js worker
 pdfjsLib.GlobalWorkerOptions.workerSrc = 'https://cdnjs.cloudflare.com/ajax/libs/pdf.js/3.4.120/pdf.worker.min.js';
@@ -20,15 +23,43 @@ document.addEventListener('DOMContentLoaded', function() {
 function initPDFViewer(pdfUrl) {
     canvas = document.getElementById('pdf-canvas');
     ctx = canvas.getContext('2d');
+    pdfSource = pdfUrl;
     
     // 显示加载状态
     showLoading();
     
-    // 加载PDF文档
-    pdfjsLib.getDocument(pdfUrl).promise.then(function(pdf) {
+    // 优先使用预渲染的页面图片，没有时再加载PDF
+    fetch(pdfUrl + '.pages.json').then(function(response) {
+        if (!response.ok) throw new Error(response.status);
+        return response.json();
+    }).then(function(index) {
+        pageImages = index;
+        document.getElementById('page-count').textContent = index.page_count;
+        hideLoading();
+        renderPage(pageNum);
+        initThumbnails();
+    }).catch(function() {
+        loadPDFDocument(pdfUrl);
+    });
+}
+
+// 加载PDF文档
+function loadPDFDocument(pdfUrl, onLoaded) {
+    // 按需用Range请求分块获取，不在后台下载整个文件
+    pdfjsLib.getDocument({
+        url: pdfUrl,
+        disableAutoFetch: true,
+        disableStream: true,
+        rangeChunkSize: 65536
+    }).promise.then(function(pdf) {
         pdfDoc = pdf;
         document.getElementById('page-count').textContent = pdf.numPages;
         
+        if (onLoaded) {
+            onLoaded();
+            return;
+        }
+        
         // 隐藏加载状态
         hideLoading();
         
@@ -45,6 +76,12 @@ function initPDFViewer(pdfUrl) {
     });
 }
 
+// 总页数
+function getPageCount() {
+    if (pageImages) return pageImages.page_count;
+    return pdfDoc ? pdfDoc.numPages : 0;
+}
+
 // 初始化控制按钮
 function initPDFControls() {
     // 上一页按钮
@@ -56,7 +93,7 @@ function initPDFControls() {
     
     // 下一页按钮
     document.getElementById('next-page').addEventListener('click', function() {
-        if (pageNum >= pdfDoc.numPages) return;
+        if (pageNum >= getPageCount()) return;
         pageNum++;
         queueRenderPage(pageNum);
     });
@@ -105,6 +142,11 @@ function renderPage(num) {
     // 显示加载状态
     showPageLoading();
     
+    if (pageImages) {
+        renderPageImage(num);
+        return;
+    }
+    
     // 获取页面
     pdfDoc.getPage(num).then(function(page) {
         const viewport = page.getViewport({ scale: scale });
@@ -122,29 +164,7 @@ function renderPage(num) {
         const renderTask = page.render(renderContext);
         
         renderTask.promise.then(function() {
-            pageRendering = false;
-            
-            // 隐藏加载状态
-            hidePageLoading();
-            
-            // 更新页面信息
-            updatePageInfo();
-            
-            // 更新进度条
-            updateProgressBar();
-            
-            // 更新缩略图
-            updateThumbnails();
-            
-            // 如果有等待的页面，渲染它
-            if (pageNumPending !== null) {
-                renderPage(pageNumPending);
-                pageNumPending = null;
-            }
-            
-            // 添加翻页动画
-            addPageTurnAnimation();
-            
+            finishRender(num);
         }).catch(function(error) {
             console.error('渲染页面失败:', error);
             pageRendering = false;
@@ -158,6 +178,81 @@ function renderPage(num) {
     });
 }
 
+// 渲染完成后的公共处理
+function finishRender(num) {
+    pageRendering = false;
+    
+    // 隐藏加载状态
+    hidePageLoading();
+    
+    // 更新页面信息
+    updatePageInfo();
+    
+    // 更新进度条
+    updateProgressBar();
+    
+    // 更新缩略图
+    updateThumbnails();
+    
+    // 如果有等待的页面，渲染它
+    if (pageNumPending !== null) {
+        renderPage(pageNumPending);
+        pageNumPending = null;
+    }
+    
+    // 添加翻页动画
+    addPageTurnAnimation();
+    
+    // 预取相邻页面的数据，翻页时无需再等待网络
+    prefetchAdjacentPages(num);
+}
+
+// 选择不小于显示尺寸的最小图片宽度
+function pageImageUrl(num) {
+    const page = pageImages.pages[num - 1];
+    const needed = page.width * scale * (window.devicePixelRatio || 1);
+    const widths = pageImages.widths.slice().sort(function(a, b) { return a - b; });
+    const width = widths.find(function(w) { return w >= needed; }) || widths[widths.length - 1];
+    return `/ebook/pages/${page.hash}/${width}.${pageImages.format}`;
+}
+
+// 用预渲染图片显示页面，图片加载失败时退回pdf.js渲染
+function renderPageImage(num) {
+    const page = pageImages.pages[num - 1];
+    const image = new Image();
+    image.onload = function() {
+        canvas.width = image.naturalWidth;
+        canvas.height = image.naturalHeight;
+        canvas.style.width = `${page.width * scale}px`;
+        canvas.style.height = `${page.height * scale}px`;
+        ctx.drawImage(image, 0, 0);
+        finishRender(num);
+    };
+    image.onerror = function() {
+        pageImages = null;
+        canvas.style.width = '';
+        canvas.style.height = '';
+        loadPDFDocument(pdfSource, function() {
+            renderPage(num);
+        });
+    };
+    image.src = pageImageUrl(num);
+}
+
+// 预取前后页（只获取页面对象，所需数据块会被PDF.js缓存）
+function prefetchAdjacentPages(num) {
+    [num + 1, num - 1].forEach(function(n) {
+        if (n < 1 || n > getPageCount()) return;
+        if (pageImages) {
+            new Image().src = pageImageUrl(n);
+        } else {
+            pdfDoc.getPage(n).then(function(page) {
+                return page.getOperatorList();
+            }).catch(function() {});
+        }
+    });
+}
+
 // 队列渲染页面（如果正在渲染，则等待）
 function queueRenderPage(num) {
     if (pageRendering) {
@@ -175,7 +270,7 @@ function updatePageInfo() {
 
 // 更新进度条
 function updateProgressBar() {
-    const progress = (pageNum / pdfDoc.numPages) * 100;
+    const progress = (pageNum / getPageCount()) * 100;
     const progressFill = document.getElementById('progress-fill');
     const progressText = document.getElementById('progress-text');
     
@@ -223,7 +318,7 @@ function handleKeyboardNavigation(e) {
     // 右箭头：下一页
     if (e.key === 'ArrowRight' || e.key === 'PageDown' || e.key === ' ') {
         e.preventDefault();
-        if (pageNum < pdfDoc.numPages) {
+        if (pageNum < getPageCount()) {
             pageNum++;
             queueRenderPage(pageNum);
         }
@@ -239,7 +334,7 @@ function handleKeyboardNavigation(e) {
     // End键：最后一页
     if (e.key === 'End') {
         e.preventDefault();
-        pageNum = pdfDoc.numPages;
+        pageNum = getPageCount();
         queueRenderPage(pageNum);
     }
     
@@ -296,7 +391,7 @@ function initTouchSwipe() {
                 }
             } else {
                 // 向左滑动：下一页
-                if (pageNum < pdfDoc.numPages) {
+                if (pageNum < getPageCount()) {
                     pageNum++;
                     queueRenderPage(pageNum);
                 }
@@ -356,7 +451,7 @@ function updateThumbnails() {
 
 // 跳转到指定页面
 function goToPage(pageNumber) {
-    if (pageNumber >= 1 && pageNumber <= pdfDoc.numPages) {
+    if (pageNumber >= 1 && pageNumber <= getPageCount()) {
         pageNum = pageNumber;
         queueRenderPage(pageNum);
     }
@@ -417,14 +512,14 @@ function goToBookmark() {
 
 // 页面可见性变化时重新渲染
 document.addEventListener('visibilitychange', function() {
-    if (!document.hidden && pdfDoc) {
+    if (!document.hidden && (pdfDoc || pageImages)) {
         queueRenderPage(pageNum);
     }
 });
 
 // 窗口大小变化时重新调整
 window.addEventListener('resize', function() {
-    if (pdfDoc) {
+    if (pdfDoc || pageImages) {
         queueRenderPage(pageNum);
     }
 });
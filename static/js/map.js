@@ -43,8 +43,8 @@ function initMap() {
         maxZoom: 20
     }).addTo(fujianMap);
     
-    // 加载福建地图GeoJSON数据
-    fetch('/static/fujian.json')
+    // 加载福建地图GeoJSON数据（服务端预先简化并压缩的中等精度版本）
+    fetch('/fujian.json?detail=medium')
         .then(response => {
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
@@ -279,6 +279,68 @@ const reverseCityNameMap = {
     '莆田市': '闽派新语 - 莆田'
 };
 
+// 本地保存的探索记录 {version, cities, pending}，按用户名区分；
+// 离线时标记的城市先放在pending中，下次同步时与服务端的增量一起在一个请求中完成
+let explorationUser = null;
+
+function explorationStorageKey() {
+    return 'explorationSync:' + explorationUser;
+}
+
+function loadExplorationState() {
+    try {
+        const state = JSON.parse(localStorage.getItem(explorationStorageKey()));
+        if (state && Array.isArray(state.cities) && Array.isArray(state.pending)) {
+            return state;
+        }
+    } catch (e) {
+        // 本地数据损坏时重新全量同步
+    }
+    return { version: 0, cities: [], pending: [] };
+}
+
+function saveExplorationState(state) {
+    try {
+        localStorage.setItem(explorationStorageKey(), JSON.stringify(state));
+    } catch (e) {
+        // 存储不可用时只影响离线缓存
+    }
+}
+
+// 与服务端同步探索记录：上传待同步的城市，并获取上次同步之后的新增记录
+function syncExplorations() {
+    const state = loadExplorationState();
+    const pending = state.pending.slice();
+    return fetch('/api/explorations', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ since: state.version, cities: pending })
+    })
+        .then(response => {
+            if (!response.ok) throw new Error(response.status);
+            return response.json();
+        })
+        .then(data => {
+            // 服务端版本比本地记录的还小（例如账号被重建），丢弃本地记录重新全量同步
+            if (data.version < state.version) {
+                saveExplorationState({ version: 0, cities: [], pending: pending });
+                return syncExplorations();
+            }
+            const latest = loadExplorationState();
+            const cities = new Set(state.cities);
+            data.explorations.forEach(city => cities.add(city));
+            latest.version = data.version;
+            latest.cities = Array.from(cities);
+            // 同步期间新标记的城市留到下次上传
+            latest.pending = latest.pending.filter(city => !pending.includes(city));
+            saveExplorationState(latest);
+            exploredCities = new Set(latest.cities.concat(latest.pending));
+            updateMapStyle();
+        });
+}
+
 // 加载用户探索记录
 function loadExploredCities() {
     // 首先检查用户是否登录
@@ -286,22 +348,17 @@ function loadExploredCities() {
         .then(response => response.json())
         .then(loginData => {
             if (loginData.logged_in) {
-                // 用户已登录，加载个人探索记录
-                fetch('/api/get-explorations')
-                    .then(response => response.json())
-                    .then(data => {
-                        // 直接使用API返回的数据库格式城市名称，不进行转换
-                        exploredCities = new Set(data.explorations);
-                        updateMapStyle();
-                    })
-                    .catch(error => {
-                        console.error('加载探索记录失败:', error);
-                        // 如果加载失败，使用空集合
-                        exploredCities = new Set();
-                        updateMapStyle();
-                    });
+                explorationUser = loginData.username;
+                // 先用本地缓存的记录绘制地图，再与服务端增量同步
+                const state = loadExplorationState();
+                exploredCities = new Set(state.cities.concat(state.pending));
+                updateMapStyle();
+                syncExplorations().catch(error => {
+                    console.error('同步探索记录失败:', error);
+                });
             } else {
                 // 用户未登录，使用空集合
+                explorationUser = null;
                 exploredCities = new Set();
                 updateMapStyle();
             }
@@ -316,24 +373,13 @@ function loadExploredCities() {
 
 // 重新加载探索记录并更新地图
 function reloadExploredCities() {
-    fetch('/api/get-explorations')
-        .then(response => response.json())
-        .then(data => {
-            // 将API返回的数据库格式城市名称转换为显示格式
-            const displayCities = data.explorations.map(dbName => {
-                // 如果城市名称以"闽派新语 - "开头，转换为显示格式
-                if (dbName.startsWith('闽派新语 - ')) {
-                    return dbName.replace('闽派新语 - ', '');
-                }
-                // 否则直接使用（兼容旧格式）
-                return dbName;
-            });
-            exploredCities = new Set(displayCities);
-            updateMapStyle();
-        })
-        .catch(error => {
-            console.error('重新加载探索记录失败:', error);
-        });
+    if (!explorationUser) {
+        loadExploredCities();
+        return;
+    }
+    syncExplorations().catch(error => {
+        console.error('重新加载探索记录失败:', error);
+    });
 }
 
 // 更新地图样式
@@ -358,14 +404,15 @@ function markCityExplored(cityName) {
     exploredCities.add(cityName);
     updateMapStyle();
     
-    // 保存到服务器
-    fetch('/api/mark-explored', {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ city_name: cityName })
-    }).catch(error => {
+    if (!explorationUser) return;
+    
+    // 先记入待同步列表，离线时下次同步再上传
+    const state = loadExplorationState();
+    if (!state.pending.includes(cityName)) {
+        state.pending.push(cityName);
+        saveExplorationState(state);
+    }
+    syncExplorations().catch(error => {
         console.error('保存探索记录失败:', error);
     });
 }
@@ -0,0 +1,66 @@
+"""AI回答缓存的近似命中：只差城市名的问题不能互相命中
+
+用法: python -m pytest tests/test_answer_cache.py
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('MINPAIXINYU_DATABASE', os.path.join(tempfile.mkdtemp(), 'database.db'))
+
+import migrations
+from answer_cache import AnswerCache, NgramIndex, normalize_question
+from database import get_pool
+
+
+def make_cache():
+    pool = get_pool()
+    db = pool.acquire()
+    try:
+        migrations.upgrade(db)
+        db.execute('DELETE FROM ai_answer_cache')
+        db.commit()
+    finally:
+        pool.release(db)
+    return AnswerCache(refresh_interval=0)
+
+
+def test_questions_differing_only_by_city_do_not_share_answers():
+    cache = make_cache()
+    cache.store('福州有什么好吃的', '福州鱼丸、佛跳墙')
+    cache.store('福州的人口是多少', '福州常住人口约八百万')
+
+    # 字面相似度超过默认阈值，但城市不同
+    index = NgramIndex()
+    index.add(normalize_question('福州有什么好吃的'))
+    assert index.best_match(normalize_question('泉州有什么好吃的'))[1] >= cache.similarity
+
+    assert cache.lookup('泉州有什么好吃的') is None
+    assert cache.lookup('泉州的人口是多少') is None
+    assert cache.lookup('厦门有什么好吃的？') is None
+
+
+def test_similar_question_about_same_city_still_hits():
+    cache = make_cache()
+    cache.store('福州有什么好吃的', '福州鱼丸、佛跳墙')
+
+    assert cache.lookup('請問，福州有什麼好吃的呢？') == '福州鱼丸、佛跳墙'
+    assert cache.lookup('福州有什么好吃') == '福州鱼丸、佛跳墙'
+    assert cache.stats()['similar_hits'] == 1
+
+
+def test_numbers_must_match():
+    cache = make_cache()
+    cache.store('福州2023年的人口是多少', '约八百四十万')
+
+    assert cache.lookup('福州2024年的人口是多少') is None
+
+
+def test_short_questions_need_exact_match():
+    cache = make_cache()
+    cache.store('福州美食', '福州鱼丸')
+
+    assert cache.lookup('福州美食推荐') is None
+    assert cache.lookup('福州美食') == '福州鱼丸'
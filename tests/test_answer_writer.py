@@ -0,0 +1,83 @@
+"""答题记录批量写入：无效记录只丢弃自身，逐条重写中途出错时不重复写入已提交的记录
+
+用法: python -m pytest tests/test_answer_writer.py
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('MINPAIXINYU_DATABASE', os.path.join(tempfile.mkdtemp(), 'database.db'))
+
+import migrations
+from answer_writer import AnswerWriter
+from database import get_pool
+
+USER_ID = 9001
+
+
+def setup_database():
+    pool = get_pool()
+    db = pool.acquire()
+    try:
+        migrations.upgrade(db)
+        for table in ('answer_records', 'user_stats', 'question_stats', 'user_answer_sets'):
+            db.execute(f'DELETE FROM {table}')
+        db.commit()
+    finally:
+        pool.release(db)
+
+
+def counts():
+    pool = get_pool()
+    db = pool.acquire()
+    try:
+        records = db.execute('SELECT COUNT(*) FROM answer_records WHERE user_id = ?', (USER_ID,)).fetchone()[0]
+        row = db.execute('SELECT total_answers FROM user_stats WHERE user_id = ?', (USER_ID,)).fetchone()
+        attempts = db.execute('SELECT COALESCE(SUM(attempts), 0) FROM question_stats').fetchone()[0]
+        return records, row[0] if row else 0, attempts
+    finally:
+        pool.release(db)
+
+
+def record(question_id, user_answer='A'):
+    return (USER_ID, question_id, user_answer, 1, '2024-01-01 00:00:00')
+
+
+def test_invalid_record_is_dropped_and_others_written():
+    setup_database()
+    writer = AnswerWriter()
+    writer._pending = [record(1), record(2, None), record(3)]
+    writer.flush()
+
+    assert counts() == (2, 2, 2)
+    assert writer.stats()['dropped'] == 1
+    assert writer.stats()['pending'] == 0
+
+
+def test_lock_error_during_per_record_retry_requeues_only_unwritten():
+    setup_database()
+    writer = AnswerWriter()
+    insert = writer._insert
+    calls = []
+
+    def flaky_insert(db, batch):
+        calls.append(len(batch))
+        # 第一次整批写入因无效记录失败；逐条重写到第三条时数据库被锁
+        if len(batch) == 1 and calls.count(1) == 3:
+            raise sqlite3.OperationalError('database is locked')
+        return insert(db, batch)
+
+    writer._insert = flaky_insert
+    writer._pending = [record(1), record(2, None), record(3), record(4)]
+    writer.flush()
+
+    assert counts() == (1, 1, 1)
+    assert writer._pending == [record(3), record(4)]
+
+    writer.flush()
+    assert counts() == (3, 3, 3)
+    assert writer.stats()['pending'] == 0
+    assert writer.stats()['dropped'] == 1
@@ -0,0 +1,70 @@
+"""AI问答等待上游期间不占用数据库连接：并发提问数超过连接池大小时不出现PoolTimeout
+
+用法: python -m pytest tests/test_chat_pool.py
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('MINPAIXINYU_DATABASE', os.path.join(tempfile.mkdtemp(), 'database.db'))
+
+import database
+import request_limits
+from app import app, ai_gateway
+from database import get_pool
+
+POOL_SIZE = 2
+USERS = 6
+
+app.config['TESTING'] = True
+
+
+def create_users():
+    pool = get_pool()
+    db = pool.acquire()
+    try:
+        ids = []
+        for i in range(USERS):
+            db.execute('INSERT OR IGNORE INTO users (username, password) VALUES (?, ?)', (f'pool-test-{i}', 'x'))
+            ids.append(db.execute('SELECT id FROM users WHERE username = ?', (f'pool-test-{i}',)).fetchone()[0])
+        db.execute('DELETE FROM ai_answer_cache')
+        db.commit()
+        return ids
+    finally:
+        pool.release(db)
+
+
+def test_concurrent_chat_does_not_exhaust_pool(monkeypatch):
+    database.configure_pool(dict(app.config, SQLITE_POOL_SIZE=POOL_SIZE, SQLITE_POOL_TIMEOUT=1.0))
+    monkeypatch.setattr(request_limits.limiter, 'enabled', False)
+
+    def slow_complete(messages, **kwargs):
+        time.sleep(1.5)
+        return '福州鱼丸'
+    monkeypatch.setattr(ai_gateway, 'complete', slow_complete)
+
+    user_ids = create_users()
+    results = [None] * USERS
+
+    def ask(i):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = user_ids[i]
+            sess['username'] = f'pool-test-{i}'
+        response = client.post('/api/chat', json={'question': f'第{i}个问题：福州有哪些特色小吃'})
+        results[i] = (response.status_code, response.get_json())
+
+    try:
+        threads = [threading.Thread(target=ask, args=(i,)) for i in range(USERS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        database.configure_pool(app.config)
+
+    assert all(result == (200, {'answer': '福州鱼丸'}) for result in results), results
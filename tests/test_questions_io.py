@@ -0,0 +1,20 @@
+"""题目导入导出：PATH为 - 时用完不关闭进程的标准输出
+
+用法: python -m pytest tests/test_questions_io.py
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from questions_io import open_text
+
+
+def test_closing_stdout_wrapper_keeps_stdout_open(capfd):
+    with open_text('-', 'w') as f:
+        f.write('福州,鼓浪屿\n')
+    assert not sys.stdout.closed
+    assert not sys.stdout.buffer.closed
+    print('导出之后')
+    assert capfd.readouterr().out == '福州,鼓浪屿\n导出之后\n'
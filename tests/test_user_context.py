@@ -0,0 +1,34 @@
+"""登录用户缓存命中时不占用数据库连接
+
+用法: python -m pytest tests/test_user_context.py
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('MINPAIXINYU_DATABASE', os.path.join(tempfile.mkdtemp(), 'database.db'))
+
+from flask import g, session
+
+from app import app
+from user_context import CurrentUser, load_user, user_cache
+
+app.config['TESTING'] = True
+
+
+def test_cached_user_does_not_take_a_connection():
+    user_cache.put(CurrentUser(4242, 'cached-user', 'x', None))
+    with app.test_request_context('/'):
+        session['user_id'] = 4242
+        assert load_user().username == 'cached-user'
+        assert '_database' not in g
+
+
+def test_cache_miss_reads_database():
+    user_cache.invalidate(4243)
+    with app.test_request_context('/'):
+        session['user_id'] = 4243
+        assert load_user() is None
+        assert '_database' in g
@@ -0,0 +1,171 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, jsonify, redirect, session, url_for
+from werkzeug.local import LocalProxy
+
+from database import get_db
+
+# 默认配置，可在app.config中覆盖
+USER_CONTEXT_DEFAULTS = {
+    # 进程内缓存用户信息的秒数，多进程部署时其它进程的修改最多延迟这么久可见，为0时不缓存
+    'USER_CACHE_TTL': 5.0,
+    'USER_CACHE_SIZE': 5000,
+}
+
+# 不读取旧版遗留的 avatar_blob 列
+USER_COLUMNS = 'id, username, password, avatar_hash'
+
+
+class CurrentUser:
+    """已登录用户的基本信息"""
+
+    __slots__ = ('id', 'username', 'password', 'avatar_hash')
+
+    def __init__(self, id, username, password, avatar_hash):
+        self.id = id
+        self.username = username
+        self.password = password
+        self.avatar_hash = avatar_hash
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row['id'], row['username'], row['password'], row['avatar_hash'])
+
+
+class UserCache:
+    """按用户id缓存CurrentUser的短期LRU缓存
+
+    本进程内修改密码、上传头像、注销账号时会立即失效；其它进程的修改在ttl秒后可见。
+    """
+
+    def __init__(self, ttl=5.0, max_entries=5000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, user_id):
+        """只查进程内缓存，未命中或已过期时返回None，不访问数据库"""
+        if self.ttl <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+        return None
+
+    def load(self, db, user_id):
+        """从数据库读取用户信息并放入缓存，用户不存在时返回None"""
+        with self._lock:
+            self.misses += 1
+        row = db.execute(f'SELECT {USER_COLUMNS} FROM users WHERE id = ?', (user_id,)).fetchone()
+        if row is None:
+            self.invalidate(user_id)
+            return None
+        user = CurrentUser.from_row(row)
+        self.put(user)
+        return user
+
+    def put(self, user):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'ttl': self.ttl,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+user_cache = UserCache()
+
+
+def load_user(refresh=False):
+    """当前请求的登录用户，未登录或账号已不存在时返回None，同一请求内只解析一次"""
+    if not refresh and '_current_user' in g:
+        return g._current_user
+    user_id = session.get('user_id')
+    user = None
+    if user_id is not None:
+        # 缓存命中时不取数据库连接，避免整个请求（包括等待上游AI回答）都占着一个连接
+        if not refresh:
+            user = user_cache.cached(user_id)
+        if user is None:
+            user = user_cache.load(get_db(), user_id)
+        if user is None:
+            # 账号已在其它会话中注销
+            session.clear()
+    g._current_user = user
+    return user
+
+
+current_user = LocalProxy(load_user)
+
+
+def login_user(user):
+    session['user_id'] = user.id
+    session['username'] = user.username
+    user_cache.put(user)
+    g._current_user = user
+
+
+def logout_user():
+    session.clear()
+    g._current_user = None
+
+
+def invalidate_user(user_id):
+    """用户信息在本请求中被修改后调用，下一次读取会重新查询数据库"""
+    user_cache.invalidate(user_id)
+    g.pop('_current_user', None)
+
+
+def login_required(view=None, *, error='未登录', redirect_to=None):
+    """未登录时返回401的JSON错误，或跳转到redirect_to指定的页面
+
+    可以直接用作 @login_required，也可以带参数 @login_required(redirect_to='login')。
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if load_user() is None:
+                if redirect_to:
+                    return redirect(url_for(redirect_to))
+                return jsonify({'error': error}), 401
+            return view(*args, **kwargs)
+        return wrapped
+
+    return decorator(view) if view is not None else decorator
+
+
+def init_app(app):
+    for key, value in USER_CONTEXT_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    user_cache.ttl = app.config['USER_CACHE_TTL']
+    user_cache.max_entries = app.config['USER_CACHE_SIZE']
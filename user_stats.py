@@ -0,0 +1,145 @@
+import json
+from collections import defaultdict
+
+import click
+from flask.cli import AppGroup
+
+CITY_PREFIX = '闽派新语 - '
+
+
+def normalize_city_name(city_name):
+    # 转换格式：从"闽派新语 - 福州"到"福州"
+    if city_name.startswith(CITY_PREFIX):
+        return city_name.replace(CITY_PREFIX, '')
+    return city_name
+
+
+def record_answers(db, records):
+    """按用户汇总一批答题记录并累加到user_stats，需在写入answer_records的同一事务中调用
+
+    records 的每一项为 (user_id, question_id, user_answer, is_correct, answered_at)
+    """
+    totals = defaultdict(lambda: [0, 0, ''])
+    for user_id, _question_id, _user_answer, is_correct, answered_at in records:
+        item = totals[user_id]
+        item[0] += 1
+        item[1] += 1 if is_correct else 0
+        item[2] = max(item[2], answered_at)
+
+    db.executemany("""
+        INSERT INTO user_stats (user_id, total_answers, correct_answers, last_activity_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            total_answers = total_answers + excluded.total_answers,
+            correct_answers = correct_answers + excluded.correct_answers,
+            last_activity_at = MAX(COALESCE(last_activity_at, ''), excluded.last_activity_at)
+    """, [(user_id, total, correct, last) for user_id, (total, correct, last) in totals.items()])
+
+
+def record_explorations(db, user_id, city_names):
+    """新增若干条探索记录后更新探索数和已探索城市列表，需在写入city_explorations的同一事务中调用"""
+    if not city_names:
+        return
+    row = db.execute('SELECT explored_cities FROM user_stats WHERE user_id = ?', (user_id,)).fetchone()
+    cities = json.loads(row['explored_cities']) if row and row['explored_cities'] else []
+    for city_name in city_names:
+        name = normalize_city_name(city_name)
+        if name not in cities:
+            cities.append(name)
+
+    db.execute("""
+        INSERT INTO user_stats (user_id, exploration_count, explored_cities, last_activity_at)
+        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(user_id) DO UPDATE SET
+            exploration_count = exploration_count + excluded.exploration_count,
+            explored_cities = excluded.explored_cities,
+            last_activity_at = CURRENT_TIMESTAMP
+    """, (user_id, len(city_names), json.dumps(cities, ensure_ascii=False)))
+
+
+def delete_user(db, user_id):
+    db.execute('DELETE FROM user_stats WHERE user_id = ?', (user_id,))
+
+
+def get_user_stats(db, user_id):
+    row = db.execute(
+        'SELECT total_answers, correct_answers, exploration_count, explored_cities, last_activity_at '
+        'FROM user_stats WHERE user_id = ?', (user_id,)
+    ).fetchone()
+    if row is None:
+        return {
+            'total_answers': 0,
+            'correct_answers': 0,
+            'exploration_count': 0,
+            'explored_cities': set(),
+            'last_activity_at': None
+        }
+    return {
+        'total_answers': row['total_answers'],
+        'correct_answers': row['correct_answers'],
+        'exploration_count': row['exploration_count'],
+        'explored_cities': set(json.loads(row['explored_cities'] or '[]')),
+        'last_activity_at': row['last_activity_at']
+    }
+
+
+def backfill(db):
+    """根据answer_records和city_explorations重新计算全部用户的统计数据"""
+    count = _rebuild(db, '', ())
+    db.commit()
+    return count
+
+
+def rebuild_users(db, first, last):
+    """重新计算 first <= user_id < last 的用户统计，由调用方控制事务"""
+    return _rebuild(db, 'WHERE user_id >= ? AND user_id < ?', (first, last))
+
+
+def _rebuild(db, where, params):
+    stats = defaultdict(lambda: {'total': 0, 'correct': 0, 'explorations': 0, 'cities': [], 'last': None})
+
+    for row in db.execute(f"""
+        SELECT user_id, COUNT(*) AS total, SUM(is_correct) AS correct, MAX(answered_at) AS last
+        FROM answer_records {where} GROUP BY user_id
+    """, params):
+        item = stats[row['user_id']]
+        item['total'] = row['total']
+        item['correct'] = row['correct'] or 0
+        item['last'] = row['last']
+
+    for row in db.execute(f'SELECT user_id, city_name, explored_at FROM city_explorations {where} ORDER BY explored_at',
+                          params):
+        item = stats[row['user_id']]
+        item['explorations'] += 1
+        name = normalize_city_name(row['city_name'])
+        if name not in item['cities']:
+            item['cities'].append(name)
+        if item['last'] is None or row['explored_at'] > item['last']:
+            item['last'] = row['explored_at']
+
+    db.execute(f'DELETE FROM user_stats {where}', params)
+    db.executemany("""
+        INSERT INTO user_stats (user_id, total_answers, correct_answers, exploration_count,
+                                explored_cities, last_activity_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [
+        (user_id, item['total'], item['correct'], item['explorations'],
+         json.dumps(item['cities'], ensure_ascii=False), item['last'])
+        for user_id, item in stats.items()
+    ])
+    return len(stats)
+
+
+stats_cli = AppGroup('stats', help='用户统计数据维护')
+
+
+@stats_cli.command('backfill')
+def backfill_command():
+    """根据历史记录重建user_stats表"""
+    from database import get_db
+    count = backfill(get_db())
+    click.echo(f'已重建 {count} 个用户的统计数据')
+
+
+def init_app(app):
+    app.cli.add_command(stats_cli)